@@ -15,12 +15,11 @@ rule bwa_index:
     threads:
         1
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 8192 + 2048, 20480)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 120, 480)
-        )
+        mem_mb = get_resource("bwa_index", "mem_mb"),
+        runtime = get_resource("bwa_index", "time_min")
+    benchmark:
+        "benchmarks/bwa_index/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
     version: swv
     log:
         "logs/bwa/index.log"
@@ -31,7 +30,8 @@ rule bwa_index:
 
 
 """
-This rule performs the actual bwa mem mapping
+This rule performs the actual bwa mem mapping, coordinate sorted with
+Picard SortSam
 """
 rule bwa_mem:
     input:
@@ -42,26 +42,336 @@ rule bwa_mem:
             ext=["amb", "ann", "bwt", "pac"]
         )
     output:
-        temp("bwa/mapping/{sample}.bam")
+        temp("bwa/mapping/{sample}.bam"),
+        **get_telemetry_output("bwa_mem", "sample")
     message:
         "Mapping {wildcards.sample} with BWA mem"
     threads:
-        min(config["threads"], 12)
+        get_threads("bwa_mem")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 8192 + 2048, 20480)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 120, 480)
-        )
-    version: swv
+        mem_mb = get_resource("bwa_mem", "mem_mb"),
+        runtime = get_resource("bwa_mem", "time_min")
+    benchmark:
+        "benchmarks/bwa_mem/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
     params:
+        telemetry = get_telemetry("bwa_mem"),
+        scratch = get_scratch("bwa_mem", "reads"),
         index = f"bwa/index/{os.path.basename(refs_pack_dict['fasta'])}",
         extra = config['params'].get('bwa_map_extra', ""),
-        sort = "picard",
-        sort_order = "coordinate",
         sort_extra = config['params'].get('picard_sort_sam_extra', "")
+    wildcard_constraints:
+        sample = used_when(
+            aligner == "bwa" and config.get("mapping_chunk_reads", 0) == 0
+        )
     log:
         "logs/bwa_mem_{sample}.log"
-    wrapper:
-        f"{swv}/bio/bwa/mem"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}bwa mem -t {threads} {params.extra} "
+        "{params.index} {input.reads} "
+        "| picard SortSam {params.sort_extra} INPUT=/dev/stdin "
+        "OUTPUT={output[0]} SORT_ORDER=coordinate TMP_DIR=$scratch) "
+        "> {log} 2>&1"
+
+
+"""
+This rule uses bwa-mem2 to index a fasta formatted genome sequence. The
+bwa-mem2 version is recorded along with the index, since its index format
+changes between versions.
+"""
+rule bwa_mem2_index:
+    input:
+        refs_pack_dict['fasta']
+    output:
+        expand(
+            "bwa-mem2/index/{genome}.{ext}",
+            genome=os.path.basename(refs_pack_dict["fasta"]),
+            ext=aligner_index_ext["bwa-mem2"]
+        ),
+        version = (
+            f"bwa-mem2/index/{os.path.basename(refs_pack_dict['fasta'])}"
+            ".version"
+        ),
+        **get_telemetry_output("bwa_mem2_index")
+    message:
+        "Indexing {input} with bwa-mem2"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("bwa_mem2_index", "mem_mb"),
+        runtime = get_resource("bwa_mem2_index", "time_min")
+    benchmark:
+        "benchmarks/bwa_mem2_index/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    log:
+        "logs/bwa/index_mem2.log"
+    params:
+        telemetry = get_telemetry("bwa_mem2_index"),
+        prefix = (
+            f"bwa-mem2/index/{os.path.basename(refs_pack_dict['fasta'])}"
+        ),
+        extra = config['params'].get('bwa_index_extra', "")
+    shell:
+        "{params.telemetry}"
+        "(bwa-mem2 index {params.extra} -p {params.prefix} {input} "
+        "&& bwa-mem2 version > {output.version}) > {log} 2>&1"
+
+
+"""
+This rule performs the actual mapping with bwa-mem2. Alignments are
+identical to the bwa mem ones, and coordinate sorted as well.
+"""
+rule bwa_mem2:
+    input:
+        unpack(fq_pairs_w),
+        **aligner_index_dict
+    output:
+        temp("bwa/mapping/{sample}.bam"),
+        **get_telemetry_output("bwa_mem2", "sample")
+    message:
+        "Mapping {wildcards.sample} with bwa-mem2"
+    threads:
+        get_threads("bwa_mem2")
+    resources:
+        mem_mb = get_resource("bwa_mem2", "mem_mb", get_sort_buffer()),
+        runtime = get_resource("bwa_mem2", "time_min")
+    benchmark:
+        "benchmarks/bwa_mem2/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    params:
+        telemetry = get_telemetry("bwa_mem2"),
+        scratch = get_scratch("bwa_mem2", "reads"),
+        check = get_aligner_check(),
+        index = get_aligner_prefix(),
+        extra = config['params'].get('bwa_map_extra', ""),
+        sort_memory = get_sort_memory
+    wildcard_constraints:
+        sample = used_when(
+            aligner == "bwa-mem2"
+            and config.get("mapping_chunk_reads", 0) == 0
+        )
+    log:
+        "logs/bwa_mem2_{sample}.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}{params.check}bwa-mem2 mem -t {threads} "
+        "{params.extra} {params.index} {input.reads} "
+        "| samtools sort -@ {threads} -m {params.sort_memory} "
+        "-T $scratch/sort -o {output[0]} -) > {log} 2>&1"
+
+
+"""
+This rule streams bwa mem mapping through fixmate, unmapped reads filtering
+and a single coordinate sort. Read groups are set at mapping time, so only
+one BAM is written per sample. It replaces the chain from bwa_mem to
+picard_add_or_replace_group when workflow/fused_mapping is set.
+"""
+rule bwa_mem_fused:
+    input:
+        unpack(fq_pairs_w),
+        **aligner_index_dict,
+        **cram_reference_dict,
+        **target_filter_dict
+    output:
+        temp(f"picard/groups/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("bwa_mem_fused", "sample")
+    message:
+        "Mapping, fixing mates and sorting {wildcards.sample} in one stream"
+    threads:
+        get_threads(get_aligner_stage("bwa_mem_fused"))
+    resources:
+        mem_mb = get_resource(
+            get_aligner_stage("bwa_mem_fused"), "mem_mb", get_sort_buffer()
+        ),
+        runtime = get_resource(get_aligner_stage("bwa_mem_fused"), "time_min")
+    benchmark:
+        f"benchmarks/{get_aligner_stage('bwa_mem_fused')}/"
+        "{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    params:
+        telemetry = get_telemetry("bwa_mem_fused"),
+        scratch = get_scratch("bwa_mem_fused", "reads"),
+        aligner = aligner,
+        check = get_aligner_check(),
+        index = get_aligner_prefix(),
+        extra = config['params'].get('bwa_map_extra', ""),
+        read_group = lambda wildcards: get_read_group(wildcards),
+        fixmate = config["params"].get("samtools_fixmate_extra", ""),
+        view = get_samtools_view(),
+        sort_memory = get_sort_memory,
+        fmt = get_samtools_format()
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_mapping", False) is True
+            and config.get("mapping_chunk_reads", 0) == 0
+        )
+    log:
+        "logs/bwa_mem_fused_{sample}.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}{params.check}{params.aligner} mem -t {threads} "
+        "{params.extra} -R '{params.read_group}' {params.index} {input.reads} "
+        "| samtools fixmate {params.fixmate} - - "
+        "| samtools view {params.view} -u - "
+        "| samtools sort -@ {threads} -m {params.sort_memory} "
+        "-T $scratch/sort {params.fmt} -o {output[0]} -) > {log} 2>&1"
+
+
+"""
+This checkpoint splits the fastq files of a sample into chunks of a fixed
+number of reads. Mates are split with the same line count, so chunk N of
+the upstream file always pairs with chunk N of the downstream file.
+"""
+checkpoint split_fastq:
+    input:
+        unpack(fq_pairs_w)
+    output:
+        temp(directory("bwa/chunks/{sample}/reads")),
+        **get_telemetry_output("split_fastq", "sample")
+    message:
+        "Splitting {wildcards.sample} into chunks of {params.reads} reads"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("split_fastq", "mem_mb"),
+        runtime = get_resource("split_fastq", "time_min")
+    benchmark:
+        "benchmarks/split_fastq/{sample}.tsv"
+    version: "1.0"
+    wildcard_constraints:
+        sample = r"[^/]+"
+    params:
+        telemetry = get_telemetry("split_fastq"),
+        reads = config.get("mapping_chunk_reads", 0),
+        lines = config.get("mapping_chunk_reads", 0) * 4
+    log:
+        "logs/bwa/split_{sample}.log"
+    shell:
+        "{params.telemetry}"
+        "(mkdir -p {output[0]} && mate=1 && for fq in {input.reads}; do "
+        "gzip -cdf ${{fq}} "
+        "| split -l {params.lines} -d -a 4 --additional-suffix .fastq.gz "
+        "--filter 'gzip -1 > $FILE' - {output[0]}/${{mate}}. ; "
+        "mate=$((mate + 1)); done) > {log} 2>&1"
+
+
+"""
+This rule maps one chunk of reads with bwa mem. All chunks of a sample
+share the same read group. In fused mapping mode, the chunk is also mate
+fixed and filtered before being sorted.
+"""
+rule bwa_mem_chunk:
+    input:
+        unpack(get_chunk_reads),
+        **aligner_index_dict,
+        **target_filter_dict
+    output:
+        temp("bwa/chunks/{sample}/{chunk}.bam"),
+        **get_telemetry_output("bwa_mem_chunk", "sample", "chunk")
+    message:
+        "Mapping chunk {wildcards.chunk} of {wildcards.sample} with BWA mem"
+    threads:
+        get_threads(get_aligner_stage("bwa_mem_chunk"))
+    resources:
+        mem_mb = get_resource(
+            get_aligner_stage("bwa_mem_chunk"), "mem_mb", get_sort_buffer()
+        ),
+        runtime = get_resource(get_aligner_stage("bwa_mem_chunk"), "time_min")
+    benchmark:
+        f"benchmarks/{get_aligner_stage('bwa_mem_chunk')}/"
+        "{sample}/{chunk}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    wildcard_constraints:
+        sample = r"[^/]+",
+        chunk = r"\d+"
+    params:
+        telemetry = get_telemetry("bwa_mem_chunk"),
+        scratch = get_scratch("bwa_mem_chunk", "reads"),
+        aligner = aligner,
+        check = get_aligner_check(),
+        index = get_aligner_prefix(),
+        extra = config['params'].get('bwa_map_extra', ""),
+        read_group = lambda wildcards: get_read_group(wildcards),
+        fused = (
+            f"| samtools fixmate "
+            f"{config['params'].get('samtools_fixmate_extra', '')} - - "
+            f"| samtools view {get_samtools_view()} -u - "
+            if config["workflow"].get("fused_mapping", False) is True
+            else ""
+        ),
+        sort_memory = get_sort_memory
+    log:
+        "logs/bwa/mem_{sample}.{chunk}.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}{params.check}{params.aligner} mem -t {threads} "
+        "{params.extra} -R '{params.read_group}' {params.index} {input.reads} "
+        "{params.fused}"
+        "| samtools sort -@ {threads} -m {params.sort_memory} "
+        "-T $scratch/sort -o {output[0]} -) > {log} 2>&1"
+
+
+"""
+This rule maps one lane of a sample sequenced on several lanes. Each lane
+gets its own read group. Lanes are mate fixed, filtered and sorted in the
+same stream, then merged by samtools_merge_lanes before duplicates marking.
+"""
+rule bwa_mem_lane:
+    input:
+        unpack(fq_pairs_w),
+        **aligner_index_dict,
+        **target_filter_dict
+    output:
+        temp("bwa/lanes/{sample}/{lane}.bam"),
+        **get_telemetry_output("bwa_mem_lane", "sample", "lane")
+    message:
+        "Mapping lane {wildcards.lane} of {wildcards.sample} with BWA mem"
+    threads:
+        get_threads(get_aligner_stage("bwa_mem_lane"))
+    resources:
+        mem_mb = get_resource(
+            get_aligner_stage("bwa_mem_lane"), "mem_mb", get_sort_buffer()
+        ),
+        runtime = get_resource(get_aligner_stage("bwa_mem_lane"), "time_min")
+    benchmark:
+        f"benchmarks/{get_aligner_stage('bwa_mem_lane')}/"
+        "{sample}/{lane}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    wildcard_constraints:
+        sample = r"[^/]+",
+        lane = r"[^/]+"
+    params:
+        telemetry = get_telemetry("bwa_mem_lane"),
+        scratch = get_scratch("bwa_mem_lane", "reads"),
+        aligner = aligner,
+        check = get_aligner_check(),
+        index = get_aligner_prefix(),
+        extra = config['params'].get('bwa_map_extra', ""),
+        read_group = lambda wildcards: get_read_group(wildcards),
+        fixmate = config["params"].get("samtools_fixmate_extra", ""),
+        view = get_samtools_view(),
+        sort_memory = get_sort_memory
+    log:
+        "logs/bwa/lane_{sample}.{lane}.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}{params.check}{params.aligner} mem -t {threads} "
+        "{params.extra} -R '{params.read_group}' {params.index} {input.reads} "
+        "| samtools fixmate {params.fixmate} - - "
+        "| samtools view {params.view} -u - "
+        "| samtools sort -@ {threads} -m {params.sort_memory} "
+        "-T $scratch/sort -o {output[0]} -) > {log} 2>&1"
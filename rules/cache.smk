@@ -0,0 +1,218 @@
+"""
+These rules replace reference indexation when a persistent reference_cache
+is provided. Indexes are keyed by the content of the indexed file, the
+pinned tools versions and the build command. They are built once under a
+lock, then linked into every working directory.
+More information with:
+python3 scripts/reference_cache.py --help
+"""
+rule cache_bwa_index:
+    input:
+        ref_link_dict[op.basename(refs_pack_dict["fasta"])]
+    output:
+        **aligner_index_dict,
+        **get_telemetry_output("cache_bwa_index")
+    message:
+        "Fetching {params.aligner} indexes from the reference cache"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource(get_aligner_stage("cache_bwa_index"), "mem_mb"),
+        runtime = get_resource(
+            get_aligner_stage("cache_bwa_index"), "time_min"
+        )
+    benchmark:
+        f"benchmarks/{get_aligner_stage('cache_bwa_index')}/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/reference_cache.yaml"
+    log:
+        "logs/cache/bwa_index.log"
+    params:
+        telemetry = get_telemetry("cache_bwa_index"),
+        cache = config.get("reference_cache", ""),
+        script = cache_script,
+        tools = cache_tools,
+        aligner = aligner,
+        command = lambda wildcards: (
+            f"{aligner} index "
+            f"{config['params'].get('bwa_index_extra', '')} "
+            f"-p {{outdir}}/{os.path.basename(refs_pack_dict['fasta'])} "
+            "{source}"
+        ) + (
+            f" && bwa-mem2 version > {{outdir}}/"
+            f"{op.basename(aligner_index_dict['version'])}"
+            if aligner == "bwa-mem2" else ""
+        ),
+        outputs = lambda wildcards, output: " ".join(
+            output.index + ([output.version] if aligner == "bwa-mem2" else [])
+        )
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} --cache {params.cache} fetch "
+        "--source {input} --tool-file {params.tools} "
+        "--command {params.command:q} --outputs {params.outputs} "
+        "> {log} 2>&1"
+
+
+rule cache_samtools_faidx:
+    input:
+        ref_link_dict[op.basename(refs_pack_dict["fasta"])]
+    output:
+        refs_pack_dict["faidx"],
+        **get_telemetry_output("cache_samtools_faidx")
+    message:
+        "Fetching the genome fasta index from the reference cache"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("cache_samtools_faidx", "mem_mb"),
+        runtime = get_resource("cache_samtools_faidx", "time_min")
+    benchmark:
+        "benchmarks/cache_samtools_faidx/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/reference_cache.yaml"
+    log:
+        "logs/cache/faidx.log"
+    params:
+        telemetry = get_telemetry("cache_samtools_faidx"),
+        cache = config.get("reference_cache", ""),
+        script = cache_script,
+        tools = cache_tools,
+        command = lambda wildcards: (
+            f"ln -s {{source}} {{outdir}}/{op.basename(get_fasta_path())} && "
+            f"samtools faidx "
+            f"{config['params'].get('samtools_faidx_extra', '')} "
+            f"{{outdir}}/{op.basename(get_fasta_path())}"
+        )
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} --cache {params.cache} fetch "
+        "--source {input} --tool-file {params.tools} "
+        "--command {params.command:q} --outputs {output[0]} > {log} 2>&1"
+
+
+rule cache_sequence_dictionnary:
+    input:
+        ref_link_dict[op.basename(refs_pack_dict["fasta"])]
+    output:
+        refs_pack_dict["fadict"],
+        **get_telemetry_output("cache_sequence_dictionnary")
+    message:
+        "Fetching the sequence dictionnary from the reference cache"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("cache_sequence_dictionnary", "mem_mb"),
+        runtime = get_resource("cache_sequence_dictionnary", "time_min")
+    benchmark:
+        "benchmarks/cache_sequence_dictionnary/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/reference_cache.yaml"
+    log:
+        "logs/cache/sequence_dictionnary.log"
+    params:
+        telemetry = get_telemetry("cache_sequence_dictionnary"),
+        cache = config.get("reference_cache", ""),
+        script = cache_script,
+        tools = cache_tools,
+        command = lambda wildcards: (
+            f"picard CreateSequenceDictionary R={{source}} "
+            f"O={{outdir}}/{op.basename(get_sequence_dict_path())} "
+            f"{config['params'].get('picard_sequence_dict_extra', '')}"
+        )
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} --cache {params.cache} fetch "
+        "--source {input} --tool-file {params.tools} "
+        "--command {params.command:q} --outputs {output[0]} > {log} 2>&1"
+
+
+rule cache_vcf_index_tbi:
+    input:
+        lambda wildcards: ref_link_dict[f"{wildcards.file}.vcf.gz"]
+    output:
+        "genome/{file}.vcf.gz.tbi",
+        **get_telemetry_output("cache_vcf_index_tbi", "file")
+    message:
+        "Fetching {wildcards.file} VCF index from the reference cache"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("cache_vcf_index_tbi", "mem_mb"),
+        runtime = get_resource("cache_vcf_index_tbi", "time_min")
+    benchmark:
+        "benchmarks/cache_vcf_index_tbi/{file}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/reference_cache.yaml"
+    log:
+        "logs/cache/{file}.tbi.log"
+    wildcard_constraints:
+        file = r"[^/]+"
+    params:
+        telemetry = get_telemetry("cache_vcf_index_tbi"),
+        cache = config.get("reference_cache", ""),
+        script = cache_script,
+        tools = cache_tools,
+        command = lambda wildcards: (
+            f"ln -s {{source}} {{outdir}}/{wildcards.file}.vcf.gz && "
+            f"bcftools index --tbi "
+            f"{config['params'].get('bcftools_index', '')} "
+            f"{{outdir}}/{wildcards.file}.vcf.gz"
+        )
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} --cache {params.cache} fetch "
+        "--source {input} --tool-file {params.tools} "
+        "--command {params.command:q} --outputs {output[0]} > {log} 2>&1"
+
+
+rule cache_compact_known_sites:
+    input:
+        vcf = lambda wildcards: ref_link_dict[f"{wildcards.file}.vcf.gz"],
+        regions = refs_pack_dict.get("known_regions", [])
+    output:
+        vcf = "genome/compact/{file}.vcf.gz",
+        index = "genome/compact/{file}.vcf.gz.tbi",
+        **get_telemetry_output("cache_compact_known_sites", "file")
+    message:
+        "Fetching {wildcards.file} compacted known sites from the "
+        "reference cache"
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("cache_compact_known_sites", "mem_mb"),
+        runtime = get_resource("cache_compact_known_sites", "time_min")
+    benchmark:
+        "benchmarks/cache_compact_known_sites/{file}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/reference_cache.yaml"
+    log:
+        "logs/cache/compact/{file}.log"
+    wildcard_constraints:
+        file = r"[^/]+"
+    params:
+        telemetry = get_telemetry("cache_compact_known_sites"),
+        cache = config.get("reference_cache", ""),
+        script = cache_script,
+        tools = cache_tools,
+        command = lambda wildcards: (
+            "bcftools view --targets-file {depends} --drop-genotypes "
+            "--output-type u {source} "
+            "| bcftools annotate --remove INFO --output-type z "
+            f"--output-file {{outdir}}/{wildcards.file}.vcf.gz && "
+            f"bcftools index --tbi {{outdir}}/{wildcards.file}.vcf.gz"
+        )
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} --cache {params.cache} fetch "
+        "--source {input.vcf} --depends {input.regions} "
+        "--tool-file {params.tools} --command {params.command:q} "
+        "--outputs {output.vcf} {output.index} > {log} 2>&1"
@@ -5,22 +5,73 @@ validations.
 """
 
 from snakemake.utils import validate, makedirs
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import os.path as op    # Path and file system manipulation
 import os               # OS related operations
 import pandas as pd     # Deal with TSV files (design)
+import re               # Regular expressions
 import sys              # System related operations
+import yaml             # Deal with YAML files (resources model)
 
 # Snakemake-Wrappers version
 swv = "https://raw.githubusercontent.com/snakemake/snakemake-wrappers/0.51.0"
 # github prefix
 git = "https://raw.githubusercontent.com/tdayris/snakemake-wrappers/Unofficial"
+# Input files staging
+stage_script = op.join(workflow.basedir, "scripts", "stage.py")
+# Samtools markdup statistics converter
+markdup_script = op.join(workflow.basedir, "scripts", "markdup_to_picard.py")
+# Reference cache manager and the pinned tools used to build cached indexes
+cache_script = op.join(workflow.basedir, "scripts", "reference_cache.py")
+cache_tools = op.join(workflow.basedir, "envs", "reference_cache.yaml")
+# Per-sample quality control records, gathered into cohort tables
+records_script = op.join(workflow.basedir, "scripts", "qc_records.py")
+# Jobs resources usage sampler and summarizer
+telemetry_script = op.join(workflow.basedir, "scripts", "telemetry.py")
 
 # Loading configuration
 configfile: "config.yaml"
 validate(config, schema="../schemas/config.schema.yaml")
 
+# Snakemake-Wrappers may be read from a local copy of the same version,
+# e.g. file:///path/to/snakemake-wrappers, to run offline
+swv = config.get("wrappers_prefix", "") or swv
+
+# Samtools markdup relies on mate scores added by fixmate
+if config.get("dedup_backend", "picard") == "samtools":
+    if "-m" not in config["params"].get("samtools_fixmate_extra", "").split():
+        raise ValueError(
+            "samtools markdup requires mate scores: "
+            "add -m to samtools_fixmate_extra"
+        )
+
+# Alignment files format: CRAM files are compressed against the reference
+aln_ext = config.get("alignment_format", "bam")
+aln_index_ext = "cram.crai" if aln_ext == "cram" else "bam.bai"
+
+# Scratch directory for sort, Picard and GATK spill files. It may name an
+# environment variable of the compute nodes, e.g. $TMPDIR, expanded by jobs.
+scratch_dir = config.get("scratch_dir", "") or "tmp"
+
+# Seconds between two samples of jobs resources usage, 0 disables telemetry
+telemetry_interval = config.get("telemetry_interval", 0)
+
+# Short reads aligner engine: bwa-mem2 builds and reads its own index files
+aligner = config.get("aligner", "bwa")
+aligner_index_ext = {
+    "bwa": ["amb", "ann", "bwt", "pac"],
+    "bwa-mem2": ["0123", "amb", "ann", "bwt.2bit.64", "pac"]
+}
+
+# Loading per-rule resources model
+resources_model_path = (
+    config.get("resources_model", "")
+    or op.join(workflow.basedir, "resources.yaml")
+)
+with open(resources_model_path) as resources_model_stream:
+    resources_model = yaml.safe_load(resources_model_stream)
+
 # Loading deisgn file
 design = pd.read_csv(
     config["design"],
@@ -29,65 +80,71 @@ design = pd.read_csv(
     index_col=None,
     dtype=str
 )
-design.set_index(design["Sample_id"])
 validate(design, schema="../schemas/design.schema.yaml")
 
+# Loading the optional fastq manifest written by prepare_design.py
+manifest_path = op.join(op.dirname(config["design"]), "manifest.tsv")
+manifest = None
+if op.exists(manifest_path):
+    manifest = pd.read_csv(
+        manifest_path,
+        sep="\t",
+        header=0,
+        index_col=None
+    )
+    validate(manifest, schema="../schemas/manifest.schema.yaml")
+
 report: "../report/general.rst"
 
 
-def fq_link() -> Dict[str, str]:
+def fq_tables() -> Tuple[Dict[str, str],
+                         Dict[str, str],
+                         Dict[str, Dict[str, List[str]]]]:
     """
-    This function takes the "samples" described in config and returns
-    a dictionnary with:
+    This function reads the design once, and returns the three fastq
+    lookup tables at the same time:
     sample file name : sample path
+    sample name : sample link path
+    sample id : lane : sample link paths, upstream files first
+    Samples sequenced on a single lane have a single entry.
     """
+    # For now, bz2 compression is not taken into account.
+    possible_ext = re.compile(r"\.f(ast)?q(\.gz)?$")
+
     # Will cause KeyError on single stranded RNA-Seq analysis
     # Better ask forgiveness than permission !
     try:
-        # Paired-ended case
-        fq_list = chain(design["Upstream_file"], design["Downstream_file"])
+        # Paired end case
+        mates = zip(design["Upstream_file"], design["Downstream_file"])
     except KeyError:
-        # Single ended case
-        fq_list = design["Upstream_file"]
-    finally:
-        return {
-            op.basename(fq): op.realpath(fq)
-            for fq in fq_list
-        }
+        # Single end case
+        mates = zip(design["Upstream_file"])
 
+    lanes = (
+        design["Lane"].fillna("")
+        if "Lane" in design.columns
+        else [""] * len(design)
+    )
 
-def fq_root() -> Dict[str, str]:
-    """
-    This function takes the fastq file list and returns the root
-    name corresponding to a fastq file
-    sample name: sample link path
-    """
-    # For now, bz2 compression is not taken into account.
-    possible_ext = (".fq", ".fastq", ".fq.gz", ".fastq.gz")
+    links, roots, pairs = {}, {}, {}
+    for name, lane, fastq in zip(design["Sample_id"], lanes, mates):
+        sample_lanes = pairs.setdefault(name, {})
+        lane = lane or str(len(sample_lanes) + 1)
+        if lane in sample_lanes:
+            raise ValueError(f"Lane {lane} of {name} is listed twice")
+        sample_lanes[lane] = []
 
-    # Will cause KeyError on single stranded RNA-Seq analysis
-    # Better ask forgiveness than permission !
-    try:
-        # Paired-ended case
-        fq_list = chain(design["Upstream_file"], design["Downstream_file"])
-    except KeyError:
-        # Single ended case
-        fq_list = design["Upstream_file"]
-
-    # Build final result
-    result = {}
-    for fq in fq_list:
-        # I always love writing these crazy for-break-else!
-        for ext in possible_ext:
-            if fq.endswith(ext):
-                # Extension removal
-                base = op.basename(fq)[:-(len(ext) + 1)]
-                result[base] = f"raw_data/{op.basename(fq)}"
-                break
-        else:
-            raise ValueError(f"Could not remove ext: {fq}")
+        for fq in fastq:
+            base = op.basename(fq)
+            ext = possible_ext.search(base)
+            if ext is None:
+                raise ValueError(f"Could not remove ext: {fq}")
+            links[base] = op.realpath(fq)
+            # Extension removal
+            roots[base[:-len(ext.group(0))]] = f"raw_data/{base}"
+            sample_lanes[lane].append(f"raw_data/{base}")
 
-    return result
+    return links, roots, pairs
 
 
 def get_sequence_dict_path() -> str:
@@ -126,48 +183,23 @@ def ref_link() -> Dict[str, str]:
     for f in config["ref"]["known"]:
         references[op.basename(f)] = op.realpath(f)
 
-    return references
-
+    # Optional capture targets
+    targets = config["ref"].get("targets", "")
+    if targets != "":
+        references[op.basename(targets)] = op.realpath(targets)
 
-def fq_pairs() -> Dict[str, str]:
-    """
-    This function returns a sample ID and
-    the corresponding fastq files.
-    """
-    # Will cause KeyError on single stranded RNA-Seq analysis
-    # Better ask forgiveness than permission !
-    try:
-        # Paired end case
-        iterator = zip(
-            design["Sample_id"],
-            design["Upstream_file"],
-            design["Downstream_file"]
-        )
-        return {
-            name: [
-                f"raw_data/{op.basename(fq1)}",
-                f"raw_data/{op.basename(fq2)}"
-            ]
-            for name, fq1, fq2 in iterator
-        }
-    except KeyError:
-        # Single end case
-        iterator = zip(
-            design["Sample_id"],
-            design["Upstream_file"]
-        )
-        return {
-            name: [f"raw_data/{op.basename(fq1)}"]
-            for name, fq1 in iterator
-        }
+    return references
 
 
 def refs_pack() -> Dict[str, str]:
     """
-    Return a dictionnary with references
+    Return a dictionnary with references. Capture targets, when given,
+    come as a BED file, as Picard interval lists with and without padding,
+    and as a padded BED file. Compacted known sites, when requested, are
+    restricted to the padded capture targets, or to the genome contigs.
     """
     fasta = op.basename(config['ref']['fasta'])
-    return {
+    references = {
         "fasta": get_fasta_path(),
         "faidx": f"{get_fasta_path()}.fai",
         "fadict": get_sequence_dict_path(),
@@ -179,31 +211,601 @@ def refs_pack() -> Dict[str, str]:
         ]
     }
 
+    targets = config["ref"].get("targets", "")
+    if targets != "":
+        references["targets_bed"] = f"genome/{op.basename(targets)}"
+        references["targets"] = "genome/capture.interval_list"
+        references["targets_padded"] = "genome/capture.padded.interval_list"
+        references["targets_padded_bed"] = "genome/capture.padded.bed"
+
+    if config["workflow"].get("compact_known", False) is True:
+        references["known_regions"] = references.get(
+            "targets_padded_bed", "genome/contigs.bed"
+        )
+        references["known_vcf"] = [
+            f"genome/compact/{op.basename(f)}" for f in config["ref"]["known"]
+        ]
+        references["known_index"] = [
+            f"genome/compact/{op.basename(f)}.tbi"
+            for f in config["ref"]["known"]
+        ]
+
+    return references
+
 
 def fq_pairs_w(wildcards) -> Dict[str, str]:
     """
-    Dynamic wildcards call for snakemake.
+    Dynamic wildcards call for snakemake: the fastq files of one lane, or
+    of every lane of the sample, upstream files first.
     """
-    return {"reads": fq_pairs_dict[wildcards.sample]}
+    lanes = fq_pairs_dict[wildcards.sample]
+    if "lane" in wildcards.keys():
+        return {"reads": lanes[wildcards.lane]}
+    return {"reads": [fq for mate in zip(*lanes.values()) for fq in mate]}
+
+
+def get_lane_bams(wildcards) -> List[str]:
+    """
+    Return the mapped lanes of a sample
+    """
+    return expand(
+        "bwa/lanes/{sample}/{lane}.bam",
+        sample=wildcards.sample,
+        lane=fq_pairs_dict[wildcards.sample].keys()
+    )
+
+
+def multi_lane_samples() -> str:
+    """
+    Return a regular expression matching the samples sequenced on several
+    lanes, or nothing at all
+    """
+    return "|".join(
+        re.escape(sample)
+        for sample, lanes in fq_pairs_dict.items()
+        if len(lanes) > 1
+    ) or "(?!)"
+
+
+def used_when(condition: bool) -> str:
+    """
+    Return a wildcard constraint letting an alternative rule match any
+    name when it is in use, and nothing at all otherwise. Snakemake builds
+    a candidate job for every rule able to produce a file before applying
+    ruleorder: on large cohorts, unused alternatives slow the DAG down.
+    """
+    return r"[^/]+" if condition else "(?!)"
+
+
+def get_chunk_reads(wildcards) -> Dict[str, List[str]]:
+    """
+    Return the fastq chunk(s) of a sample built by the split_fastq
+    checkpoint, one per mate
+    """
+    mates = ["1", "2"] if "Downstream_file" in design.columns else ["1"]
+    return {
+        "reads": [
+            f"bwa/chunks/{wildcards.sample}/reads/"
+            f"{mate}.{wildcards.chunk}.fastq.gz"
+            for mate in mates
+        ]
+    }
+
+
+def get_mapping_chunks(wildcards) -> List[str]:
+    """
+    Return the mapped chunks of a sample
+    """
+    reads = checkpoints.split_fastq.get(sample=wildcards.sample).output[0]
+    return expand(
+        "bwa/chunks/{sample}/{chunk}.bam",
+        sample=wildcards.sample,
+        chunk=sorted(glob_wildcards(
+            op.join(reads, "1.{chunk}.fastq.gz")
+        ).chunk)
+    )
 
 
 def sample_id() -> List[str]:
     """
     Return the list of samples identifiers
     """
-    return design["Sample_id"].tolist()
+    return list(fq_pairs_dict.keys())
 
 
 def get_java_args(wildcards, resources) -> str:
     """
     Return java args for GATK
     """
-    makedirs("tmp")
+    if "$" not in scratch_dir:
+        makedirs(scratch_dir)
     return (
         f"-Xmx{resources.mem_mb}m"
     )
 
 
+def get_scratch(rule: str, sized: str = "", factor: int = 2) -> Callable:
+    """
+    Return a params function opening a job command: it makes a unique
+    scratch directory, available as $scratch and removed on exit, whether
+    the job succeeds or fails. When the job input is sized, the job fails
+    early if the scratch directory holds less than factor times its size.
+    """
+    def scratch(wildcards, input) -> str:
+        command = (
+            f"mkdir -p {scratch_dir} && "
+            f"scratch=$(mktemp -d {scratch_dir}/{rule}.XXXXXX) && "
+            "trap 'rm -rf \"$scratch\"' EXIT && trap 'exit 1' INT TERM && "
+        )
+        if sized != "":
+            files = getattr(input, sized)
+            if isinstance(files, str):
+                files = [files]
+            command += (
+                f"needed=$(du -Lcm {' '.join(files)} | tail -n 1 "
+                "| cut -f 1) && "
+                "free=$(df -Pm \"$scratch\" | awk 'NR == 2 {print $4}') && "
+                f"if [ \"$free\" -lt $((needed * {factor})) ]; then "
+                f"echo \"$free MB free in {scratch_dir}, "
+                f"$((needed * {factor})) MB needed\" >&2 ; exit 1 ; fi && "
+            )
+        return command
+
+    return scratch
+
+
+def get_telemetry(rule: str) -> Callable:
+    """
+    Return a params function opening a job command: when telemetry is
+    enabled, the job process tree is sampled in background into the
+    telemetry output of the job. On exit, the job asks the sampler to stop
+    until it does, so that its samples are complete once the job is done:
+    the sampler ignores these requests until it is ready to handle them.
+    """
+    def telemetry(wildcards, output, threads, resources) -> str:
+        if telemetry_interval == 0:
+            return ""
+        return (
+            f"(trap '' TERM && exec python3 {telemetry_script} --quiet "
+            f"record --pid $$ --interval {telemetry_interval} "
+            f"--threads {threads} "
+            f"--mem-mb {getattr(resources, 'mem_mb', 0)} "
+            f"--output {output.telemetry}) & telemetry=$! && "
+            "trap 'while kill $telemetry 2> /dev/null; do sleep 0.1; done; "
+            "wait $telemetry || true' EXIT && "
+        )
+
+    return telemetry
+
+
+def get_telemetry_output(rule: str, *names: str) -> Dict[str, str]:
+    """
+    Return the telemetry output of a rule, when telemetry is enabled:
+    telemetry/{rule}/{wildcards}.tsv, after the given wildcards names,
+    or telemetry/{rule}/{rule}.tsv for rules without wildcards
+    """
+    if telemetry_interval == 0:
+        return {}
+    job = ".".join(f"{{{name}}}" for name in names) or rule
+    return {"telemetry": f"telemetry/{rule}/{job}.tsv"}
+
+
+def get_samtools_format() -> str:
+    """
+    Return samtools options writing alignments in the configured format.
+    CRAM files are written and read against the reference sequence.
+    """
+    if aln_ext == "cram":
+        return f"--output-fmt cram --reference {refs_pack_dict['fasta']}"
+    return ""
+
+
+def get_picard_reference() -> str:
+    """
+    Return the Picard option giving the reference sequence CRAM files are
+    read and written against, nothing for BAM files
+    """
+    if aln_ext == "cram":
+        return f"REFERENCE_SEQUENCE={refs_pack_dict['fasta']}"
+    return ""
+
+
+def get_samtools_view() -> str:
+    """
+    Return samtools view filters. Reads out of the padded capture targets
+    are filtered out as well, when off-target reads are dropped.
+    """
+    view = config["params"].get("samtools_view", "")
+    if target_filter_dict:
+        return f"{view} -L {target_filter_dict['targets']}"
+    return view
+
+
+def get_bqsr_intervals() -> str:
+    """
+    Return the GATK option restricting BQSR modelling to the padded
+    capture targets, nothing without capture targets
+    """
+    if "targets" in refs_pack_dict:
+        return f"--intervals {refs_pack_dict['targets_padded']}"
+    return ""
+
+
+def get_bqsr_table_intervals(wildcards) -> str:
+    """
+    Return the intervals a BQSR table is computed on: an interval shard,
+    or the padded capture targets as a whole
+    """
+    if wildcards.shard == "targets":
+        return refs_pack_dict["targets_padded"]
+    return f"gatk/intervals/{wildcards.shard}-scattered.interval_list"
+
+
+def capture_targets(name: str, condition: bool = True) -> Dict[str, str]:
+    """
+    Return a capture targets file as a named input, nothing when no
+    capture targets are given, or when the rule does not use them
+    """
+    if "targets" in refs_pack_dict and condition is True:
+        return {"targets": refs_pack_dict[name]}
+    return {}
+
+
+def cram_reference() -> Dict[str, str]:
+    """
+    Return the reference sequence and its index, as named inputs of the
+    rules writing the first CRAM files, nothing for BAM files
+    """
+    if aln_ext == "cram":
+        return {
+            "ref": refs_pack_dict["fasta"],
+            "ref_index": refs_pack_dict["faidx"]
+        }
+    return {}
+
+
+def get_aligner_prefix() -> str:
+    """
+    Return the index prefix of the aligner engine. Each engine keeps its
+    index files in its own directory.
+    """
+    return f"{aligner}/index/{op.basename(refs_pack_dict['fasta'])}"
+
+
+def aligner_index() -> Dict[str, Any]:
+    """
+    Return the index files of the aligner engine, as named inputs. The
+    bwa-mem2 index format depends on the engine version, so the version
+    which built the index is recorded next to it.
+    """
+    prefix = get_aligner_prefix()
+    index = {
+        "index": [f"{prefix}.{ext}" for ext in aligner_index_ext[aligner]]
+    }
+    if aligner == "bwa-mem2":
+        index["version"] = f"{prefix}.version"
+    return index
+
+
+def get_aligner_check() -> str:
+    """
+    Return a shell command failing when the bwa-mem2 index was not built
+    by the bwa-mem2 version about to map reads, nothing for BWA
+    """
+    if aligner == "bwa-mem2":
+        version = aligner_index_dict["version"]
+        return (
+            f"bwa-mem2 version 2> /dev/null | cmp -s - {version} || "
+            f"{{ echo 'Index does not match the aligner: remove "
+            f"{get_aligner_prefix()}.*' >&2 ; exit 1 ; }} ; "
+        )
+    return ""
+
+
+def get_aligner_stage(stage: str) -> str:
+    """
+    Return the resources and benchmark name of a mapping stage. bwa-mem2
+    stages are sized and benchmarked apart from the BWA ones.
+    """
+    if aligner == "bwa-mem2":
+        return stage.replace("bwa_mem", "bwa_mem2").replace(
+            "bwa_index", "bwa_mem2_index"
+        )
+    return stage
+
+
+def input_sizes() -> Dict[str, float]:
+    """
+    Return the size, in GB, of the raw data each job scales with:
+    samples identifiers map to their fastq files, "sample/lane" keys to
+    the fastq files of that lane, fastq roots and references names map
+    to the file itself. Fastq files described in the manifest are not
+    looked up on the file system.
+    """
+    known = {}
+    if manifest is not None:
+        known = dict(zip(manifest["File"], manifest["Compressed_size"]))
+
+    sizes = {
+        name: (
+            known[path] if path in known
+            else op.getsize(path) if op.exists(path)
+            else 0.0
+        ) / 1024 ** 3
+        for name, path in {**fq_link_dict, **ref_link_dict}.items()
+    }
+
+    # VCF indexation rules only see the file name without extension
+    for name in list(sizes.keys()):
+        if name.endswith(".vcf.gz"):
+            sizes[name[:-len(".vcf.gz")]] = sizes[name]
+
+    for root, link in fq_root_dict.items():
+        sizes[root] = sizes[op.basename(link)]
+
+    for sample, lanes in fq_pairs_dict.items():
+        for lane, fastq in lanes.items():
+            sizes[f"{sample}/{lane}"] = sum(
+                sizes[op.basename(fq)] for fq in fastq
+            )
+        sizes[sample] = sum(
+            sizes[op.basename(fq)]
+            for fastq in lanes.values()
+            for fq in fastq
+        )
+
+    return sizes
+
+
+def input_reads() -> Dict[str, int]:
+    """
+    Return the number of reads of each sample, per mate, as counted in
+    the fastq manifest. Samples with fastq files missing from the manifest
+    are left out.
+    """
+    if manifest is None:
+        return {}
+    known = dict(zip(manifest["File"], manifest["Reads"]))
+
+    reads = {}
+    for sample, lanes in fq_pairs_dict.items():
+        upstream = [
+            fq_link_dict[op.basename(fastq[0])] for fastq in lanes.values()
+        ]
+        if all(path in known for path in upstream):
+            reads[sample] = sum(int(known[path]) for path in upstream)
+    return reads
+
+
+def get_chunk_size(wildcards) -> float:
+    """
+    Return the size, in GB, of a chunk of reads built by split_fastq: its
+    share of the sample reads counted in the manifest, or the size of the
+    chunk files when the sample is not in the manifest
+    """
+    if wildcards.sample in input_reads_dict:
+        reads = input_reads_dict[wildcards.sample]
+        chunk_reads = config["mapping_chunk_reads"]
+        first = int(wildcards.chunk) * chunk_reads
+        share = min(chunk_reads, max(reads - first, 0)) / max(reads, 1)
+        return input_sizes_dict[wildcards.sample] * share
+
+    # Chunks only exist once the split_fastq checkpoint is done
+    return sum(
+        op.getsize(fq) if op.exists(fq) else 0
+        for fq in get_chunk_reads(wildcards)["reads"]
+    ) / 1024 ** 3
+
+
+def get_job_size(wildcards) -> float:
+    """
+    Return the size, in GB, of the raw data processed by a job: the
+    fastq files of its lane or of its chunk when the job maps a part of a
+    sample, the first wildcard naming a sample or a file otherwise, and
+    the genome sequence by default
+    """
+    if hasattr(wildcards, "lane"):
+        return input_sizes_dict[f"{wildcards.sample}/{wildcards.lane}"]
+    if hasattr(wildcards, "chunk"):
+        return get_chunk_size(wildcards)
+    for value in wildcards:
+        if value in input_sizes_dict:
+            return input_sizes_dict[value]
+    return input_sizes_dict[op.basename(config["ref"]["fasta"])]
+
+
+def get_resource(rule: str, resource: str, reserved: int = 0) -> Callable:
+    """
+    Return a resource function estimating the memory or time needed by a
+    rule from the size of its input data, after the resources model.
+    Each new attempt escalates the estimation, up to the model maximum.
+    Reserved resources, e.g. the buffer of a sort stage, are added on top.
+    Grouped jobs only ask for their own resources: Snakemake sums the
+    runtime of the consecutive jobs of a group job, and keeps the largest
+    one among jobs running side by side.
+    """
+    model = resources_model[rule][resource]
+
+    def estimate(wildcards, attempt: int = 1) -> int:
+        size = get_job_size(wildcards)
+        return reserved + int(min(
+            (model["base"] + model["per_gb"] * size) * attempt,
+            model["max"]
+        ))
+
+    return estimate
+
+
+def get_threads(rule: str) -> Callable:
+    """
+    Return a threads function sizing a rule from its input data, after the
+    resources model, and never above the threads given in config. Threads
+    given to the rule in config/rule_threads replace the estimation.
+    """
+    model = resources_model[rule]["threads"]
+    fixed = config.get("rule_threads", {}).get(rule, None)
+
+    def estimate(wildcards) -> int:
+        if fixed is not None:
+            return max(1, min(int(fixed), config["threads"]))
+        value = model["base"] + model["per_gb"] * get_job_size(wildcards)
+        return max(1, int(min(value, model["max"], config["threads"])))
+
+    return estimate
+
+
+def job_groups() -> Dict[str, List[str]]:
+    """
+    Return the rules submitted together, when workflow/group_jobs is set:
+    the short consecutive steps of a sample, and its quality controls.
+    Rules run once per fastq file are listed once per file of the largest
+    sample.
+    """
+    if config["workflow"].get("group_jobs", False) is not True:
+        return {}
+
+    groups = {
+        "prepare": ["samtools_filter_unmaped", "picard_add_or_replace_group"],
+        "index": ["gatk_SetNmMdAndUqTags", "samtools_index"],
+        "metrics": []
+    }
+    if config["workflow"]["fastqc"] is True and (
+        config["workflow"].get("staging_qc", False) is not True
+    ):
+        groups["metrics"] += ["fastqc"] * max(
+            len(roots) for roots in fq_roots_dict.values()
+        )
+    if config["workflow"]["mapping_quality"] is True:
+        if config["workflow"].get("fused_qc", False) is True:
+            groups["metrics"].append("picard_collect_multiple_metrics")
+        else:
+            groups["metrics"].append("picard_alignment_summary")
+            if "Downstream_file" in design.columns.tolist():
+                groups["metrics"].append("picard_insert_size")
+        if "targets" in refs_pack_dict:
+            groups["metrics"].append("picard_hs_metrics")
+    if config["workflow"].get("incremental_qc", False) is True:
+        groups["metrics"].append("qc_record")
+    return {group: members for group, members in groups.items() if members}
+
+
+def get_group(rule: str) -> Optional[str]:
+    """
+    Return the group a rule is submitted with, nothing when the rule is
+    submitted on its own
+    """
+    for group, members in job_groups_dict.items():
+        if rule in members:
+            return group
+    return None
+
+
+def get_group_components() -> Dict[str, int]:
+    """
+    Return the number of connected jobs bundled in each group job: one
+    per sample for consecutive steps, one per independent quality control
+    of a sample, times the number of samples batched together
+    """
+    components = {}
+    for group, members in job_groups_dict.items():
+        per_sample = 1
+        if group == "metrics":
+            # Per-sample records depend on all quality controls but the
+            # hybrid selection metrics
+            per_sample = len(members)
+            if "qc_record" in members:
+                per_sample = 1 + int("picard_hs_metrics" in members)
+        components[group] = config.get("group_samples", 1) * per_sample
+    return components
+
+
+def get_sort_buffer() -> int:
+    """
+    Return the memory, in MB, shared by the threads of a samtools sort
+    """
+    memory = float(config["params"].get("samtools_sort_memory", "8"))
+    return int(memory * 1024)
+
+
+def get_sort_memory(wildcards, threads) -> str:
+    """
+    Return the memory given to each samtools sort thread, so that all the
+    threads of a job use samtools_sort_memory gigabytes at most
+    """
+    return f"{max(1, get_sort_buffer() // threads)}M"
+
+
+def get_read_group_fields(wildcards) -> Dict[str, str]:
+    """
+    Parse Picard's read group arguments into @RG fields for a given sample.
+    Each lane of a sample gets its own read group identifier and platform
+    unit.
+    """
+    lane = wildcards.get("lane", "")
+    fields = {"ID": "1"}
+    for arg in config["params"].get("picard_group_extra", "").split():
+        if not arg.startswith("RG") or "=" not in arg:
+            continue
+        key, value = arg[2:].split("=", 1)
+        fields[key] = value.format(sample=wildcards.sample, lane=lane)
+
+    if lane != "":
+        for key in ["ID", "PU"]:
+            if key in fields and lane not in fields[key]:
+                fields[key] = f"{fields[key]}.{lane}"
+
+    return fields
+
+
+def get_read_group(wildcards) -> str:
+    """
+    Translate Picard's read group arguments into a @RG header line
+    understood by bwa mem, so that read groups can be set at mapping time
+    """
+    return "\\t".join(
+        ["@RG"] + [
+            f"{key}:{value}"
+            for key, value in get_read_group_fields(wildcards).items()
+        ]
+    )
+
+
+def get_bqsr_shards(wildcards) -> List[str]:
+    """
+    Return the interval shards names built by the gatk_split_intervals
+    checkpoint, in reference order
+    """
+    intervals = checkpoints.gatk_split_intervals.get().output[0]
+    return sorted(glob_wildcards(
+        op.join(intervals, "{shard}-scattered.interval_list")
+    ).shard)
+
+
+def get_bqsr_tables(wildcards) -> List[str]:
+    """
+    Return the per-shard BQSR tables of a sample. Capture targets are a
+    small fraction of the genome: their table is computed in a single job.
+    """
+    if "targets" in refs_pack_dict:
+        return [f"gatk/bqsr/{wildcards.sample}/targets.table"]
+    return expand(
+        "gatk/bqsr/{sample}/{shard}.table",
+        sample=wildcards.sample,
+        shard=get_bqsr_shards(wildcards)
+    )
+
+
+def get_recal_shards(wildcards) -> List[str]:
+    """
+    Return the per-shard recalibrated bam files of a sample
+    """
+    return expand(
+        f"gatk/recal/{{sample}}/{{shard}}.{aln_ext}",
+        sample=wildcards.sample,
+        shard=get_bqsr_shards(wildcards)
+    )
+
+
 def get_picard_dedup_stats(sample) -> str:
     """
     Return the Picard MarkDuplicates parameters including
@@ -217,26 +819,44 @@ def get_picard_dedup_stats(sample) -> str:
     return config["params"].get("picard_dedup_extra", "")
 
 
-def get_targets(no_multiqc=False) -> Dict[str, Any]:
+def get_targets() -> Dict[str, Any]:
     """
     This function returns the targets of Snakemake
     following the requests from the user.
     """
+    # Fused duplicates marking does not write deduplicated alignments
+    deduplicated = (
+        "gatk/setmnanduqtags"
+        if config["workflow"].get("fused_dedup", False) is True
+        else "picard/deduplicated"
+    )
     targets = {
         "gatk": expand(
-            "picard/deduplicated/{sample}.bam",
+            f"{deduplicated}/{{sample}}.{aln_ext}",
             sample=sample_id_list
         )
     }
     if config["workflow"]["fastqc"] is True:
-        targets["fastqc"] = expand(
-            "qc/fastqc/{samples}_fastqc.{ext}",
-            samples=fq_root_dict.keys(),
-            ext=["html", "zip"]
-        )
-    if config["workflow"]["multiqc"] is True and no_multiqc is False:
+        if config["workflow"].get("staging_qc", False) is True:
+            targets["fastqc"] = expand(
+                "qc/fastp/{files}.fastp.{ext}",
+                files=fq_link_dict.keys(),
+                ext=["html", "json"]
+            )
+        else:
+            targets["fastqc"] = expand(
+                "qc/fastqc/{samples}_fastqc.{ext}",
+                samples=fq_root_dict.keys(),
+                ext=["html", "zip"]
+            )
+    if config["workflow"]["multiqc"] is True:
         targets["multiqc"] = "qc/multiqc_report.html"
 
+    if telemetry_interval > 0:
+        targets["telemetry"] = [
+            "telemetry/stages.tsv", "telemetry/timeline.tsv"
+        ]
+
     if config["workflow"]["mapping_quality"] is True:
         targets["picard_dedup"] = expand(
             "picard/stats/duplicates/{sample}.metrics.txt",
@@ -251,17 +871,118 @@ def get_targets(no_multiqc=False) -> Dict[str, Any]:
             "picard/stats/summary/{sample}_summary.txt",
             sample=sample_id_list
         )
+        if config["workflow"].get("fused_qc", False) is True:
+            targets["samtools_stats"] = expand(
+                "samtools/{tool}/{sample}.{tool}.txt",
+                sample=sample_id_list,
+                tool=["stats", "flagstat"]
+            )
+            targets["picard_quality"] = expand(
+                "picard/stats/quality/{sample}.quality_distribution.txt",
+                sample=sample_id_list
+            )
+        if "targets" in refs_pack_dict:
+            targets["picard_hs"] = expand(
+                "picard/stats/hs/{sample}.hs_metrics.txt",
+                sample=sample_id_list
+            )
 
     return targets
 
 
+def get_quality_targets(wildcards) -> Dict[str, Any]:
+    """
+    Return the targets gathered by MultiQC: all of them, but its report
+    and the telemetry one. With incremental quality controls, MultiQC
+    reads the cohort tables built from per-sample records instead.
+    """
+    if config["workflow"].get("incremental_qc", False) is True:
+        return {
+            "cohort": ["qc/cohort/fastq_mqc.tsv", "qc/cohort/samples_mqc.tsv"]
+        }
+    return {
+        name: files
+        for name, files in targets_dict.items()
+        if name not in ["multiqc", "telemetry"]
+    }
+
+
+def fq_sample_roots() -> Dict[str, List[str]]:
+    """
+    Return the fastq roots, as named by FastQC, of each sample
+    """
+    samples = {
+        link: sample
+        for sample, lanes in fq_pairs_dict.items()
+        for links in lanes.values()
+        for link in links
+    }
+    roots = {}
+    for root, link in fq_root_dict.items():
+        roots.setdefault(samples[link], []).append(root)
+    return roots
+
+
+def get_qc_record_inputs(wildcards) -> Dict[str, Any]:
+    """
+    Return the quality controls of a sample, parsed into its record
+    """
+    inputs = {}
+    if config["workflow"]["fastqc"] is True:
+        if config["workflow"].get("staging_qc", False) is True:
+            inputs["fastp"] = [
+                f"qc/fastp/{op.basename(link)}.fastp.json"
+                for links in fq_pairs_dict[wildcards.sample].values()
+                for link in links
+            ]
+        else:
+            inputs["fastqc"] = [
+                f"qc/fastqc/{root}_fastqc.zip"
+                for root in fq_roots_dict.get(wildcards.sample, [])
+            ]
+    if config["workflow"]["mapping_quality"] is True:
+        inputs["duplicates"] = (
+            f"picard/stats/duplicates/{wildcards.sample}.metrics.txt"
+        )
+        inputs["summary"] = (
+            f"picard/stats/summary/{wildcards.sample}_summary.txt"
+        )
+        if "Downstream_file" in design.columns.tolist():
+            inputs["insert_size"] = (
+                f"picard/stats/size/{wildcards.sample}.isize.txt"
+            )
+    return inputs
+
+
+def get_telemetry_targets(wildcards) -> Dict[str, Any]:
+    """
+    Return the targets summarized by the telemetry report: all of them,
+    since each job writes its telemetry as one of its outputs
+    """
+    return {
+        name: files
+        for name, files in targets_dict.items()
+        if name != "telemetry"
+    }
+
+
 # We will use these functions multiple times. On large input datasets,
 # pre-computing all of these makes Snakemake faster.
-fq_link_dict = fq_link()
-fq_root_dict = fq_root()
+fq_link_dict, fq_root_dict, fq_pairs_dict = fq_tables()
+fq_roots_dict = fq_sample_roots()
 ref_link_dict = ref_link()
-fq_pairs_dict = fq_pairs()
+ref_names_regex = "|".join(re.escape(name) for name in ref_link_dict)
 refs_pack_dict = refs_pack()
+job_groups_dict = job_groups()
+cram_reference_dict = cram_reference()
+aligner_index_dict = aligner_index()
+target_filter_dict = capture_targets(
+    "targets_padded_bed",
+    config["workflow"].get("drop_off_target", False)
+)
 sample_id_list = sample_id()
+multi_lane_regex = multi_lane_samples()
 targets_dict = get_targets()
+input_sizes_dict = input_sizes()
+input_reads_dict = input_reads()
 # print(ref_link_dict)
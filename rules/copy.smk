@@ -2,63 +2,126 @@
 On most clusters, cold and hot storage coexist. Non-expert users might
 try to run IO intensive processes on data through cold storage and break
 either the pipeline or the mounting points on a cluster. This rule
-copies the fastq files.
-More information at:
-https://github.com/tdayris/yawn/tree/master/SnakemakeWrappers/cp/8.25
+stages the fastq files: files under cold storage are copied in parallel,
+verified chunks, while files already on hot storage are linked.
+More information with:
+python3 scripts/stage.py --help
 """
 rule copy_fastq:
     input:
         lambda wildcards: fq_link_dict[wildcards.files]
     output:
-        temp("raw_data/{files}")
+        temp("raw_data/{files}"),
+        **get_telemetry_output("copy_fastq", "files")
     message:
         "Copying {wildcards.files} for further process"
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 128, 512)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 1440, 2832)
+        mem_mb = get_resource("copy_fastq", "mem_mb"),
+        runtime = get_resource("copy_fastq", "time_min")
+    benchmark:
+        "benchmarks/copy_fastq/{files}.tsv"
+    version: "2.0"
+    log:
+        "logs/copy_{files}.log"
+    wildcard_constraints:
+        files = used_when(
+            config["workflow"].get("staging_qc", False) is not True
         )
+    threads: get_threads("copy_fastq")
+    priority: 1
+    params:
+        telemetry = get_telemetry("copy_fastq"),
+        extra = config["params"].get("copy_extra", ""),
+        cold_storage = config.get("cold_storage", ["NONE"]),
+        script = stage_script
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} {input} {output[0]} {params.extra} "
+        "--threads {threads} --cold-storage {params.cold_storage} "
+        "> {log} 2>&1"
+
+"""
+Same remarks as the above. Here, the staged bytes are also streamed to
+fastp, so that the quality of the fastq file is controlled without reading
+it a second time. This rule replaces the above one, and FastQC, when
+workflow/staging_qc is set. fastp reports are read by MultiQC. fastp does
+not decompress its standard input, hence gzip.
+More information at:
+https://github.com/OpenGene/fastp
+"""
+rule copy_fastq_qc:
+    input:
+        lambda wildcards: fq_link_dict[wildcards.files]
+    output:
+        fastq = temp("raw_data/{files}"),
+        json = "qc/fastp/{files}.fastp.json",
+        html = report(
+            "qc/fastp/{files}.fastp.html",
+            caption="../report/fastp.rst",
+            category="Quality Controls"
+        ),
+        **get_telemetry_output("copy_fastq_qc", "files")
+    message:
+        "Copying {wildcards.files} and controlling its quality with fastp"
+    resources:
+        mem_mb = get_resource("copy_fastq_qc", "mem_mb"),
+        runtime = get_resource("copy_fastq_qc", "time_min")
+    benchmark:
+        "benchmarks/copy_fastq_qc/{files}.tsv"
     version: "1.0"
+    conda:
+        "../envs/fastp.yaml"
     log:
         "logs/copy_{files}.log"
     wildcard_constraints:
-        files = r"[^/]+"
-    threads: 1
+        files = used_when(config["workflow"].get("staging_qc", False) is True)
+    threads: get_threads("copy_fastq_qc")
     priority: 1
     params:
+        telemetry = get_telemetry("copy_fastq_qc"),
         extra = config["params"].get("copy_extra", ""),
-        cold_storage = config.get("cold_storage", ["NONE"])
-    wrapper:
-        f"{git}/bio/cp"
+        cold_storage = config.get("cold_storage", ["NONE"]),
+        script = stage_script
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} {input} {output.fastq} {params.extra} "
+        "--threads {threads} --cold-storage {params.cold_storage} "
+        "--tee 'gzip -cdf | fastp --stdin --thread {threads} "
+        "--json {output.json} --html {output.html} "
+        "--report_title {wildcards.files}' "
+        "> {log} 2>&1"
 
 """
-Same remarks as the above. Here, we copy the reference files.
+Same remarks as the above. Here, we copy the reference files. Only their
+names are matched, so that their indexes are not looked up here.
 """
 rule copy_extra:
     input:
         lambda wildcards: ref_link_dict[wildcards.files]
     output:
-        temp("genome/{files}")
+        temp("genome/{files}"),
+        **get_telemetry_output("copy_extra", "files")
     message:
         "Copying {wildcards.files} as reference"
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 128, 512)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 1440, 2832)
-        )
-    version: "1.0"
+        mem_mb = get_resource("copy_extra", "mem_mb"),
+        runtime = get_resource("copy_extra", "time_min")
+    benchmark:
+        "benchmarks/copy_extra/{files}.tsv"
+    version: "2.0"
     log:
         "logs/copy_{files}.log"
     wildcard_constraints:
-        files = r"[^/]+"
-    threads: 1
+        files = ref_names_regex
+    threads: get_threads("copy_extra")
     priority: 1
     params:
+        telemetry = get_telemetry("copy_extra"),
         extra = config["params"].get("copy_extra", ""),
-        cold_storage = config.get("cold_storage", ["NONE"])
-    wrapper:
-        f"{git}/bio/cp"
+        cold_storage = config.get("cold_storage", ["NONE"]),
+        script = stage_script
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} {input} {output[0]} {params.extra} "
+        "--threads {threads} --cold-storage {params.cold_storage} "
+        "> {log} 2>&1"
@@ -17,13 +17,13 @@ rule fastqc:
         ""
     threads:
         1
+    group:
+        get_group("fastqc")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 512 + 512, 2048)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 20, 120)
-        )
+        mem_mb = get_resource("fastqc", "mem_mb"),
+        runtime = get_resource("fastqc", "time_min")
+    benchmark:
+        "benchmarks/fastqc/{sample}.tsv"
     version: "1.0"
     wildcard_constraints:
         sample = r"[^/]+"
@@ -5,12 +5,13 @@ previous corrections.
 """
 rule gatk_SetNmMdAndUqTags:
     input:
-        bam = "picard/deduplicated/{sample}.bam",
+        bam = f"picard/deduplicated/{{sample}}.{aln_ext}",
         ref = refs_pack_dict["fasta"],
         ref_index = refs_pack_dict["faidx"],
         ref_dict = refs_pack_dict["fadict"]
     output:
-        bam = "gatk/setmnanduqtags/{sample}.bam"
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        **get_telemetry_output("gatk_SetNmMdAndUqTags", "sample")
     message:
         "Fixing possible broken MN, MD and UQ tags on {wildcards.sample}"
     threads:
@@ -19,59 +20,474 @@ rule gatk_SetNmMdAndUqTags:
         "1.0"
     conda:
         "../envs/gatk.yaml"
+    group:
+        get_group("gatk_SetNmMdAndUqTags")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 7168, 16384)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 180, 480)
+        mem_mb = get_resource("gatk_SetNmMdAndUqTags", "mem_mb"),
+        runtime = get_resource("gatk_SetNmMdAndUqTags", "time_min")
+    benchmark:
+        "benchmarks/gatk_SetNmMdAndUqTags/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is not True
         )
     log:
         "logs/gatk/setmnanduqtags/{sample}.log"
+    params:
+        telemetry = get_telemetry("gatk_SetNmMdAndUqTags"),
+        scratch = get_scratch("gatk_SetNmMdAndUqTags", "bam", 1)
     shell:
-        "gatk SetNmMdAndUqTags --INPUT {input.bam} --OUTPUT {output.bam} "
-        "--REFERENCE_SEQUENCE {input.ref} --TMP_DIR tmp_{wildcards.sample} "
-        "> {log} 2>&1"
+        "{params.telemetry}"
+        "({params.scratch}gatk SetNmMdAndUqTags --INPUT {input.bam} "
+        "--OUTPUT {output.bam} --REFERENCE_SEQUENCE {input.ref} "
+        "--TMP_DIR $scratch) > {log} 2>&1"
 
 
 """
 This rule performs both BQSR table computation and its
-application to the original input bam file
+application to the original input bam file. With capture targets,
+the table is computed on padded targets only.
 """
 rule gatk_bqsr:
     input:
-        bam = "gatk/setmnanduqtags/{sample}.bam",
-        bam_index = "gatk/setmnanduqtags/{sample}.bam.bai",
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        bam_index = f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}",
         ref = refs_pack_dict["fasta"],
         ref_index = refs_pack_dict["faidx"],
         ref_dict = refs_pack_dict["fadict"],
         known = refs_pack_dict["known_vcf"],
-        known_index = refs_pack_dict["known_index"]
+        known_index = refs_pack_dict["known_index"],
+        **capture_targets("targets_padded")
     output:
         bam = report(
-            "gatk/recal/{sample}.bam",
+            f"gatk/recal/{{sample}}.{aln_ext}",
             caption="../report/gatk.rst",
             category="Mapping"
-        )
+        ),
+        **get_telemetry_output("gatk_bqsr", "sample")
     message:
         "Recalibrating variants in {wildcards.sample} with GATK"
     threads:
         1
     version:
-        swv
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 7168, 16384)
+        mem_mb = get_resource("gatk_bqsr", "mem_mb"),
+        runtime = get_resource("gatk_bqsr", "time_min")
+    benchmark:
+        "benchmarks/gatk_bqsr/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config.get("bqsr_shards", 1) <= 1
+            and config["workflow"].get("spark", False) is not True
+        )
+    log:
+        "logs/gatk/bqsr/{sample}.log"
+    params:
+        telemetry = get_telemetry("gatk_bqsr"),
+        scratch = get_scratch("gatk_bqsr"),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        ),
+        known = (
+            lambda wildcards, input: " ".join(
+                f"--known-sites {known}" for known in input.known
+            )
         ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 180, 480)
+        extra = " ".join([
+            config["params"].get("gatk_bqsr_extra", ""),
+            get_bqsr_intervals()
+        ]),
+        apply_extra = config["params"].get("gatk_bqsr_apply_extra", "")
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "BaseRecalibrator {params.extra} --input {input.bam} "
+        "--reference {input.ref} {params.known} "
+        "--output $scratch/recal.table --tmp-dir $scratch && "
+        "gatk --java-options '{params.java_opts}' ApplyBQSR "
+        "{params.apply_extra} --input {input.bam} --reference {input.ref} "
+        "--bqsr-recal-file $scratch/recal.table --output {output.bam} "
+        "--tmp-dir $scratch) > {log} 2>&1"
+
+
+"""
+This checkpoint splits the reference into balanced interval shards for
+BQSR scatter-gather. Contigs are never subdivided, so that no read is
+recalibrated twice and shards can be concatenated back in order.
+"""
+checkpoint gatk_split_intervals:
+    input:
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"]
+    output:
+        directory("gatk/intervals"),
+        **get_telemetry_output("gatk_split_intervals")
+    message:
+        "Splitting reference into {params.shards} interval shards"
+    threads:
+        1
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_split_intervals", "mem_mb"),
+        runtime = get_resource("gatk_split_intervals", "time_min")
+    benchmark:
+        "benchmarks/gatk_split_intervals/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
+    params:
+        telemetry = get_telemetry("gatk_split_intervals"),
+        shards = config.get("bqsr_shards", 1),
+        scratch = get_scratch("gatk_split_intervals"),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        )
+    log:
+        "logs/gatk/split_intervals.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "SplitIntervals --reference {input.ref} "
+        "--scatter-count {params.shards} "
+        "--subdivision-mode BALANCING_WITHOUT_INTERVAL_SUBDIVISION "
+        "--output {output[0]} --tmp-dir $scratch) > {log} 2>&1"
+
+
+"""
+This rule computes the BQSR table on one interval shard, or on the padded
+capture targets when they are given
+"""
+rule gatk_base_recalibrator_shard:
+    input:
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        bam_index = f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}",
+        intervals = get_bqsr_table_intervals,
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"],
+        known = refs_pack_dict["known_vcf"],
+        known_index = refs_pack_dict["known_index"]
+    output:
+        temp("gatk/bqsr/{sample}/{shard}.table"),
+        **get_telemetry_output(
+            "gatk_base_recalibrator_shard", "sample", "shard"
         )
-    # log:
-    #     "logs/gatk/bqsr/{sample}.log"
+    message:
+        "Computing BQSR table of {wildcards.sample} on {wildcards.shard}"
+    threads:
+        1
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_base_recalibrator_shard", "mem_mb"),
+        runtime = get_resource("gatk_base_recalibrator_shard", "time_min")
+    benchmark:
+        "benchmarks/gatk_base_recalibrator_shard/{sample}/{shard}.tsv"
+    wildcard_constraints:
+        sample = r"[^/]+",
+        shard = r"\d+|targets"
     params:
+        telemetry = get_telemetry("gatk_base_recalibrator_shard"),
+        scratch = get_scratch("gatk_base_recalibrator_shard"),
         java_opts = (
             lambda wildcards, resources: get_java_args(wildcards, resources)
         ),
+        known = (
+            lambda wildcards, input: " ".join(
+                f"--known-sites {known}" for known in input.known
+            )
+        ),
         extra = config["params"].get("gatk_bqsr_extra", "")
-    wrapper:
-        f"{swv}/bio/gatk/baserecalibrator"
+    log:
+        "logs/gatk/bqsr/{sample}.{shard}.table.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "BaseRecalibrator {params.extra} --input {input.bam} "
+        "--reference {input.ref} {params.known} --intervals {input.intervals} "
+        "--output {output[0]} --tmp-dir $scratch) > {log} 2>&1"
+
+
+"""
+This rule gathers the per-shard BQSR tables into a single one
+"""
+rule gatk_gather_bqsr_reports:
+    input:
+        get_bqsr_tables
+    output:
+        temp("gatk/bqsr/{sample}.table"),
+        **get_telemetry_output("gatk_gather_bqsr_reports", "sample")
+    message:
+        "Gathering BQSR tables for {wildcards.sample}"
+    threads:
+        1
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_gather_bqsr_reports", "mem_mb"),
+        runtime = get_resource("gatk_gather_bqsr_reports", "time_min")
+    benchmark:
+        "benchmarks/gatk_gather_bqsr_reports/{sample}.tsv"
+    params:
+        telemetry = get_telemetry("gatk_gather_bqsr_reports"),
+        scratch = get_scratch("gatk_gather_bqsr_reports"),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        ),
+        tables = (
+            lambda wildcards, input: " ".join(
+                f"--input {table}" for table in input
+            )
+        )
+    wildcard_constraints:
+        sample = r"[^/]+"
+    log:
+        "logs/gatk/bqsr/{sample}.gather_tables.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "GatherBQSRReports {params.tables} --output {output[0]} "
+        "--tmp-dir $scratch) > {log} 2>&1"
+
+
+"""
+This rule applies the gathered BQSR table on one interval shard
+"""
+rule gatk_apply_bqsr_shard:
+    input:
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        bam_index = f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}",
+        table = "gatk/bqsr/{sample}.table",
+        intervals = "gatk/intervals/{shard}-scattered.interval_list",
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"]
+    output:
+        temp(f"gatk/recal/{{sample}}/{{shard}}.{aln_ext}"),
+        **get_telemetry_output("gatk_apply_bqsr_shard", "sample", "shard")
+    message:
+        "Applying BQSR on {wildcards.sample} shard {wildcards.shard}"
+    threads:
+        1
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_apply_bqsr_shard", "mem_mb"),
+        runtime = get_resource("gatk_apply_bqsr_shard", "time_min")
+    benchmark:
+        "benchmarks/gatk_apply_bqsr_shard/{sample}/{shard}.tsv"
+    wildcard_constraints:
+        sample = r"[^/]+",
+        shard = r"\d+"
+    params:
+        telemetry = get_telemetry("gatk_apply_bqsr_shard"),
+        scratch = get_scratch("gatk_apply_bqsr_shard"),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        ),
+        extra = config["params"].get("gatk_bqsr_apply_extra", "")
+    log:
+        "logs/gatk/bqsr/{sample}.{shard}.apply.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "ApplyBQSR {params.extra} --input {input.bam} --reference {input.ref} "
+        "--bqsr-recal-file {input.table} --intervals {input.intervals} "
+        "--output {output[0]} --tmp-dir $scratch) > {log} 2>&1"
+
+
+"""
+This rule concatenates the recalibrated shards back in reference order
+"""
+rule gatk_gather_recal_bam:
+    input:
+        get_recal_shards
+    output:
+        bam = report(
+            f"gatk/recal/{{sample}}.{aln_ext}",
+            caption="../report/gatk.rst",
+            category="Mapping"
+        ),
+        **get_telemetry_output("gatk_gather_recal_bam", "sample")
+    message:
+        "Gathering recalibrated shards of {wildcards.sample}"
+    threads:
+        1
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_gather_recal_bam", "mem_mb"),
+        runtime = get_resource("gatk_gather_recal_bam", "time_min")
+    benchmark:
+        "benchmarks/gatk_gather_recal_bam/{sample}.tsv"
+    params:
+        telemetry = get_telemetry("gatk_gather_recal_bam"),
+        scratch = get_scratch("gatk_gather_recal_bam"),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        ),
+        bams = (
+            lambda wildcards, input: " ".join(f"-I {bam}" for bam in input)
+        ),
+        # GatherBamFiles does not write CRAM files
+        tool = (
+            f"PrintReads --reference {refs_pack_dict['fasta']}"
+            if aln_ext == "cram" else "GatherBamFiles"
+        )
+    wildcard_constraints:
+        sample = used_when(config.get("bqsr_shards", 1) > 1)
+    log:
+        "logs/gatk/bqsr/{sample}.gather_bam.log"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "{params.tool} {params.bams} -O {output.bam} --tmp-dir $scratch) "
+        "> {log} 2>&1"
+
+
+"""
+This rule marks duplicates with the Spark version of MarkDuplicates, run
+in local mode on the job threads. Duplicates and metrics are the same as
+Picard's. It replaces picard_mark_duplicates when workflow/spark is set.
+"""
+rule gatk_mark_duplicates_spark:
+    input:
+        bam = f"picard/groups/{{sample}}.{aln_ext}",
+        **cram_reference_dict
+    output:
+        bam = temp(f"picard/deduplicated/{{sample}}.{aln_ext}"),
+        metrics = "picard/stats/duplicates/{sample}.metrics.txt",
+        **get_telemetry_output("gatk_mark_duplicates_spark", "sample")
+    message:
+        "Dealing with duplicates in {wildcards.sample} with GATK Spark"
+    threads:
+        get_threads("gatk_mark_duplicates_spark")
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_mark_duplicates_spark", "mem_mb"),
+        runtime = get_resource("gatk_mark_duplicates_spark", "time_min")
+    benchmark:
+        "benchmarks/gatk_mark_duplicates_spark/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is not True
+            and config.get("dedup_backend", "picard") == "picard"
+            and config["workflow"].get("spark", False) is True
+        )
+    log:
+        "logs/gatk/duplicates/{sample}.log"
+    params:
+        telemetry = get_telemetry("gatk_mark_duplicates_spark"),
+        scratch = get_scratch("gatk_mark_duplicates_spark", "bam", 1),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        ),
+        extra = config["params"].get(
+            "gatk_markdup_spark_extra", "--remove-all-duplicates"
+        ),
+        reference = (
+            f"--reference {refs_pack_dict['fasta']}"
+            if aln_ext == "cram" else ""
+        )
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "MarkDuplicatesSpark {params.extra} --input {input.bam} "
+        "--output {output.bam} --metrics-file {output.metrics} "
+        "{params.reference} --create-output-bam-index false "
+        "--create-output-bam-splitting-index false "
+        "--spark-master 'local[{threads}]' --conf spark.local.dir=$scratch "
+        "--tmp-dir $scratch) > {log} 2>&1"
+
+
+"""
+This rule computes the BQSR table and applies it with the Spark versions
+of BaseRecalibrator and ApplyBQSR, run in local mode on the job threads.
+As with gatk_bqsr, the table is computed on padded capture targets only,
+while every read is recalibrated. It replaces gatk_bqsr when
+workflow/spark is set.
+"""
+rule gatk_bqsr_spark:
+    input:
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        bam_index = f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}",
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"],
+        known = refs_pack_dict["known_vcf"],
+        known_index = refs_pack_dict["known_index"],
+        **capture_targets("targets_padded")
+    output:
+        bam = report(
+            f"gatk/recal/{{sample}}.{aln_ext}",
+            caption="../report/gatk.rst",
+            category="Mapping"
+        ),
+        **get_telemetry_output("gatk_bqsr_spark", "sample")
+    message:
+        "Recalibrating variants in {wildcards.sample} with GATK Spark"
+    threads:
+        get_threads("gatk_bqsr_spark")
+    version:
+        "1.0"
+    conda:
+        "../envs/gatk.yaml"
+    resources:
+        mem_mb = get_resource("gatk_bqsr_spark", "mem_mb"),
+        runtime = get_resource("gatk_bqsr_spark", "time_min")
+    benchmark:
+        "benchmarks/gatk_bqsr_spark/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config.get("bqsr_shards", 1) <= 1
+            and config["workflow"].get("spark", False) is True
+        )
+    log:
+        "logs/gatk/bqsr/{sample}.spark.log"
+    params:
+        telemetry = get_telemetry("gatk_bqsr_spark"),
+        scratch = get_scratch("gatk_bqsr_spark"),
+        java_opts = (
+            lambda wildcards, resources: get_java_args(wildcards, resources)
+        ),
+        known = (
+            lambda wildcards, input: " ".join(
+                f"--known-sites {known}" for known in input.known
+            )
+        ),
+        extra = " ".join([
+            config["params"].get("gatk_bqsr_extra", ""),
+            get_bqsr_intervals()
+        ]),
+        apply_extra = config["params"].get("gatk_bqsr_apply_extra", "")
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}gatk --java-options '{params.java_opts}' "
+        "BaseRecalibratorSpark {params.extra} --input {input.bam} "
+        "--reference {input.ref} {params.known} "
+        "--output $scratch/recal.table "
+        "--spark-master 'local[{threads}]' --conf spark.local.dir=$scratch "
+        "--tmp-dir $scratch && "
+        "gatk --java-options '{params.java_opts}' ApplyBQSRSpark "
+        "{params.apply_extra} --input {input.bam} --reference {input.ref} "
+        "--bqsr-recal-file $scratch/recal.table --output {output.bam} "
+        "--create-output-bam-index false "
+        "--create-output-bam-splitting-index false "
+        "--spark-master 'local[{threads}]' --conf spark.local.dir=$scratch "
+        "--tmp-dir $scratch) > {log} 2>&1"
@@ -5,16 +5,15 @@ rule vcf_index_tbi:
     input:
         "genome/{file}.vcf.gz"
     output:
-        "genome/{file}.vcf.gz.tbi"
+        "genome/{file}.vcf.gz.tbi",
+        **get_telemetry_output("vcf_index_tbi", "file")
     threads:
-        min(config["threads"], 6)
+        get_threads("vcf_index_tbi")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45, 180)
-        )
+        mem_mb = get_resource("vcf_index_tbi", "mem_mb"),
+        runtime = get_resource("vcf_index_tbi", "time_min")
+    benchmark:
+        "benchmarks/vcf_index_tbi/{file}.tsv"
     message:
         "Indexing VCF with bcftools"
     version:
@@ -23,9 +22,89 @@ rule vcf_index_tbi:
         "../envs/bcftools.yaml"
     log:
         "logs/bcftools/index/{file}.log"
+    wildcard_constraints:
+        file = r"[^/]+"
     params:
-        config["params"].get("bcftools_index", "")
+        config["params"].get("bcftools_index", ""),
+        telemetry = get_telemetry("vcf_index_tbi")
     shell:
+        "{params.telemetry}"
         "bcftools index --tbi --threads {threads} "
-        "--force {input} --output-file {output} "
+        "--force {input} --output-file {output[0]} "
+        "> {log} 2>&1"
+
+
+"""
+This rule lists the genome contigs as a BED file. Known sites are
+restricted to these contigs when no capture targets are given.
+"""
+rule fasta_contigs_bed:
+    input:
+        refs_pack_dict["faidx"]
+    output:
+        "genome/contigs.bed",
+        **get_telemetry_output("fasta_contigs_bed")
+    threads:
+        1
+    resources:
+        mem_mb = get_resource("fasta_contigs_bed", "mem_mb"),
+        runtime = get_resource("fasta_contigs_bed", "time_min")
+    benchmark:
+        "benchmarks/fasta_contigs_bed/contigs.tsv"
+    message:
+        "Listing genome contigs"
+    version:
+        1
+    log:
+        "logs/bcftools/contigs.log"
+    params:
+        telemetry = get_telemetry("fasta_contigs_bed")
+    shell:
+        "{params.telemetry}"
+        "awk 'BEGIN {{OFS=\"\\t\"}} {{print $1, 0, $2}}' {input} "
+        "> {output[0]} 2> {log}"
+
+
+"""
+This rule compacts known sites, when workflow/compact_known is set: only
+the sites within the padded capture targets (or the genome contigs) are
+kept, without genotypes nor INFO fields, since BQSR only masks their
+positions. The compacted file is indexed in the same job.
+More information at:
+https://samtools.github.io/bcftools/bcftools.html
+"""
+rule compact_known_sites:
+    input:
+        vcf = "genome/{file}.vcf.gz",
+        regions = refs_pack_dict.get("known_regions", [])
+    output:
+        vcf = "genome/compact/{file}.vcf.gz",
+        index = "genome/compact/{file}.vcf.gz.tbi",
+        **get_telemetry_output("compact_known_sites", "file")
+    threads:
+        get_threads("compact_known_sites")
+    resources:
+        mem_mb = get_resource("compact_known_sites", "mem_mb"),
+        runtime = get_resource("compact_known_sites", "time_min")
+    benchmark:
+        "benchmarks/compact_known_sites/{file}.tsv"
+    message:
+        "Compacting {wildcards.file} known sites with bcftools"
+    version:
+        1
+    conda:
+        "../envs/bcftools.yaml"
+    log:
+        "logs/bcftools/compact/{file}.log"
+    wildcard_constraints:
+        file = r"[^/]+"
+    params:
+        telemetry = get_telemetry("compact_known_sites")
+    shell:
+        "{params.telemetry}"
+        "(bcftools view --targets-file {input.regions} --drop-genotypes "
+        "--output-type u {input.vcf} "
+        "| bcftools annotate --remove INFO --threads {threads} "
+        "--output-type z --output-file {output.vcf} "
+        "&& bcftools index --tbi --threads {threads} {output.vcf}) "
         "> {log} 2>&1"
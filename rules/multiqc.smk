@@ -7,7 +7,7 @@ https://snakemake-wrappers.readthedocs.io/en/stable/wrappers/multiqc.html
 """
 rule multiqc:
     input:
-        **get_targets(no_multiqc=True)
+        unpack(get_quality_targets)
     output:
         report(
             "qc/multiqc_report.html",
@@ -18,12 +18,10 @@ rule multiqc:
     params: ""
     threads: 1
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048, 4096)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 10, 60)
-        )
+        mem_mb = get_resource("multiqc", "mem_mb"),
+        runtime = get_resource("multiqc", "time_min")
+    benchmark:
+        "benchmarks/multiqc/multiqc.tsv"
     version: "1.0"
     log:
         "logs/multiqc.log"
@@ -31,3 +29,81 @@ rule multiqc:
         "Gathering quality reports with MultiQC"
     wrapper:
         f"{swv}/bio/multiqc"
+
+
+"""
+This rule parses the quality controls of one sample into a compact record,
+when workflow/incremental_qc is set. A new sample only adds its own record,
+the quality controls of the other samples are not read again.
+More information with:
+python3 scripts/qc_records.py record --help
+"""
+rule qc_record:
+    input:
+        unpack(get_qc_record_inputs)
+    output:
+        "qc/records/{sample}.json",
+        **get_telemetry_output("qc_record", "sample")
+    message:
+        "Recording quality controls of {wildcards.sample}"
+    threads: 1
+    group:
+        get_group("qc_record")
+    resources:
+        mem_mb = get_resource("qc_record", "mem_mb"),
+        runtime = get_resource("qc_record", "time_min")
+    benchmark:
+        "benchmarks/qc_record/{sample}.tsv"
+    version: "1.0"
+    log:
+        "logs/qc/records/{sample}.log"
+    params:
+        telemetry = get_telemetry("qc_record"),
+        script = records_script,
+        inputs = (
+            lambda wildcards, input: " ".join(
+                f"--{key.replace('_', '-')} " + (
+                    files if isinstance(files, str) else " ".join(files)
+                )
+                for key, files in input.items()
+            )
+        )
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} record --sample {wildcards.sample} "
+        "{params.inputs} --output {output[0]} > {log} 2>&1"
+
+
+"""
+This rule gathers the records of all samples into the cohort tables read
+by MultiQC, when workflow/incremental_qc is set.
+More information with:
+python3 scripts/qc_records.py aggregate --help
+"""
+rule qc_cohort:
+    input:
+        expand("qc/records/{sample}.json", sample=sample_id_list)
+    output:
+        fastq = "qc/cohort/fastq_mqc.tsv",
+        samples = "qc/cohort/samples_mqc.tsv",
+        **get_telemetry_output("qc_cohort")
+    message:
+        "Building cohort quality tables"
+    threads: 1
+    resources:
+        mem_mb = get_resource("qc_cohort", "mem_mb"),
+        runtime = get_resource("qc_cohort", "time_min")
+    benchmark:
+        "benchmarks/qc_cohort/qc_cohort.tsv"
+    version: "1.0"
+    log:
+        "logs/qc/cohort.log"
+    params:
+        telemetry = get_telemetry("qc_cohort"),
+        script = records_script,
+        design = op.abspath(config["design"])
+    shell:
+        "{params.telemetry}"
+        "python3 {params.script} aggregate qc/records "
+        "--design {params.design} --fastq {output.fastq} "
+        "--samples {output.samples} > {log} 2>&1"
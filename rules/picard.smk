@@ -4,28 +4,43 @@ the @RG, @SM, ... tags within bam file.
 """
 rule picard_add_or_replace_group:
     input:
-        "samtools/filtered/{sample}.bam"
+        bam = f"samtools/filtered/{{sample}}.{aln_ext}"
     output:
-        temp("picard/groups/{sample}.bam")
+        temp(f"picard/groups/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("picard_add_or_replace_group", "sample")
     message:
         "Replacing groups within {wildcards.sample} with Picard"
     threads:
         1
-    version:
-        swv
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
+    group:
+        get_group("picard_add_or_replace_group")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 60, 120)
+        mem_mb = get_resource("picard_add_or_replace_group", "mem_mb"),
+        runtime = get_resource("picard_add_or_replace_group", "time_min")
+    benchmark:
+        "benchmarks/picard_add_or_replace_group/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_mapping", False) is not True
         )
     log:
         "logs/picard/groups/{sample}.log"
     params:
-        config["params"].get("picard_group_extra", "")
-    wrapper:
-        f"{swv}/bio/picard/addorreplacereadgroups"
+        telemetry = get_telemetry("picard_add_or_replace_group"),
+        extra = " ".join([
+            config["params"].get("picard_group_extra", ""),
+            get_picard_reference()
+        ]),
+        java_opts = lambda wildcards, resources: f"-Xmx{resources.mem_mb}m",
+        scratch = get_scratch("picard_add_or_replace_group", "bam", 1)
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}picard {params.java_opts} AddOrReplaceReadGroups "
+        "{params.extra} INPUT={input.bam} OUTPUT={output[0]} "
+        "TMP_DIR=$scratch) > {log} 2>&1"
 
 
 """
@@ -33,29 +48,102 @@ This rule marks duplicates in bam file
 """
 rule picard_mark_duplicates:
     input:
-        "picard/groups/{sample}.bam"
+        bam = f"picard/groups/{{sample}}.{aln_ext}"
     output:
-        bam = temp("picard/deduplicated/{sample}.bam"),
-        metrics = "picard/stats/duplicates/{sample}.metrics.txt"
+        bam = temp(f"picard/deduplicated/{{sample}}.{aln_ext}"),
+        metrics = "picard/stats/duplicates/{sample}.metrics.txt",
+        **get_telemetry_output("picard_mark_duplicates", "sample")
     message:
         "Dealing with duplicates in {wildcards.sample} with Picard"
     threads:
         1
-    version:
-        swv
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45 + 60, 240)
+        mem_mb = get_resource("picard_mark_duplicates", "mem_mb"),
+        runtime = get_resource("picard_mark_duplicates", "time_min")
+    benchmark:
+        "benchmarks/picard_mark_duplicates/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is not True
+            and config.get("dedup_backend", "picard") == "picard"
+            and config["workflow"].get("spark", False) is not True
         )
     log:
         "logs/picard/duplicates/{sample}.log"
     params:
-        config["params"].get("picard_dedup_extra", "")
-    wrapper:
-        f"{swv}/bio/picard/markduplicates"
+        telemetry = get_telemetry("picard_mark_duplicates"),
+        extra = " ".join([
+            config["params"].get("picard_dedup_extra", ""),
+            get_picard_reference()
+        ]),
+        java_opts = lambda wildcards, resources: f"-Xmx{resources.mem_mb}m",
+        scratch = get_scratch("picard_mark_duplicates", "bam", 1)
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}picard {params.java_opts} MarkDuplicates "
+        "{params.extra} INPUT={input.bam} OUTPUT={output.bam} "
+        "METRICS_FILE={output.metrics} TMP_DIR=$scratch) > {log} 2>&1"
+
+
+"""
+This rule marks duplicates, then recomputes NM, MD and UQ tags and indexes
+the result within the same stream, instead of writing the deduplicated
+alignments and reading them twice. It replaces picard_mark_duplicates,
+gatk_SetNmMdAndUqTags and samtools_index when workflow/fused_dedup is set.
+"""
+rule picard_mark_duplicates_tags:
+    input:
+        bam = f"picard/groups/{{sample}}.{aln_ext}",
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"]
+    output:
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        index = f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}",
+        metrics = "picard/stats/duplicates/{sample}.metrics.txt",
+        **get_telemetry_output("picard_mark_duplicates_tags", "sample")
+    message:
+        "Marking duplicates and fixing tags in {wildcards.sample} with Picard"
+    threads:
+        1
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
+    resources:
+        mem_mb = get_resource("picard_mark_duplicates_tags", "mem_mb"),
+        runtime = get_resource("picard_mark_duplicates_tags", "time_min")
+    benchmark:
+        "benchmarks/picard_mark_duplicates_tags/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is True
+            and config.get("dedup_backend", "picard") == "picard"
+        )
+    log:
+        "logs/picard/duplicates/{sample}.log"
+    params:
+        telemetry = get_telemetry("picard_mark_duplicates_tags"),
+        extra = config["params"].get("picard_dedup_extra", ""),
+        # Both Picard tools share the job memory
+        java_opts = (
+            lambda wildcards, resources: f"-Xmx{resources.mem_mb // 2}m"
+        ),
+        fmt = get_samtools_format() or "-b",
+        scratch = get_scratch("picard_mark_duplicates_tags", "bam", 1)
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}picard {params.java_opts} MarkDuplicates "
+        "{params.extra} INPUT={input.bam} OUTPUT=/dev/stdout "
+        "METRICS_FILE={output.metrics} REFERENCE_SEQUENCE={input.ref} "
+        "COMPRESSION_LEVEL=0 TMP_DIR=$scratch "
+        "| picard {params.java_opts} SetNmMdAndUqTags INPUT=/dev/stdin "
+        "OUTPUT=/dev/stdout REFERENCE_SEQUENCE={input.ref} "
+        "COMPRESSION_LEVEL=0 TMP_DIR=$scratch "
+        "| samtools view {params.fmt} --write-index "
+        "-o {output.bam}##idx##{output.index} -) > {log} 2>&1"
 
 
 """
@@ -63,7 +151,7 @@ This rule collect metrics on aligned reads with picard tools.
 """
 rule picard_alignment_summary:
     input:
-        bam = "gatk/recal/{sample}.bam",
+        bam = f"gatk/recal/{{sample}}.{aln_ext}",
         ref = refs_pack_dict["fasta"]
     output:
         report(
@@ -78,12 +166,16 @@ rule picard_alignment_summary:
         1
     version:
         swv
+    group:
+        get_group("picard_alignment_summary")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 1024, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 60, 180)
+        mem_mb = get_resource("picard_alignment_summary", "mem_mb"),
+        runtime = get_resource("picard_alignment_summary", "time_min")
+    benchmark:
+        "benchmarks/picard_alignment_summary/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_qc", False) is not True
         )
     log:
         "logs/picard/stats/{sample}.summary.log"
@@ -98,7 +190,7 @@ This rule collect metrics on insert size of paired end reads with picard tools.
 """
 rule picard_insert_size:
     input:
-        "gatk/recal/{sample}.bam"
+        f"gatk/recal/{{sample}}.{aln_ext}"
     output:
         txt = "picard/stats/size/{sample}.isize.txt",
         pdf = report(
@@ -113,21 +205,216 @@ rule picard_insert_size:
         1
     version:
         swv
+    group:
+        get_group("picard_insert_size")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 1024, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45 + 60, 180)
+        mem_mb = get_resource("picard_insert_size", "mem_mb"),
+        runtime = get_resource("picard_insert_size", "time_min")
+    benchmark:
+        "benchmarks/picard_insert_size/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_qc", False) is not True
         )
     log:
         "logs/picard/stats/{sample}.isize.log"
     params:
-        config["params"].get("picard_isize_extra", "")
+        " ".join([
+            config["params"].get("picard_isize_extra", ""),
+            get_picard_reference()
+        ])
     wrapper:
         f"{swv}/bio/picard/collectinsertsizemetrics"
 
 
+"""
+This rule reads the final alignments once, and streams them to all quality
+collectors at the same time: Picard alignment summary, insert size and
+base quality distribution, samtools stats and flagstat. It replaces
+picard_alignment_summary and picard_insert_size when workflow/fused_qc is
+set, and writes their metrics at the same paths.
+"""
+rule picard_collect_multiple_metrics:
+    input:
+        bam = f"gatk/recal/{{sample}}.{aln_ext}",
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"]
+    output:
+        summary = "picard/stats/summary/{sample}_summary.txt",
+        quality = "picard/stats/quality/{sample}.quality_distribution.txt",
+        stats = "samtools/stats/{sample}.stats.txt",
+        flagstat = "samtools/flagstat/{sample}.flagstat.txt",
+        **(
+            {
+                "isize": "picard/stats/size/{sample}.isize.txt",
+                "pdf": "picard/stats/size/{sample}.isize.pdf"
+            }
+            if "Downstream_file" in design.columns.tolist() else {}
+        ),
+        **get_telemetry_output("picard_collect_multiple_metrics", "sample")
+    message:
+        "Collecting all alignment metrics from {wildcards.sample} at once"
+    threads:
+        get_threads("picard_collect_multiple_metrics")
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
+    group:
+        get_group("picard_collect_multiple_metrics")
+    resources:
+        mem_mb = get_resource("picard_collect_multiple_metrics", "mem_mb"),
+        runtime = get_resource("picard_collect_multiple_metrics", "time_min")
+    benchmark:
+        "benchmarks/picard_collect_multiple_metrics/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(config["workflow"].get("fused_qc", False) is True)
+    log:
+        "logs/picard/stats/{sample}.multiple.log"
+    params:
+        telemetry = get_telemetry("picard_collect_multiple_metrics"),
+        # Raw Picard metrics and streams are removed along with the scratch
+        prefix = "$scratch/{sample}",
+        programs = " ".join(
+            f"PROGRAM={program}"
+            for program in [
+                "null", "CollectAlignmentSummaryMetrics",
+                "CollectInsertSizeMetrics", "QualityScoreDistribution"
+            ]
+        ),
+        extra = " ".join([
+            config["params"].get("picard_summary_extra", ""),
+            config["params"].get("picard_isize_extra", "")
+        ]),
+        java_opts = lambda wildcards, resources: f"-Xmx{resources.mem_mb}m",
+        reference = f"--reference {refs_pack_dict['fasta']}",
+        # Picard names metrics after the prefix, MultiQC after the input
+        rename = lambda wildcards, input, output: " && ".join(
+            f"sed 's|INPUT=/dev/stdin|INPUT={input.bam}|' "
+            f"$scratch/{wildcards.sample}.{suffix} "
+            f"> {getattr(output, key)}"
+            for key, suffix in [
+                ("summary", "alignment_summary_metrics"),
+                ("quality", "quality_distribution_metrics"),
+                ("isize", "insert_size_metrics")
+            ]
+            if key in output.keys()
+        ) + (
+            f" && mv $scratch/{wildcards.sample}"
+            f".insert_size_histogram.pdf {output.pdf}"
+            if "pdf" in output.keys() else ""
+        ),
+        scratch = get_scratch("picard_collect_multiple_metrics")
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}"
+        "mkfifo {params.prefix}.stats.fifo {params.prefix}.flagstat.fifo ; "
+        "samtools stats -@ {threads} {params.reference} "
+        "{params.prefix}.stats.fifo > {output.stats} & stats=$! ; "
+        "samtools flagstat -@ {threads} "
+        "{params.prefix}.flagstat.fifo > {output.flagstat} & flagstat=$! ; "
+        "samtools view -@ {threads} -u {params.reference} {input.bam} "
+        "| tee {params.prefix}.stats.fifo {params.prefix}.flagstat.fifo "
+        "| picard {params.java_opts} CollectMultipleMetrics "
+        "INPUT=/dev/stdin OUTPUT={params.prefix} "
+        "REFERENCE_SEQUENCE={input.ref} {params.programs} {params.extra} "
+        "TMP_DIR=$scratch && "
+        "wait $stats && wait $flagstat && "
+        "{params.rename}) > {log} 2>&1"
+
+
+"""
+This rule collects hybrid selection metrics (on-target rate, fold-80 base
+penalty, ...) over the capture targets, with Picard tools.
+"""
+rule picard_hs_metrics:
+    input:
+        bam = f"gatk/recal/{{sample}}.{aln_ext}",
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"],
+        targets = refs_pack_dict.get("targets", [])
+    output:
+        report(
+            "picard/stats/hs/{sample}.hs_metrics.txt",
+            caption="../report/picard_hs.rst",
+            category="Quality",
+            subcategory="Picard"
+        ),
+        **get_telemetry_output("picard_hs_metrics", "sample")
+    message:
+        "Collecting hybrid selection metrics on {wildcards.sample} with Picard"
+    threads:
+        1
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
+    group:
+        get_group("picard_hs_metrics")
+    resources:
+        mem_mb = get_resource("picard_hs_metrics", "mem_mb"),
+        runtime = get_resource("picard_hs_metrics", "time_min")
+    benchmark:
+        "benchmarks/picard_hs_metrics/{sample}.tsv"
+    wildcard_constraints:
+        sample = r"[^/]+"
+    log:
+        "logs/picard/stats/{sample}.hs.log"
+    params:
+        telemetry = get_telemetry("picard_hs_metrics"),
+        extra = config["params"].get("picard_hs_extra", ""),
+        java_opts = lambda wildcards, resources: f"-Xmx{resources.mem_mb}m",
+        scratch = get_scratch("picard_hs_metrics")
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}picard {params.java_opts} CollectHsMetrics "
+        "{params.extra} INPUT={input.bam} OUTPUT={output[0]} "
+        "REFERENCE_SEQUENCE={input.ref} BAIT_INTERVALS={input.targets} "
+        "TARGET_INTERVALS={input.targets} TMP_DIR=$scratch) > {log} 2>&1"
+
+
+"""
+This rule converts the capture targets into Picard interval lists, checked
+against the sequence dictionnary, then pads them. Padded targets are also
+written as a BED file, for samtools.
+"""
+rule picard_bed_to_interval_list:
+    input:
+        bed = refs_pack_dict.get("targets_bed", []),
+        ref_dict = refs_pack_dict["fadict"]
+    output:
+        targets = "genome/capture.interval_list",
+        padded = "genome/capture.padded.interval_list",
+        padded_bed = "genome/capture.padded.bed",
+        **get_telemetry_output("picard_bed_to_interval_list")
+    message:
+        "Building capture targets interval lists"
+    threads:
+        1
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
+    resources:
+        mem_mb = get_resource("picard_bed_to_interval_list", "mem_mb"),
+        runtime = get_resource("picard_bed_to_interval_list", "time_min")
+    benchmark:
+        "benchmarks/picard_bed_to_interval_list/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
+    log:
+        "logs/picard/bed_to_interval_list.log"
+    params:
+        telemetry = get_telemetry("picard_bed_to_interval_list"),
+        padding = config.get("target_padding", 100)
+    shell:
+        "{params.telemetry}"
+        "(picard BedToIntervalList INPUT={input.bed} "
+        "SEQUENCE_DICTIONARY={input.ref_dict} OUTPUT={output.targets} && "
+        "picard IntervalListTools INPUT={output.targets} "
+        "PADDING={params.padding} OUTPUT={output.padded} && "
+        "picard IntervalListToBed INPUT={output.padded} "
+        "OUTPUT={output.padded_bed}) > {log} 2>&1"
+
+
 """
 This rule re-builds fasta dictionnaries to avoid version issue
 """
@@ -143,12 +430,13 @@ rule picard_create_sequence_dictionnary:
     threads:
         1
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 1024, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45 + 60, 180)
+        mem_mb = get_resource("picard_create_sequence_dictionnary", "mem_mb"),
+        runtime = get_resource(
+            "picard_create_sequence_dictionnary", "time_min"
         )
+    benchmark:
+        "benchmarks/picard_create_sequence_dictionnary/"
+        f"{op.basename(refs_pack_dict['fasta'])}.tsv"
     params:
         extra = config["params"].get("picard_sequence_dict_extra", "")
     version:
@@ -3,58 +3,72 @@ This rule sorts reads by name for fixmate
 """
 rule samtools_sort_query:
     input:
-        "bwa/mapping/{sample}.bam"
+        bam = "bwa/mapping/{sample}.bam",
+        **cram_reference_dict
     output:
-        temp("samtools/query_sort/{sample}.bam")
+        temp(f"samtools/query_sort/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("samtools_sort_query", "sample")
     message:
         "Sorting {wildcards.sample} reads by query name for fixing mates"
     threads:
-        1
+        get_threads("samtools_sort_query")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 8192 + 2048, 24576)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 75, 225)
-        )
+        mem_mb = get_resource("samtools_sort_query", "mem_mb"),
+        runtime = get_resource("samtools_sort_query", "time_min")
+    benchmark:
+        "benchmarks/samtools_sort_query/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/samtools.yaml"
     log:
         "logs/samtools/query_sort_{sample}.log"
     params:
-        f"-m {config['params'].get('samtools_sort_memory', '8')}G -n"
-    wrapper:
-        f"{swv}/bio/samtools/sort"
+        telemetry = get_telemetry("samtools_sort_query"),
+        scratch = get_scratch("samtools_sort_query", "bam"),
+        memory = get_sort_memory,
+        extra = f"-n {get_samtools_format()}"
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}samtools sort -@ {threads} -m {params.memory} "
+        "{params.extra} -T $scratch/sort -o {output[0]} {input.bam}) "
+        "> {log} 2>&1"
 
 
 """
 This rule uses Samtools to perform fix mate operation on
-BWA output. It does not use any wrapper since (1) it does
-not exists, and (2) co-workers are currently writing the
-wrapper
+BWA output, reading mates sorted by query name.
 """
 rule samtools_fixmate:
     input:
-        "samtools/query_sort/{sample}.bam"
+        bam = f"samtools/query_sort/{{sample}}.{aln_ext}",
+        **cram_reference_dict
     output:
-        temp("samtools/fixmate/{sample}.bam")
+        temp(f"samtools/fixmate/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("samtools_fixmate", "sample")
     message:
         "Fixing mates in {wildcards.sample} BWA's output"
     threads:
-        1
+        get_threads("samtools_fixmate")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45, 180)
-        )
-    version:
-        swv
+        mem_mb = get_resource("samtools_fixmate", "mem_mb"),
+        runtime = get_resource("samtools_fixmate", "time_min")
+    benchmark:
+        "benchmarks/samtools_fixmate/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/samtools.yaml"
     log:
         "logs/samtools/fixmate_{sample}.log"
     params:
-        extra = config["params"].get("samtools_fixmate_extra", "")
-    wrapper:
-        f"{swv}/bio/samtools/fixmate"
+        telemetry = get_telemetry("samtools_fixmate"),
+        extra = " ".join([
+            config["params"].get("samtools_fixmate_extra", ""),
+            get_samtools_format()
+        ])
+    shell:
+        "{params.telemetry}"
+        "samtools fixmate {params.extra} -@ {threads} {input.bam} "
+        "{output[0]} > {log} 2>&1"
 
 
 """
@@ -62,28 +76,34 @@ This rule sorts reads by position for further analyses
 """
 rule samtools_sort_coordinate:
     input:
-        "samtools/fixmate/{sample}.bam"
+        bam = f"samtools/fixmate/{{sample}}.{aln_ext}"
     output:
-        temp("samtools/position_sort/{sample}.bam")
+        temp(f"samtools/position_sort/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("samtools_sort_coordinate", "sample")
     message:
         "Sorting {wildcards.sample} reads by query name for fixing mates"
     threads:
-        1
+        get_threads("samtools_sort_coordinate")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 8192 + 2048, 24576)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 75, 225)
-        )
-    version:
-        swv
+        mem_mb = get_resource("samtools_sort_coordinate", "mem_mb"),
+        runtime = get_resource("samtools_sort_coordinate", "time_min")
+    benchmark:
+        "benchmarks/samtools_sort_coordinate/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/samtools.yaml"
     log:
         "logs/samtools/query_sort_{sample}.log"
     params:
-        f"-m {config['params'].get('samtools_sort_memory', '8')}G"
-    wrapper:
-        f"{swv}/bio/samtools/sort"
+        telemetry = get_telemetry("samtools_sort_coordinate"),
+        scratch = get_scratch("samtools_sort_coordinate", "bam"),
+        memory = get_sort_memory,
+        extra = get_samtools_format()
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}samtools sort -@ {threads} -m {params.memory} "
+        "{params.extra} -T $scratch/sort -o {output[0]} {input.bam}) "
+        "> {log} 2>&1"
 
 
 """
@@ -91,28 +111,34 @@ This rule remove unmapped mates as GATK does not allow them
 """
 rule samtools_filter_unmaped:
     input:
-        "samtools/position_sort/{sample}.bam"
+        bam = f"samtools/position_sort/{{sample}}.{aln_ext}",
+        **target_filter_dict
     output:
-        temp("samtools/filtered/{sample}.bam")
+        temp(f"samtools/filtered/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("samtools_filter_unmaped", "sample")
     message:
         "Removing unmated reads in {wildcards.sample}"
     threads:
-        1
+        get_threads("samtools_filter_unmaped")
+    group:
+        get_group("samtools_filter_unmaped")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45, 180)
-        )
-    version:
-        swv
+        mem_mb = get_resource("samtools_filter_unmaped", "mem_mb"),
+        runtime = get_resource("samtools_filter_unmaped", "time_min")
+    benchmark:
+        "benchmarks/samtools_filter_unmaped/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/samtools.yaml"
     log:
         "logs/samtools/filter_{sample}.log"
     params:
-        config["params"].get("samtools_view", "")
-    wrapper:
-        f"{swv}/bio/samtools/view"
+        telemetry = get_telemetry("samtools_filter_unmaped"),
+        extra = " ".join([get_samtools_view(), get_samtools_format()])
+    shell:
+        "{params.telemetry}"
+        "samtools view {params.extra} -@ {threads} -o {output[0]} "
+        "{input.bam} > {log} 2>&1"
 
 
 """
@@ -120,23 +146,27 @@ This rule indexes bam files bafore BQSR
 """
 rule samtools_index:
     input:
-        "gatk/setmnanduqtags/{sample}.bam"
+        f"gatk/setmnanduqtags/{{sample}}.{aln_ext}"
     output:
-        "gatk/setmnanduqtags/{sample}.bam.bai"
+        f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}"
     message:
         "Indexing {wildcards.sample} right before BQSR"
     threads:
-        1
+        get_threads("samtools_index")
     params:
-        ""
+        lambda wildcards, threads: f"-@ {threads}"
     version:
         swv
+    group:
+        get_group("samtools_index")
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45, 180)
+        mem_mb = get_resource("samtools_index", "mem_mb"),
+        runtime = get_resource("samtools_index", "time_min")
+    benchmark:
+        "benchmarks/samtools_index/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is not True
         )
     log:
         "logs/samtools/index/setmnanduqtags_{sample}.log"
@@ -157,12 +187,10 @@ rule samtools_faidx:
     threads:
         1
     resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048 + 2048, 8192)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 45, 180)
-        )
+        mem_mb = get_resource("samtools_faidx", "mem_mb"),
+        runtime = get_resource("samtools_faidx", "time_min")
+    benchmark:
+        "benchmarks/samtools_faidx/{fasta}.tsv"
     params:
         config["params"].get("samtools_faidx_extra", "")
     version:
@@ -171,3 +199,203 @@ rule samtools_faidx:
         "logs/samtools/faidx/{fasta}.log"
     wrapper:
         f"{swv}/bio/samtools/faidx"
+
+
+"""
+This rule merges the coordinate-sorted chunks of a sample mapped
+independently by bwa_mem_chunk. Identical read groups and program
+lines are collapsed, so the merged header matches a single-job mapping.
+"""
+rule samtools_merge_chunks:
+    input:
+        chunks = get_mapping_chunks,
+        **cram_reference_dict
+    output:
+        temp(
+            f"picard/groups/{{sample}}.{aln_ext}"
+            if config["workflow"].get("fused_mapping", False) is True
+            else "bwa/mapping/{sample}.bam"
+        ),
+        **get_telemetry_output("samtools_merge_chunks", "sample")
+    message:
+        "Merging mapped chunks of {wildcards.sample}"
+    threads:
+        get_threads("samtools_merge_chunks")
+    resources:
+        mem_mb = get_resource("samtools_merge_chunks", "mem_mb"),
+        runtime = get_resource("samtools_merge_chunks", "time_min")
+    benchmark:
+        "benchmarks/samtools_merge_chunks/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    wildcard_constraints:
+        sample = used_when(config.get("mapping_chunk_reads", 0) > 0)
+    params:
+        telemetry = get_telemetry("samtools_merge_chunks"),
+        fmt = (
+            get_samtools_format()
+            if config["workflow"].get("fused_mapping", False) is True
+            else ""
+        )
+    log:
+        "logs/samtools/merge_chunks_{sample}.log"
+    shell:
+        "{params.telemetry}"
+        "samtools merge -c -p -@ {threads} {params.fmt} "
+        "{output[0]} {input.chunks} > {log} 2>&1"
+
+
+"""
+This rule merges the lanes of a sample mapped independently by
+bwa_mem_lane. Read groups differ from one lane to another and are all
+kept, so duplicates are marked across lanes.
+"""
+rule samtools_merge_lanes:
+    input:
+        lanes = get_lane_bams,
+        **cram_reference_dict
+    output:
+        temp(f"picard/groups/{{sample}}.{aln_ext}"),
+        **get_telemetry_output("samtools_merge_lanes", "sample")
+    message:
+        "Merging mapped lanes of {wildcards.sample}"
+    threads:
+        get_threads("samtools_merge_lanes")
+    resources:
+        mem_mb = get_resource("samtools_merge_lanes", "mem_mb"),
+        runtime = get_resource("samtools_merge_lanes", "time_min")
+    benchmark:
+        "benchmarks/samtools_merge_lanes/{sample}.tsv"
+    version: "1.0"
+    conda:
+        "../envs/bwa.yaml"
+    wildcard_constraints:
+        sample = multi_lane_regex
+    params:
+        telemetry = get_telemetry("samtools_merge_lanes"),
+        fmt = get_samtools_format()
+    log:
+        "logs/samtools/merge_lanes_{sample}.log"
+    shell:
+        "{params.telemetry}"
+        "samtools merge -c -p -@ {threads} {params.fmt} "
+        "{output[0]} {input.lanes} > {log} 2>&1"
+
+
+"""
+This rule marks duplicates with samtools markdup, using the mate scores
+added by samtools fixmate -m. It is multi-threaded, and its statistics are
+converted into Picard metrics so MultiQC reads them as usual.
+"""
+rule samtools_markdup:
+    input:
+        bam = f"picard/groups/{{sample}}.{aln_ext}"
+    output:
+        bam = temp(f"picard/deduplicated/{{sample}}.{aln_ext}"),
+        metrics = "picard/stats/duplicates/{sample}.metrics.txt",
+        **get_telemetry_output("samtools_markdup", "sample")
+    message:
+        "Dealing with duplicates in {wildcards.sample} with Samtools"
+    threads:
+        get_threads("samtools_markdup")
+    resources:
+        mem_mb = get_resource("samtools_markdup", "mem_mb"),
+        runtime = get_resource("samtools_markdup", "time_min")
+    version: "1.0"
+    conda:
+        "../envs/samtools.yaml"
+    benchmark:
+        "benchmarks/samtools_markdup/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is not True
+            and config.get("dedup_backend", "picard") == "samtools"
+        )
+    log:
+        stats = "logs/samtools/markdup/{sample}.stats.txt",
+        log = "logs/samtools/markdup/{sample}.log"
+    params:
+        telemetry = get_telemetry("samtools_markdup"),
+        extra = config["params"].get("samtools_markdup_extra", ""),
+        library = (
+            lambda wildcards: get_read_group_fields(wildcards).get(
+                "LB", "Unknown Library"
+            )
+        ),
+        script = markdup_script,
+        fmt = get_samtools_format(),
+        scratch = get_scratch("samtools_markdup", "bam", 1)
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}samtools markdup {params.extra} {params.fmt} "
+        "-@ {threads} -T $scratch/markdup -f {log.stats} {input.bam} "
+        "{output.bam} && "
+        "python3 {params.script} {log.stats} --input {input.bam} "
+        "--library {params.library:q} --output {output.metrics}) "
+        "> {log.log} 2>&1"
+
+
+"""
+This rule marks duplicates with samtools markdup, then recomputes NM, MD
+and UQ tags and indexes the result within the same stream. It replaces
+samtools_markdup, gatk_SetNmMdAndUqTags and samtools_index when
+workflow/fused_dedup is set.
+"""
+rule samtools_markdup_tags:
+    input:
+        bam = f"picard/groups/{{sample}}.{aln_ext}",
+        ref = refs_pack_dict["fasta"],
+        ref_index = refs_pack_dict["faidx"],
+        ref_dict = refs_pack_dict["fadict"]
+    output:
+        bam = f"gatk/setmnanduqtags/{{sample}}.{aln_ext}",
+        index = f"gatk/setmnanduqtags/{{sample}}.{aln_index_ext}",
+        metrics = "picard/stats/duplicates/{sample}.metrics.txt",
+        **get_telemetry_output("samtools_markdup_tags", "sample")
+    message:
+        "Marking duplicates and fixing tags in {wildcards.sample} "
+        "with Samtools"
+    threads:
+        get_threads("samtools_markdup_tags")
+    resources:
+        mem_mb = get_resource("samtools_markdup_tags", "mem_mb"),
+        runtime = get_resource("samtools_markdup_tags", "time_min")
+    version: "1.0"
+    conda:
+        "../envs/picard.yaml"
+    benchmark:
+        "benchmarks/samtools_markdup_tags/{sample}.tsv"
+    wildcard_constraints:
+        sample = used_when(
+            config["workflow"].get("fused_dedup", False) is True
+            and config.get("dedup_backend", "picard") == "samtools"
+        )
+    log:
+        stats = "logs/samtools/markdup/{sample}.stats.txt",
+        log = "logs/samtools/markdup/{sample}.log"
+    params:
+        telemetry = get_telemetry("samtools_markdup_tags"),
+        extra = config["params"].get("samtools_markdup_extra", ""),
+        library = (
+            lambda wildcards: get_read_group_fields(wildcards).get(
+                "LB", "Unknown Library"
+            )
+        ),
+        script = markdup_script,
+        java_opts = lambda wildcards, resources: f"-Xmx{resources.mem_mb}m",
+        fmt = get_samtools_format() or "-b",
+        scratch = get_scratch("samtools_markdup_tags", "bam", 1)
+    shell:
+        "{params.telemetry}"
+        "({params.scratch}samtools markdup {params.extra} -@ {threads} "
+        "--output-fmt bam,level=0 --reference {input.ref} "
+        "-T $scratch/markdup -f {log.stats} {input.bam} - "
+        "| picard {params.java_opts} SetNmMdAndUqTags INPUT=/dev/stdin "
+        "OUTPUT=/dev/stdout REFERENCE_SEQUENCE={input.ref} "
+        "COMPRESSION_LEVEL=0 TMP_DIR=$scratch "
+        "| samtools view -@ {threads} {params.fmt} --write-index "
+        "-o {output.bam}##idx##{output.index} - && "
+        "python3 {params.script} {log.stats} --input {input.bam} "
+        "--library {params.library:q} --output {output.metrics}) "
+        "> {log.log} 2>&1"
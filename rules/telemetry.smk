@@ -0,0 +1,44 @@
+"""
+This rule summarizes the resources usage sampled along each job, when
+telemetry_interval is set: per-stage CPU, memory and IO utilisation, with
+the resource bounding each stage, and per-job timelines. Reads counts are
+taken from Picard alignment summaries when they are computed.
+More information with:
+python3 scripts/telemetry.py summarize --help
+"""
+rule telemetry_report:
+    input:
+        unpack(get_telemetry_targets)
+    output:
+        stages = report(
+            "telemetry/stages.tsv",
+            caption="../report/telemetry.rst",
+            category="Telemetry"
+        ),
+        timeline = report(
+            "telemetry/timeline.tsv",
+            caption="../report/telemetry.rst",
+            category="Telemetry"
+        )
+    message:
+        "Summarizing jobs resources usage"
+    threads: 1
+    resources:
+        mem_mb = get_resource("telemetry_report", "mem_mb"),
+        runtime = get_resource("telemetry_report", "time_min")
+    benchmark:
+        "benchmarks/telemetry_report/telemetry_report.tsv"
+    version: "1.0"
+    log:
+        "logs/telemetry.log"
+    params:
+        script = telemetry_script,
+        summaries = (
+            lambda wildcards, input: " ".join(
+                ["--alignment-summaries"] + input.picard_summary
+            ) if "picard_summary" in input.keys() else ""
+        )
+    shell:
+        "python3 {params.script} summarize telemetry "
+        "--stages {output.stages} --timeline {output.timeline} "
+        "{params.summaries} > {log} 2>&1"
@@ -0,0 +1,582 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script aggregates Snakemake benchmark files per pipeline stage (rule):
+number of jobs, wall time, CPU time, peak memory, bytes written and reads
+processed per second. Results may be compared against a stored baseline
+report, in which case stages slower or heavier than the baseline are
+flagged. Comparing a CRAM run against a BAM run of the same data shows
+the bytes saved, and the time spent compressing, at each stage.
+
+Benchmark files are expected under benchmarks/{rule}/, named after the
+sample they processed. Reads counts come from the simulation manifest
+written by simulate_wes.py. Mapping stages are named after the aligner
+engine (bwa_mem_fused, bwa_mem2_fused, ...), so reads processed per second
+are reported per engine.
+
+You can test this script with:
+pytest -v ./benchmark_report.py
+
+Usage example:
+python3.8 ./benchmark_report.py benchmarks --simulation simulation.json \
+    --baseline baseline.tsv --output report.tsv
+
+# Compare a CRAM run against a BAM run of the same data:
+python3.8 ./benchmark_report.py cram/benchmarks --baseline bam/report.tsv
+"""
+
+import argparse             # Parse command line
+import csv                  # Read/write TSV files
+import json                 # Simulation manifest
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import sys                  # System related methods
+
+from pathlib import Path                    # Paths related methods
+from typing import Any, Dict, List          # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+COLUMNS = [
+    "stage", "jobs", "wall_s", "cpu_s", "max_rss_mb", "written_mb",
+    "reads_per_s", "wall_change", "cpu_change", "rss_change",
+    "written_change", "status"
+]
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+def to_float(value: str) -> float:
+    """
+    Convert a benchmark value, "-" when not measured, into a float
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Reading benchmark files
+def read_job(path: Path) -> Dict[str, float]:
+    """
+    Summarize the benchmark file of one job. Repeated measures are
+    averaged, except memory which keeps its peak. CPU time is read from
+    the cpu_time column when available, or rebuilt from the mean load.
+    Bytes written come from the io_out column, in MB.
+
+    Parameters:
+        path    Path                Path to a benchmark file
+
+    Return:
+                Dict[str, float]    Wall time, CPU time, peak memory and
+                                    bytes written
+
+    Example:
+    >>> read_job(Path("benchmarks/bwa_mem/s1.tsv"))
+    {'wall_s': 60.0, 'cpu_s': 240.0, 'max_rss_mb': 5321.2,
+     'written_mb': 812.5}
+    """
+    with path.open() as benchmark:
+        rows = list(csv.DictReader(benchmark, delimiter="\t"))
+    if not rows:
+        raise ValueError(f"Empty benchmark file: {path}")
+
+    wall, cpu, rss, written = 0.0, 0.0, 0.0, 0.0
+    for row in rows:
+        seconds = to_float(row["s"])
+        wall += seconds
+        if "cpu_time" in row:
+            cpu += to_float(row["cpu_time"])
+        else:
+            cpu += to_float(row.get("mean_load")) / 100 * seconds
+        rss = max(rss, to_float(row.get("max_rss")))
+        written += to_float(row.get("io_out"))
+
+    return {
+        "wall_s": wall / len(rows),
+        "cpu_s": cpu / len(rows),
+        "max_rss_mb": rss,
+        "written_mb": written / len(rows)
+    }
+
+
+def test_read_job(tmp_path) -> None:
+    """
+    This function tests the benchmark files parsing
+
+    Example:
+    pytest -v benchmark_report.py -k test_read_job
+    """
+    path = tmp_path / "s1.tsv"
+    path.write_text(
+        "s\th:m:s\tmax_rss\tmean_load\n"
+        "10.0\t0:00:10\t100\t200\n"
+        "30.0\t0:00:30\t-\t100\n"
+    )
+    assert read_job(path) == {
+        "wall_s": 20, "cpu_s": 25, "max_rss_mb": 100, "written_mb": 0
+    }
+
+    path.write_text(
+        "s\tmax_rss\tio_out\tmean_load\tcpu_time\n10\t5\t42\t100\t7\n"
+    )
+    assert read_job(path)["cpu_s"] == 7
+    assert read_job(path)["written_mb"] == 42
+
+
+def summarize(benchmarks: Path,
+              reads: Dict[str, int]) -> Dict[str, Dict[str, float]]:
+    """
+    Aggregate benchmark files per stage. Reads per second are computed over
+    the jobs named after a known sample.
+
+    Parameters:
+        benchmarks  Path                Path to the benchmarks directory
+        reads       Dict[str, int]      Reads counts, by sample
+
+    Return:
+                    Dict[str, Dict]     Aggregated metrics, by stage
+
+    Example:
+    >>> summarize(Path("benchmarks"), {"sim1": 200000})
+    {'bwa_mem': {'jobs': 1, 'wall_s': 60.0, ..., 'reads_per_s': 3333.33}}
+    """
+    stages = {}
+    for stage in sorted(benchmarks.iterdir()):
+        if not stage.is_dir():
+            continue
+        summary = {
+            "jobs": 0, "wall_s": 0.0, "cpu_s": 0.0, "max_rss_mb": 0.0,
+            "written_mb": 0.0
+        }
+        samples, sample_wall = set(), 0.0
+        for path in sorted(stage.rglob("*.tsv")):
+            job = read_job(path)
+            summary["jobs"] += 1
+            summary["wall_s"] += job["wall_s"]
+            summary["cpu_s"] += job["cpu_s"]
+            summary["max_rss_mb"] = max(summary["max_rss_mb"],
+                                        job["max_rss_mb"])
+            summary["written_mb"] += job["written_mb"]
+            sample = path.relative_to(stage).parts[0].split(".")[0]
+            if sample in reads:
+                samples.add(sample)
+                sample_wall += job["wall_s"]
+
+        if summary["jobs"] == 0:
+            continue
+        summary["reads_per_s"] = (
+            sum(reads[sample] for sample in samples) / sample_wall
+            if sample_wall > 0 else ""
+        )
+        stages[stage.name] = summary
+
+    stages["total"] = {
+        "jobs": sum(stage["jobs"] for stage in stages.values()),
+        "wall_s": sum(stage["wall_s"] for stage in stages.values()),
+        "cpu_s": sum(stage["cpu_s"] for stage in stages.values()),
+        "max_rss_mb": max(
+            [stage["max_rss_mb"] for stage in stages.values()] or [0]
+        ),
+        "written_mb": sum(stage["written_mb"] for stage in stages.values()),
+        "reads_per_s": ""
+    }
+    return stages
+
+
+def test_summarize(tmp_path) -> None:
+    """
+    This function tests the aggregation per stage
+
+    Example:
+    pytest -v benchmark_report.py -k test_summarize
+    """
+    header = "s\tmax_rss\tmean_load\n"
+    (tmp_path / "bwa_mem").mkdir()
+    (tmp_path / "bwa_mem" / "sim1.tsv").write_text(header + "10\t100\t100\n")
+    (tmp_path / "bwa_mem" / "sim2.tsv").write_text(header + "30\t300\t200\n")
+    (tmp_path / "bwa_mem2").mkdir()
+    (tmp_path / "bwa_mem2" / "sim1.tsv").write_text(header + "5\t200\t100\n")
+    (tmp_path / "bwa_index").mkdir()
+    (tmp_path / "bwa_index" / "genome.fasta.tsv").write_text(
+        header + "5\t50\t100\n"
+    )
+    stages = summarize(tmp_path, {"sim1": 1000, "sim2": 3000})
+    assert stages["bwa_mem2"]["reads_per_s"] == 200
+    assert stages["bwa_mem"] == {
+        "jobs": 2, "wall_s": 40, "cpu_s": 70, "max_rss_mb": 300,
+        "written_mb": 0, "reads_per_s": 100
+    }
+    assert stages["bwa_index"]["reads_per_s"] == ""
+    assert stages["total"]["wall_s"] == 50
+    assert stages["total"]["max_rss_mb"] == 300
+
+
+# Comparing against a baseline
+def compare(stages: Dict[str, Dict[str, Any]],
+            baseline: Dict[str, Dict[str, Any]],
+            tolerance: float = 0.2,
+            min_seconds: float = 5,
+            min_mb: float = 100) -> Dict[str, Dict[str, Any]]:
+    """
+    Compare each stage against the baseline. A stage is flagged as a
+    regression when its wall time, CPU time, peak memory or bytes written
+    grows beyond the relative tolerance and the absolute noise floor.
+
+    Parameters:
+        stages      Dict[str, Dict]     Aggregated metrics, by stage
+        baseline    Dict[str, Dict]     Baseline metrics, by stage
+        tolerance   float               Accepted relative change
+        min_seconds float               Time changes ignored below this
+        min_mb      float               Memory and bytes written changes
+                                        ignored below this
+
+    Return:
+                    Dict[str, Dict]     Metrics with changes and status
+
+    Example:
+    >>> compare({"bwa_mem": {"wall_s": 90, ...}}, {"bwa_mem": {...}})
+    {'bwa_mem': {'wall_s': 90, ..., 'wall_change': 0.5, 'status': ...}}
+    """
+    floors = {
+        "wall": min_seconds, "cpu": min_seconds, "rss": min_mb,
+        "written": min_mb
+    }
+    columns = {
+        "wall": "wall_s", "cpu": "cpu_s", "rss": "max_rss_mb",
+        "written": "written_mb"
+    }
+
+    for name, stage in stages.items():
+        if name not in baseline:
+            stage["status"] = "new" if baseline else ""
+            continue
+
+        flags = set()
+        for metric, column in columns.items():
+            # Baselines may predate a metric
+            current = stage[column]
+            previous = to_float(baseline[name].get(column))
+            change = (current - previous) / previous if previous > 0 else 0
+            stage[f"{metric}_change"] = round(change, 4)
+            if abs(current - previous) < floors[metric]:
+                continue
+            if change > tolerance:
+                flags.add("regression")
+            elif change < -tolerance:
+                flags.add("improvement")
+
+        if "regression" in flags:
+            stage["status"] = "regression"
+        elif "improvement" in flags:
+            stage["status"] = "improvement"
+        else:
+            stage["status"] = "ok"
+
+    for name in baseline:
+        if name not in stages:
+            stages[name] = {"jobs": 0, "status": "missing"}
+
+    return stages
+
+
+def test_compare() -> None:
+    """
+    This function tests the baseline comparison
+
+    Example:
+    pytest -v benchmark_report.py -k test_compare
+    """
+    def stage(wall, cpu, rss, written=0):
+        return {
+            "wall_s": wall, "cpu_s": cpu, "max_rss_mb": rss,
+            "written_mb": written
+        }
+
+    baseline = {
+        "bwa_mem": stage(100, 400, 5000),
+        "fastqc": stage(10, 10, 200),
+        "multiqc": stage(2, 2, 100),
+        "samtools_index": stage(10, 10, 50),
+        "samtools_sort": stage(10, 10, 50, 1000),
+        "gone": stage(1, 1, 1)
+    }
+    stages = compare({
+        "bwa_mem": stage(130, 400, 5000),
+        "fastqc": stage(5, 5, 200),
+        "multiqc": stage(4, 4, 100),
+        "samtools_index": stage(10, 10, 500),
+        "samtools_sort": stage(10, 10, 50, 400),
+        "new_rule": stage(1, 1, 1)
+    }, baseline)
+    assert stages["bwa_mem"]["status"] == "regression"
+    assert stages["bwa_mem"]["wall_change"] == 0.3
+    assert stages["fastqc"]["status"] == "improvement"
+    assert stages["multiqc"]["status"] == "ok"
+    assert stages["samtools_index"]["status"] == "regression"
+    assert stages["samtools_sort"]["status"] == "improvement"
+    assert stages["samtools_sort"]["written_change"] == -0.6
+    assert stages["new_rule"]["status"] == "new"
+    assert stages["gone"]["status"] == "missing"
+
+
+def read_report(path: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Load a report written by this script, by stage
+    """
+    with path.open() as report:
+        return {
+            row["stage"]: row
+            for row in csv.DictReader(report, delimiter="\t")
+            if row["status"] != "missing"
+        }
+
+
+def write_report(stages: Dict[str, Dict[str, Any]], path: Path) -> None:
+    """
+    Write the report as a TSV file, one line per stage
+    """
+    with path.open("w") as report:
+        writer = csv.DictWriter(
+            report, fieldnames=COLUMNS, delimiter="\t", restval="",
+            lineterminator="\n"
+        )
+        writer.writeheader()
+        for name, stage in stages.items():
+            writer.writerow({
+                "stage": name,
+                **{
+                    key: round(value, 2) if isinstance(value, float) else value
+                    for key, value in stage.items()
+                }
+            })
+
+
+def test_write_report(tmp_path) -> None:
+    """
+    This function tests the report round trip, used to store baselines
+
+    Example:
+    pytest -v benchmark_report.py -k test_write_report
+    """
+    path = tmp_path / "report.tsv"
+    stages = {
+        "bwa_mem": {
+            "jobs": 1, "wall_s": 10.123, "cpu_s": 40.0, "max_rss_mb": 100.0,
+            "written_mb": 50.0, "reads_per_s": 10.0, "status": ""
+        }
+    }
+    write_report(stages, path)
+    report = read_report(path)
+    assert report["bwa_mem"]["wall_s"] == "10.12"
+    assert report["bwa_mem"]["wall_change"] == ""
+    assert compare(stages, report)["bwa_mem"]["status"] == "ok"
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("benchmarks"))
+    Namespace(baseline=None, benchmarks='benchmarks', debug=False,
+    fail_on_regression=False, min_mb=100, min_seconds=5,
+    output='/dev/stdout', quiet=False, simulation=None, tolerance=0.2)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    main_parser.add_argument(
+        "benchmarks",
+        help="Path to the benchmarks directory",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "-s", "--simulation",
+        help="Path to the simulation manifest, used to count reads",
+        type=str,
+        default=None
+    )
+
+    main_parser.add_argument(
+        "-b", "--baseline",
+        help="Path to a baseline report to compare with",
+        type=str,
+        default=None
+    )
+
+    main_parser.add_argument(
+        "-t", "--tolerance",
+        help="Accepted relative change before flagging a stage "
+             "(default: %(default)s)",
+        type=float,
+        default=0.2
+    )
+
+    main_parser.add_argument(
+        "--min-seconds",
+        help="Time changes below this are considered noise "
+             "(default: %(default)s)",
+        type=float,
+        default=5
+    )
+
+    main_parser.add_argument(
+        "--min-mb",
+        help="Memory or bytes written changes below this are considered "
+             "noise (default: %(default)s)",
+        type=float,
+        default=100
+    )
+
+    main_parser.add_argument(
+        "--fail-on-regression",
+        help="Exit with an error when a regression is flagged",
+        default=False,
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Path to output report (default: %(default)s)",
+        type=str,
+        default="/dev/stdout"
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v benchmark_report.py -k test_parse_args
+    """
+    options = parse_args(shlex.split("benchmarks -b baseline.tsv"))
+    expected = argparse.Namespace(
+        baseline="baseline.tsv",
+        benchmarks="benchmarks",
+        debug=False,
+        fail_on_regression=False,
+        min_mb=100,
+        min_seconds=5,
+        output="/dev/stdout",
+        quiet=False,
+        simulation=None,
+        tolerance=0.2
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> int:
+    """
+    This function builds the whole report, and returns the number of
+    regressions found
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Return:
+                int                 Number of regressions
+
+    Example:
+    >>> main(parse_args(shlex.split("benchmarks")))
+    0
+    """
+    reads = {}
+    if args.simulation is not None:
+        with open(args.simulation) as manifest:
+            reads = json.load(manifest)["samples"]
+
+    stages = summarize(Path(args.benchmarks), reads)
+
+    baseline = {}
+    if args.baseline is not None:
+        if Path(args.baseline).exists():
+            baseline = read_report(Path(args.baseline))
+        else:
+            logger.warning("No baseline found at %s", args.baseline)
+    stages = compare(
+        stages, baseline, args.tolerance, args.min_seconds, args.min_mb
+    )
+    write_report(stages, Path(args.output))
+
+    regressions = [
+        name for name, stage in stages.items()
+        if stage.get("status") == "regression"
+    ]
+    for name in regressions:
+        logger.warning("Performance regression: %s", name)
+    return len(regressions)
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Building benchmark report")
+        regressions = main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(1 if regressions > 0 and args.fail_on_regression else 0)
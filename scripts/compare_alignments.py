@@ -0,0 +1,405 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script checks that two runs of the pipeline produced equivalent
+alignments and duplicates metrics, e.g. the GATK Spark path against the
+classic Picard/GATK path on the same data.
+
+Alignments are compared as SAM records, whatever their order among reads
+starting at the same position, and without the @PG related tags that
+name the tools which wrote them. Duplicates metrics are compared column
+by column, except for the library name.
+
+You can test this script with:
+pytest -v ./compare_alignments.py
+
+Usage example:
+python3.8 ./compare_alignments.py <(samtools view classic/sim1.bam) \
+    <(samtools view spark/sim1.bam) \
+    --metrics classic/sim1.metrics.txt spark/sim1.metrics.txt
+"""
+
+import argparse             # Parse command line
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import sys                  # System related methods
+
+from collections import Counter             # Count hashable objects
+from pathlib import Path                    # Paths related methods
+from typing import Any, Dict, List          # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+# SAM tags written by the tools themselves, not by the alignment content
+IGNORED_TAGS = ["PG"]
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+# Comparing alignments
+def normalize_record(line: str) -> str:
+    """
+    Return a SAM record without the tags naming the tools, its other tags
+    sorted
+
+    Parameters:
+        line    str     A SAM record
+
+    Return:
+                str     The normalized record
+
+    Example:
+    >>> normalize_record("r1\\t99\\tchr1\\t...\\tPG:Z:MarkDuplicates\\tNM:i:0")
+    'r1\\t99\\tchr1\\t...\\tNM:i:0'
+    """
+    fields = line.rstrip("\n").split("\t")
+    tags = sorted(
+        tag for tag in fields[11:] if tag[:2] not in IGNORED_TAGS
+    )
+    return "\t".join(fields[:11] + tags)
+
+
+def test_normalize_record() -> None:
+    """
+    This function tests the SAM records normalization
+
+    Example:
+    pytest -v compare_alignments.py -k test_normalize_record
+    """
+    fields = "r1\t99\tchr1\t10\t60\t4M\t=\t20\t14\tACGT\tIIII"
+    record = f"{fields}\tPG:Z:MarkDuplicates\tRG:Z:1\tNM:i:0\n"
+    assert normalize_record(record) == f"{fields}\tNM:i:0\tRG:Z:1"
+    assert normalize_record(fields) == fields
+
+
+def compare_alignments(expected: List[str],
+                       observed: List[str],
+                       limit: int = 5) -> List[str]:
+    """
+    Return the differences between two sets of SAM records, header lines
+    excluded
+
+    Parameters:
+        expected    List[str]   Reference SAM records
+        observed    List[str]   Compared SAM records
+        limit       int         Maximum number of differing records listed
+
+    Return:
+                    List[str]   Differences, empty when equivalent
+
+    Example:
+    >>> compare_alignments(["r1\\t99\\t..."], ["r1\\t1123\\t..."])
+    ['1 records missing, 1 unexpected', 'missing: r1\\t99\\t...', ...]
+    """
+    def records(lines: List[str]) -> Counter:
+        return Counter(
+            normalize_record(line) for line in lines
+            if line.strip() != "" and not line.startswith("@")
+        )
+
+    expected, observed = records(expected), records(observed)
+    missing, unexpected = expected - observed, observed - expected
+    if not missing and not unexpected:
+        return []
+
+    differences = [
+        f"{sum(missing.values())} records missing, "
+        f"{sum(unexpected.values())} unexpected"
+    ]
+    differences += [f"missing: {record}" for record in missing][:limit]
+    differences += [f"unexpected: {record}" for record in unexpected][:limit]
+    return differences
+
+
+def test_compare_alignments() -> None:
+    """
+    This function tests the SAM records comparison
+
+    Example:
+    pytest -v compare_alignments.py -k test_compare_alignments
+    """
+    r1 = "r1\t99\tchr1\t10\t60\t4M\t=\t20\t14\tACGT\tIIII"
+    r2 = "r2\t99\tchr1\t10\t60\t4M\t=\t20\t14\tACGT\tIIII"
+    expected = ["@HD\tVN:1.6", f"{r1}\tPG:Z:MarkDuplicates", r2]
+    observed = ["@HD\tVN:1.6\tSO:coordinate", r2, f"{r1}\tPG:Z:Spark"]
+    assert compare_alignments(expected, observed) == []
+
+    duplicate = r2.replace("\t99\t", "\t1123\t")
+    differences = compare_alignments(expected, [r1, duplicate])
+    assert differences == [
+        "1 records missing, 1 unexpected",
+        f"missing: {r2}",
+        f"unexpected: {duplicate}"
+    ]
+
+
+# Comparing duplicates metrics
+def read_metrics(lines: List[str]) -> List[Dict[str, str]]:
+    """
+    Parse the rows of a Picard DuplicationMetrics file
+
+    Parameters:
+        lines   List[str]               Lines of the metrics file
+
+    Return:
+                List[Dict[str, str]]    Metrics rows, by column name
+
+    Example:
+    >>> read_metrics(["## METRICS CLASS\\t...", "LIBRARY\\t...", "lib\\t..."])
+    [{'LIBRARY': 'lib', ...}]
+    """
+    rows, header = [], None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("LIBRARY\t"):
+            header = line.split("\t")
+        elif header is not None and line.strip() == "":
+            break
+        elif header is not None:
+            rows.append(dict(zip(header, line.split("\t"))))
+    return rows
+
+
+def test_read_metrics() -> None:
+    """
+    This function tests the Picard metrics parsing
+
+    Example:
+    pytest -v compare_alignments.py -k test_read_metrics
+    """
+    lines = [
+        "## htsjdk.samtools.metrics.StringHeader",
+        "# MarkDuplicates INPUT=[a.bam]",
+        "## METRICS CLASS\tpicard.sam.DuplicationMetrics",
+        "LIBRARY\tREAD_PAIRS_EXAMINED\tPERCENT_DUPLICATION",
+        "standard\t100\t0.1",
+        "",
+        "## HISTOGRAM\tjava.lang.Double",
+        "BIN\tCoverageMult"
+    ]
+    assert read_metrics(lines) == [{
+        "LIBRARY": "standard",
+        "READ_PAIRS_EXAMINED": "100",
+        "PERCENT_DUPLICATION": "0.1"
+    }]
+
+
+def compare_metrics(expected: List[Dict[str, str]],
+                    observed: List[Dict[str, str]],
+                    tolerance: float = 1e-6) -> List[str]:
+    """
+    Return the differences between two sets of duplicates metrics rows.
+    Numbers are compared within a relative tolerance, since tools round
+    ratios differently.
+
+    Parameters:
+        expected    List[Dict[str, str]]    Reference metrics rows
+        observed    List[Dict[str, str]]    Compared metrics rows
+        tolerance   float                   Relative tolerance
+
+    Return:
+                    List[str]               Differences, empty when equal
+
+    Example:
+    >>> compare_metrics([{"READ_PAIR_DUPLICATES": "10"}],
+                        [{"READ_PAIR_DUPLICATES": "12"}])
+    ['READ_PAIR_DUPLICATES (row 1): expected 10, observed 12']
+    """
+    if len(expected) != len(observed):
+        return [f"expected {len(expected)} rows, observed {len(observed)}"]
+
+    differences = []
+    for index, (reference, compared) in enumerate(zip(expected, observed)):
+        for column, value in reference.items():
+            if column == "LIBRARY":
+                continue
+            other = compared.get(column, "")
+            try:
+                equal = abs(float(value or 0) - float(other or 0)) <= (
+                    tolerance * max(abs(float(value or 0)), 1)
+                )
+            except ValueError:
+                equal = value == other
+            if not equal:
+                differences.append(
+                    f"{column} (row {index + 1}): "
+                    f"expected {value}, observed {other}"
+                )
+    return differences
+
+
+def test_compare_metrics() -> None:
+    """
+    This function tests the duplicates metrics comparison
+
+    Example:
+    pytest -v compare_alignments.py -k test_compare_metrics
+    """
+    expected = [{
+        "LIBRARY": "standard", "READ_PAIR_DUPLICATES": "10",
+        "PERCENT_DUPLICATION": "0.1", "ESTIMATED_LIBRARY_SIZE": ""
+    }]
+    observed = [{
+        "LIBRARY": "Unknown Library", "READ_PAIR_DUPLICATES": "10",
+        "PERCENT_DUPLICATION": "0.1000000001", "ESTIMATED_LIBRARY_SIZE": ""
+    }]
+    assert compare_metrics(expected, observed) == []
+
+    observed[0]["READ_PAIR_DUPLICATES"] = "12"
+    assert compare_metrics(expected, observed) == [
+        "READ_PAIR_DUPLICATES (row 1): expected 10, observed 12"
+    ]
+    assert compare_metrics(expected, []) == ["expected 1 rows, observed 0"]
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("a.sam b.sam"))
+    Namespace(debug=False, expected='a.sam', metrics=None, observed='b.sam',
+    quiet=False)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    main_parser.add_argument(
+        "expected",
+        help="Path to the reference SAM records",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "observed",
+        help="Path to the compared SAM records",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "-m", "--metrics",
+        help="Paths to the reference and compared duplicates metrics",
+        type=str,
+        nargs=2,
+        default=None
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v compare_alignments.py -k test_parse_args
+    """
+    options = parse_args(shlex.split("a.sam b.sam --metrics a.txt b.txt"))
+    expected = argparse.Namespace(
+        debug=False,
+        expected="a.sam",
+        metrics=["a.txt", "b.txt"],
+        observed="b.sam",
+        quiet=False
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> int:
+    """
+    This function performs the whole comparison
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Return:
+                int                 The number of differences found
+
+    Example:
+    >>> main(parse_args(shlex.split("a.sam b.sam")))
+    """
+    with open(args.expected) as expected, open(args.observed) as observed:
+        differences = compare_alignments(expected, observed)
+
+    if args.metrics is not None:
+        expected, observed = (
+            read_metrics(Path(path).read_text().split("\n"))
+            for path in args.metrics
+        )
+        differences += compare_metrics(expected, observed)
+
+    for difference in differences:
+        logger.error(difference)
+    if not differences:
+        logger.info("Alignments and metrics are equivalent")
+    return len(differences)
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Comparing alignments")
+        differences = main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(1 if differences > 0 else 0)
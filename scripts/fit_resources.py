@@ -0,0 +1,511 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script refits the per-rule resources model from Snakemake benchmark
+files. Each benchmark file is expected under benchmarks/{rule}/, named
+after the sample, fastq or reference file the job processed. Memory and
+time are fitted as a linear function of the raw data size:
+
+    base + per_gb * size
+
+The fitted coefficients are widened by a safety margin. Threads and maximum
+values are kept from the current model.
+
+You can test this script with:
+pytest -v ./fit_resources.py
+
+Usage example:
+python3.8 ./fit_resources.py resources.yaml --benchmarks benchmarks \
+    --design design.tsv --config config.yaml --output resources.yaml
+"""
+
+import argparse             # Parse command line
+import csv                  # Read benchmark files
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import math                 # Rounding up
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import sys                  # System related methods
+import yaml                 # Parse/write YAML files
+
+from pathlib import Path                          # Paths related methods
+from typing import Any, Dict, List, Tuple         # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+HEADER = """\
+# Per-rule resources model. Each resource of a job is estimated from the
+# size, in GB, of the raw data it processes (its sample fastq files, or the
+# reference file it indexes):
+#   min((base + per_gb * size) * attempt, max)
+# Threads follow the same formula, without attempt, and never exceed the
+# threads given in the configuration file. Threads set for a rule in the
+# rule_threads section of the configuration file replace the formula.
+# Refit base and per_gb from Snakemake benchmark files with:
+#   python3 scripts/fit_resources.py resources.yaml --help
+"""
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+# Reading benchmark files
+def read_benchmark(path: Path) -> Tuple[float, float]:
+    """
+    Return the peak memory (MB) and wall time (minutes) of a Snakemake
+    benchmark file. Repeated measures are summarized by their maximum.
+
+    Parameters:
+        path    Path                Path to a benchmark file
+
+    Return:
+                Tuple[float, float] Memory in MB, time in minutes
+
+    Example:
+    >>> read_benchmark(Path("benchmarks/bwa_mem/s1.tsv"))
+    (5321.2, 12.5)
+    """
+    memory, time = 0.0, 0.0
+    with path.open() as benchmark:
+        for row in csv.DictReader(benchmark, delimiter="\t"):
+            try:
+                memory = max(memory, float(row["max_rss"]))
+            except ValueError:
+                # Jobs too short to be measured report "-"
+                pass
+            time = max(time, float(row["s"]) / 60)
+    return memory, time
+
+
+def test_read_benchmark(tmp_path) -> None:
+    """
+    This function tests the benchmark files parsing
+
+    Example:
+    pytest -v fit_resources.py -k test_read_benchmark
+    """
+    path = tmp_path / "s1.tsv"
+    path.write_text(
+        "s\th:m:s\tmax_rss\tmax_vms\n"
+        "60.0\t0:01:00\t100.5\t200\n"
+        "120.0\t0:02:00\t-\t-\n"
+    )
+    assert read_benchmark(path) == (100.5, 2.0)
+
+
+# Sizing the raw data behind each benchmark file
+def input_sizes(design: Path, config: Path) -> Dict[str, float]:
+    """
+    Return the size, in GB, of the raw data each job scales with. Samples
+    identifiers map to their fastq files, fastq roots and references names
+    map to the file itself, as in the pipeline.
+
+    Parameters:
+        design  Path                Path to the design file
+        config  Path                Path to the configuration file
+
+    Return:
+                Dict[str, float]    Sizes in GB, by name
+
+    Example:
+    >>> input_sizes(Path("design.tsv"), Path("config.yaml"))
+    {'s1_R1.fq.gz': 1.2, 's1_R1': 1.2, ..., 's1': 2.5, 'genome.fasta': 3.0}
+    """
+    def size_gb(path: str) -> float:
+        if not os.path.exists(path):
+            return 0.0
+        return os.path.getsize(path) / 1024 ** 3
+
+    sizes = {}
+    with design.open() as stream:
+        for row in csv.DictReader(stream, delimiter="\t"):
+            fastq = [
+                row[column]
+                for column in ["Upstream_file", "Downstream_file"]
+                if row.get(column)
+            ]
+            for path in fastq:
+                name = os.path.basename(path)
+                sizes[name] = size_gb(path)
+                sizes[name.split(".")[0]] = sizes[name]
+            sizes[row["Sample_id"]] = sum(
+                sizes[os.path.basename(path)] for path in fastq
+            )
+
+    with config.open() as stream:
+        ref = yaml.safe_load(stream)["ref"]
+    for path in [ref["fasta"]] + ref["known"]:
+        name = os.path.basename(path)
+        sizes[name] = size_gb(path)
+        if name.endswith(".vcf.gz"):
+            sizes[name[:-len(".vcf.gz")]] = sizes[name]
+    sizes[""] = sizes[os.path.basename(ref["fasta"])]
+
+    return sizes
+
+
+def test_input_sizes(tmp_path) -> None:
+    """
+    This function tests the raw data sizing
+
+    Example:
+    pytest -v fit_resources.py -k test_input_sizes
+    """
+    for name, size in [("a_R1.fq", 1024), ("a_R2.fq", 2048), ("g.fa", 512)]:
+        (tmp_path / name).write_bytes(b"A" * size)
+    design = tmp_path / "design.tsv"
+    design.write_text(
+        "Sample_id\tUpstream_file\tDownstream_file\n"
+        f"a\t{tmp_path}/a_R1.fq\t{tmp_path}/a_R2.fq\n"
+    )
+    config = tmp_path / "config.yaml"
+    config.write_text(yaml.dump({
+        "ref": {"fasta": str(tmp_path / "g.fa"), "known": ["k.vcf.gz"]}
+    }))
+    sizes = input_sizes(design, config)
+    assert sizes["a"] == 3072 / 1024 ** 3
+    assert sizes["a_R1"] == 1024 / 1024 ** 3
+    assert sizes["k"] == 0
+    assert sizes[""] == 512 / 1024 ** 3
+
+
+def job_size(benchmark: Path, sizes: Dict[str, float]) -> float:
+    """
+    Return the raw data size of a benchmarked job: the first part of its
+    benchmark path naming a known sample or file, the genome otherwise
+
+    Parameters:
+        benchmark   Path                Benchmark path, relative to its rule
+        sizes       Dict[str, float]    Sizes in GB, by name
+
+    Return:
+                    float               Size in GB
+
+    Example:
+    >>> job_size(Path("s1/0001.tsv"), {"s1": 2.5, "": 3.0})
+    2.5
+    """
+    for part in benchmark.with_suffix("").parts:
+        for name in [part] + part.split("."):
+            if name in sizes:
+                return sizes[name]
+    return sizes[""]
+
+
+def test_job_size() -> None:
+    """
+    This function tests the benchmark paths sizing
+
+    Example:
+    pytest -v fit_resources.py -k test_job_size
+    """
+    sizes = {"s1": 2.5, "dbsnp.vcf.gz": 1.0, "": 3.0}
+    assert job_size(Path("s1/0001.tsv"), sizes) == 2.5
+    assert job_size(Path("s1.picard.tsv"), sizes) == 2.5
+    assert job_size(Path("dbsnp.vcf.gz.tsv"), sizes) == 1.0
+    assert job_size(Path("genome.tsv"), sizes) == 3.0
+
+
+# Fitting coefficients
+def fit_linear(points: List[Tuple[float, float]]) -> Tuple[float, float]:
+    """
+    Least squares fit of y = base + per_gb * x. Negative slopes, which
+    would under-reserve large inputs, are replaced with a flat fit on the
+    largest observation.
+
+    Parameters:
+        points  List[Tuple[float, float]]   Observed (size, value) pairs
+
+    Return:
+                Tuple[float, float]         The base and per_gb values
+
+    Example:
+    >>> fit_linear([(1, 3), (2, 5)])
+    (1.0, 2.0)
+    """
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        raise ZeroDivisionError("All observations have the same size")
+
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+    if slope < 0:
+        return max(y for _, y in points), 0.0
+    return mean_y - slope * mean_x, slope
+
+
+def test_fit_linear() -> None:
+    """
+    This function tests the least squares fit
+
+    Example:
+    pytest -v fit_resources.py -k test_fit_linear
+    """
+    assert fit_linear([(1, 3), (2, 5), (3, 7)]) == (1.0, 2.0)
+    assert fit_linear([(1, 7), (2, 5)]) == (7, 0.0)
+
+
+def refit(model: Dict[str, Any],
+          observations: Dict[str, List[Tuple[float, float, float]]],
+          margin: float = 1.2) -> Dict[str, Any]:
+    """
+    Refit the memory and time coefficients of each benchmarked rule. When
+    all observations share one size, the current per_gb is kept and only
+    the base is refitted.
+
+    Parameters:
+        model           Dict[str, Any]  Current resources model
+        observations    Dict[str, List] (size, memory, time) by rule
+        margin          float           Safety factor on fitted values
+
+    Return:
+                        Dict[str, Any]  The refitted resources model
+
+    Example:
+    >>> refit({"bwa_mem": {...}}, {"bwa_mem": [(1.0, 5000, 10)]})
+    {'bwa_mem': {'mem_mb': {'base': 5939, 'max': 20480, 'per_gb': 256}, ...}}
+    """
+    for rule, points in observations.items():
+        if rule not in model:
+            logger.warning("Rule %s is not in the resources model", rule)
+            continue
+
+        for index, resource in [(1, "mem_mb"), (2, "time_min")]:
+            values = [(point[0], point[index]) for point in points]
+            coefs = model[rule][resource]
+            try:
+                base, per_gb = fit_linear(values)
+            except ZeroDivisionError:
+                per_gb = coefs["per_gb"] / margin
+                base = max(y for _, y in values) - per_gb * values[0][0]
+
+            coefs["base"] = max(1, math.ceil(base * margin))
+            coefs["per_gb"] = round(per_gb * margin, 2)
+            logger.debug("%s %s: %s", rule, resource, coefs)
+
+    return model
+
+
+def test_header() -> None:
+    """
+    This function tests that refitted models keep the documentation of the
+    pipeline resources model
+
+    Example:
+    pytest -v fit_resources.py -k test_header
+    """
+    path = Path(__file__).resolve().parent.parent / "resources.yaml"
+    with path.open() as model:
+        assert model.read().startswith(HEADER)
+
+
+def test_refit() -> None:
+    """
+    This function tests the model refitting
+
+    Example:
+    pytest -v fit_resources.py -k test_refit
+    """
+    model = {
+        "bwa_mem": {
+            "mem_mb": {"base": 8192, "per_gb": 256, "max": 20480},
+            "time_min": {"base": 20, "per_gb": 15, "max": 480},
+            "threads": {"base": 2, "per_gb": 2, "max": 12}
+        }
+    }
+    refitted = refit(model, {"bwa_mem": [(1, 1000, 10), (3, 2000, 30)]}, 1)
+    assert refitted["bwa_mem"]["mem_mb"] == {
+        "base": 500, "per_gb": 500.0, "max": 20480
+    }
+    assert refitted["bwa_mem"]["time_min"] == {
+        "base": 1, "per_gb": 10.0, "max": 480
+    }
+    assert refitted["bwa_mem"]["threads"]["base"] == 2
+
+    refitted = refit(model, {"bwa_mem": [(2, 4000, 60)]}, 1)
+    assert refitted["bwa_mem"]["mem_mb"]["base"] == 3000
+    assert refitted["bwa_mem"]["mem_mb"]["per_gb"] == 500.0
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("resources.yaml"))
+    Namespace(benchmarks='benchmarks', config='config.yaml', debug=False,
+    design='design.tsv', margin=1.2, model='resources.yaml',
+    output='/dev/stdout', quiet=False)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    main_parser.add_argument(
+        "model",
+        help="Path to the current resources model",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "-b", "--benchmarks",
+        help="Path to the benchmarks directory (default: %(default)s)",
+        type=str,
+        default="benchmarks"
+    )
+
+    main_parser.add_argument(
+        "--design",
+        help="Path to the design file of the benchmarked run "
+             "(default: %(default)s)",
+        type=str,
+        default="design.tsv"
+    )
+
+    main_parser.add_argument(
+        "--config",
+        help="Path to the configuration file of the benchmarked run "
+             "(default: %(default)s)",
+        type=str,
+        default="config.yaml"
+    )
+
+    main_parser.add_argument(
+        "-m", "--margin",
+        help="Safety factor applied on fitted values (default: %(default)s)",
+        type=float,
+        default=1.2
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Path to the refitted model (default: %(default)s)",
+        type=str,
+        default="/dev/stdout"
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v fit_resources.py -k test_parse_args
+    """
+    options = parse_args(shlex.split("resources.yaml -m 1.5"))
+    expected = argparse.Namespace(
+        benchmarks="benchmarks",
+        config="config.yaml",
+        debug=False,
+        design="design.tsv",
+        margin=1.5,
+        model="resources.yaml",
+        output="/dev/stdout",
+        quiet=False
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    This function performs the whole refit
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Example:
+    >>> main(parse_args(shlex.split("resources.yaml")))
+    """
+    with open(args.model) as stream:
+        model = yaml.safe_load(stream)
+    sizes = input_sizes(Path(args.design), Path(args.config))
+
+    observations = {}
+    for rule in sorted(Path(args.benchmarks).iterdir()):
+        if not rule.is_dir():
+            continue
+        for benchmark in sorted(rule.rglob("*.tsv")):
+            size = job_size(benchmark.relative_to(rule), sizes)
+            memory, time = read_benchmark(benchmark)
+            observations.setdefault(rule.name, []).append(
+                (size, memory, time)
+            )
+        logger.info(
+            "%s benchmarks found for %s",
+            len(observations.get(rule.name, [])), rule.name
+        )
+
+    model = refit(model, observations, args.margin)
+    with open(args.output, "w") as output:
+        output.write(HEADER)
+        yaml.dump(model, output, default_flow_style=False)
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Refitting resources model")
+        main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,363 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script converts samtools markdup statistics into Picard MarkDuplicates
+metrics, so that MultiQC and downstream tools read the same metrics file
+whatever the duplicate marking backend.
+
+Samtools counts reads, while Picard counts read pairs: paired counts are
+halved accordingly. Samtools does not count unmapped reads apart from the
+other excluded reads: this column is left out, as is the estimated library
+size when samtools does not write it.
+
+You can test this script with:
+pytest -v ./markdup_to_picard.py
+
+Usage example:
+python3.8 ./markdup_to_picard.py sample.stats.txt \
+    --input picard/groups/sample.bam --output sample.metrics.txt
+"""
+
+import argparse             # Parse command line
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import sys                  # System related methods
+
+from pathlib import Path             # Paths related methods
+from typing import Any, Dict, List   # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+# Picard DuplicationMetrics columns, in Picard order
+PICARD_COLUMNS = [
+    "LIBRARY",
+    "UNPAIRED_READS_EXAMINED",
+    "READ_PAIRS_EXAMINED",
+    "SECONDARY_OR_SUPPLEMENTARY_RDS",
+    "UNMAPPED_READS",
+    "UNPAIRED_READ_DUPLICATES",
+    "READ_PAIR_DUPLICATES",
+    "READ_PAIR_OPTICAL_DUPLICATES",
+    "PERCENT_DUPLICATION",
+    "ESTIMATED_LIBRARY_SIZE"
+]
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+# Parsing samtools statistics
+def parse_markdup_stats(lines: List[str]) -> Dict[str, str]:
+    """
+    Parse the "KEY: value" lines written by samtools markdup -s/-f
+
+    Parameters:
+        lines   List[str]       Lines of the statistics file
+
+    Return:
+                Dict[str, str]  Statistics names and values
+
+    Example:
+    >>> parse_markdup_stats(["READ: 10", "DUPLICATE TOTAL: 2"])
+    {'READ': '10', 'DUPLICATE TOTAL': '2'}
+    """
+    stats = {}
+    for line in lines:
+        if ":" not in line or line.startswith("COMMAND"):
+            continue
+        key, value = line.split(":", 1)
+        stats[key.strip()] = value.strip()
+    return stats
+
+
+def test_parse_markdup_stats() -> None:
+    """
+    This function tests the samtools statistics parsing
+
+    Example:
+    pytest -v markdup_to_picard.py -k test_parse_markdup_stats
+    """
+    lines = [
+        "COMMAND: samtools markdup -f stats.txt in.bam out.bam",
+        "READ: 1000",
+        "DUPLICATE PAIR: 80",
+        ""
+    ]
+    expected = {"READ": "1000", "DUPLICATE PAIR": "80"}
+    assert parse_markdup_stats(lines) == expected
+
+
+# Converting statistics into Picard metrics
+def to_picard_metrics(stats: Dict[str, str],
+                      library: str = "Unknown Library") -> Dict[str, Any]:
+    """
+    Translate samtools markdup statistics into Picard DuplicationMetrics.
+    Metrics samtools does not compute are left out.
+
+    Parameters:
+        stats       Dict[str, str]  Parsed samtools markdup statistics
+        library     str             Library name
+
+    Return:
+                    Dict[str, Any]  Picard metrics, by column name
+
+    Example:
+    >>> to_picard_metrics({"SINGLE": "10", "PAIRED": "90", ...})
+    {'LIBRARY': 'Unknown Library', 'UNPAIRED_READS_EXAMINED': 10, ...}
+    """
+    def count(key: str) -> int:
+        return int(stats.get(key, 0))
+
+    metrics = {
+        "LIBRARY": library,
+        "UNPAIRED_READS_EXAMINED": count("SINGLE"),
+        "READ_PAIRS_EXAMINED": count("PAIRED") // 2,
+        "SECONDARY_OR_SUPPLEMENTARY_RDS": count("EXCLUDED"),
+        "UNPAIRED_READ_DUPLICATES": count("DUPLICATE SINGLE"),
+        "READ_PAIR_DUPLICATES": count("DUPLICATE PAIR") // 2,
+        "READ_PAIR_OPTICAL_DUPLICATES": count("DUPLICATE PAIR OPTICAL") // 2
+    }
+    # Written by samtools 1.11 and later
+    if stats.get("ESTIMATED_LIBRARY_SIZE", "") != "":
+        metrics["ESTIMATED_LIBRARY_SIZE"] = count("ESTIMATED_LIBRARY_SIZE")
+
+    examined = (
+        metrics["UNPAIRED_READS_EXAMINED"]
+        + metrics["READ_PAIRS_EXAMINED"] * 2
+    )
+    duplicates = (
+        metrics["UNPAIRED_READ_DUPLICATES"]
+        + metrics["READ_PAIR_DUPLICATES"] * 2
+    )
+    metrics["PERCENT_DUPLICATION"] = (
+        round(duplicates / examined, 6) if examined > 0 else 0
+    )
+    return metrics
+
+
+def test_to_picard_metrics() -> None:
+    """
+    This function tests the conversion of reads counts into pairs counts
+
+    Example:
+    pytest -v markdup_to_picard.py -k test_to_picard_metrics
+    """
+    stats = {
+        "EXCLUDED": "5",
+        "SINGLE": "10",
+        "PAIRED": "90",
+        "DUPLICATE SINGLE": "2",
+        "DUPLICATE PAIR": "18",
+        "DUPLICATE PAIR OPTICAL": "4",
+    }
+    metrics = to_picard_metrics(stats)
+    assert metrics["READ_PAIRS_EXAMINED"] == 45
+    assert metrics["READ_PAIR_DUPLICATES"] == 9
+    assert metrics["READ_PAIR_OPTICAL_DUPLICATES"] == 2
+    assert metrics["SECONDARY_OR_SUPPLEMENTARY_RDS"] == 5
+    assert metrics["PERCENT_DUPLICATION"] == 0.2
+    assert "UNMAPPED_READS" not in metrics
+    assert "ESTIMATED_LIBRARY_SIZE" not in metrics
+
+    stats["ESTIMATED_LIBRARY_SIZE"] = "1234"
+    assert to_picard_metrics(stats)["ESTIMATED_LIBRARY_SIZE"] == 1234
+
+
+def format_picard_metrics(metrics: Dict[str, Any], input_bam: str) -> str:
+    """
+    Format metrics the way Picard MarkDuplicates writes them, in Picard
+    columns order. The header names the input bam file, which MultiQC uses
+    as sample name.
+
+    Parameters:
+        metrics     Dict[str, Any]  Picard metrics, by column name
+        input_bam   str             Path to the deduplicated bam file
+
+    Return:
+                    str             The metrics file content
+
+    Example:
+    >>> print(format_picard_metrics(metrics, "picard/groups/s1.bam"))
+    ## htsjdk.samtools.metrics.StringHeader
+    # MarkDuplicates INPUT=[picard/groups/s1.bam] (samtools markdup)
+    ...
+    """
+    columns = [column for column in PICARD_COLUMNS if column in metrics]
+    return "\n".join([
+        "## htsjdk.samtools.metrics.StringHeader",
+        f"# MarkDuplicates INPUT=[{input_bam}] (samtools markdup)",
+        "",
+        "## METRICS CLASS\tpicard.sam.DuplicationMetrics",
+        "\t".join(columns),
+        "\t".join(str(metrics[column]) for column in columns),
+        "",
+        ""
+    ])
+
+
+def test_format_picard_metrics() -> None:
+    """
+    This function tests the Picard metrics layout
+
+    Example:
+    pytest -v markdup_to_picard.py -k test_format_picard_metrics
+    """
+    metrics = to_picard_metrics({
+        "SINGLE": "4", "DUPLICATE SINGLE": "1", "ESTIMATED_LIBRARY_SIZE": "9"
+    })
+    content = format_picard_metrics(metrics, "s1.bam").split("\n")
+    assert content[1] == "# MarkDuplicates INPUT=[s1.bam] (samtools markdup)"
+    assert content[3] == "## METRICS CLASS\tpicard.sam.DuplicationMetrics"
+    assert content[4].split("\t") == [
+        column for column in PICARD_COLUMNS if column != "UNMAPPED_READS"
+    ]
+    assert content[5].split("\t")[1] == "4"
+    assert content[5].split("\t")[7] == "0.25"
+    assert content[5].split("\t")[8] == "9"
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("stats.txt --input s1.bam"))
+    Namespace(debug=False, input='s1.bam', library='Unknown Library',
+    output='/dev/stdout', quiet=False, stats='stats.txt')
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    main_parser.add_argument(
+        "stats",
+        help="Path to samtools markdup statistics",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "-i", "--input",
+        help="Path to the bam file given to samtools markdup",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "-l", "--library",
+        help="Library name (default: %(default)s)",
+        type=str,
+        default="Unknown Library"
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Path to output metrics file (default: %(default)s)",
+        type=str,
+        default="/dev/stdout"
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v markdup_to_picard.py -k test_parse_args
+    """
+    options = parse_args(shlex.split("stats.txt --input s1.bam"))
+    expected = argparse.Namespace(
+        debug=False,
+        input="s1.bam",
+        library="Unknown Library",
+        output="/dev/stdout",
+        quiet=False,
+        stats="stats.txt"
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    This function performs the whole conversion
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Example:
+    >>> main(parse_args(shlex.split("stats.txt --input s1.bam")))
+    """
+    stats = parse_markdup_stats(Path(args.stats).read_text().split("\n"))
+    logger.debug(stats)
+    metrics = to_picard_metrics(stats, args.library)
+    with open(args.output, "w") as output:
+        output.write(format_picard_metrics(metrics, args.input))
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Converting samtools markdup statistics")
+        main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)
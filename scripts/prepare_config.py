@@ -82,19 +82,28 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
 
     Example:
     >>> parse_args(shlex.split("/path/to/fasta.fa /path/to/known.vcf"))
-    Namespace(bwa_index_extra='', bwa_map_extra='-T 20 -M',
-    cold_storage='None', copy_extra='--verbose', debug=False,
-    design='design.tsv', fasta='/path/to/fasta.fa',
-    gatk_bqsr_extra='--verbosity DEBUG', known_vcf=['/path/to/known.vcf'],
+    Namespace(aligner='bwa', alignment_format='bam', bqsr_shards=1,
+    bwa_index_extra='', bwa_map_extra='-T 20 -M',
+    cold_storage='None', compact_known=False, copy_extra='--verbose',
+    debug=False, dedup_backend='picard', design='design.tsv',
+    drop_off_target=False,
+    fasta='/path/to/fasta.fa', fused_dedup=False, fused_mapping=False,
+    fused_qc=False, gatk_bqsr_extra='--verbosity DEBUG',
+    gatk_markdup_spark_extra='--remove-all-duplicates', group_jobs=False,
+    group_samples=1, incremental_qc=False,
+    known_vcf=['/path/to/known.vcf'], mapping_chunk_reads=0,
     no_quality_control=False, picard_dedup_extra='REMOVE_DUPLICATES=true',
     picard_group_extra='RGLB=standard RGPL=illumina RGPU={sample}
     RGSM={sample}', picard_isize_extra='METRIC_ACCUMULATION_LEVEL=SAMPLE',
     picard_sequence_dict_extra='GENOME_ASSEMBLY=GRCH38 SPECIES=HSA
      URI=https://www.gencodegenes.org/human/', picard_sort_sam_extra='',
-    picard_summary_extra='', quiet=False, samtools_faidx_extra='',
-    samtools_fixmate_extra='-c -m', samtools_view='-b -h -F 12',
-    singularity='docker://continuumio/miniconda3:4.4.10', threads=1,
-    workdir='.')
+    picard_summary_extra='', quiet=False, reference_cache='',
+    resources_model='', rule_threads=[], samtools_faidx_extra='',
+    samtools_fixmate_extra='-c -m', samtools_markdup_extra='-r',
+    samtools_view='-b -h -F 12', scratch_dir='',
+    singularity='docker://continuumio/miniconda3:4.4.10', spark=False,
+    staging_qc=False, target_padding=100, targets='', telemetry_interval=0,
+    threads=1, workdir='.')
     """
     main_parser = argparse.ArgumentParser(
         description="ok",  # sys.modules[__name__].doc,
@@ -139,6 +148,47 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
         default=1
     )
 
+    main_parser.add_argument(
+        "--rule-threads",
+        help="Space separated list of RULE=THREADS pairs, overriding the "
+             "threads of a rule estimated by the resources model, e.g. "
+             "samtools_sort_coordinate=4. Never above --threads.",
+        type=str,
+        nargs="+",
+        default=[]
+    )
+
+    main_parser.add_argument(
+        "--targets",
+        help="Path to capture targets (BED). Empty string processes the "
+             "whole genome (default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--target-padding",
+        help="Number of bases added on both sides of capture targets "
+             "(default: %(default)s)",
+        type=int,
+        default=100
+    )
+
+    main_parser.add_argument(
+        "--drop-off-target",
+        help="Drop reads out of the padded capture targets right after "
+             "mapping",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--bqsr-shards",
+        help="Number of interval shards used to scatter GATK BQSR"
+             " (default: %(default)s)",
+        type=int,
+        default=1
+    )
+
     main_parser.add_argument(
         "-s", "--singularity",
         help="Name of the docker/singularity image (default: %(default)s)",
@@ -154,15 +204,146 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
         nargs="+"
     )
 
+    main_parser.add_argument(
+        "--reference-cache",
+        help="Path to a persistent reference indexes cache shared across "
+             "runs. Empty string disables the cache (default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--resources-model",
+        help="Path to a per-rule resources model, as refitted by "
+             "fit_resources.py. Empty string uses the model shipped with "
+             "the pipeline (default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--scratch-dir",
+        help="Directory holding sort, Picard and GATK spill files, e.g. "
+             "'$TMPDIR' on node-local disks. Empty string uses tmp in the "
+             "working directory (default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--telemetry-interval",
+        help="Seconds between two samples of jobs CPU, memory and IO "
+             "usage. 0 disables jobs telemetry (default: %(default)s)",
+        type=int,
+        default=0
+    )
+
     main_parser.add_argument(
         "--no-quality-control",
         help="Do not perform any additional quality controls",
         action="store_true"
     )
 
+    main_parser.add_argument(
+        "--fused-mapping",
+        help="Stream mapping, mate fixing, filtering and sorting in one job",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--fused-dedup",
+        help="Mark duplicates, fix NM/MD/UQ tags and index in one pass",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--fused-qc",
+        help="Collect all alignment metrics in one pass over final files",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--compact-known",
+        help="Restrict known sites to the padded capture targets (or to "
+             "the genome contigs) and strip their INFO fields before BQSR",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--group-jobs",
+        help="Submit short consecutive steps of a sample, and its quality "
+             "controls, as one cluster job",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--group-samples",
+        help="Number of samples batched in each grouped cluster job, "
+             "along with the --group-components printed by the workflow "
+             "(default: %(default)s)",
+        type=int,
+        default=1
+    )
+
+    main_parser.add_argument(
+        "--incremental-qc",
+        help="Parse quality controls once per sample, and build the MultiQC "
+             "report from these compact records only",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--spark",
+        help="Mark duplicates and recalibrate base qualities with GATK "
+             "Spark tools, in local mode on the job threads",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--staging-qc",
+        help="Control fastq quality with fastp while staging them, instead "
+             "of reading them again with FastQC",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--mapping-chunk-reads",
+        help="Split each sample into chunks of this many reads, mapped as "
+             "independent jobs. 0 disables chunking (default: %(default)s)",
+        type=int,
+        default=0
+    )
+
+    main_parser.add_argument(
+        "--aligner",
+        help="Short reads aligner engine, each with its own genome index "
+             "(default: %(default)s)",
+        type=str,
+        choices=["bwa", "bwa-mem2"],
+        default="bwa"
+    )
+
+    main_parser.add_argument(
+        "--dedup-backend",
+        help="Tool used to mark duplicates (default: %(default)s)",
+        type=str,
+        choices=["picard", "samtools"],
+        default="picard"
+    )
+
+    main_parser.add_argument(
+        "--alignment-format",
+        help="Format of alignment files, CRAM files are compressed against "
+             "the reference (default: %(default)s)",
+        type=str,
+        choices=["bam", "cram"],
+        default="bam"
+    )
+
     main_parser.add_argument(
         "--copy-extra",
-        help="Extra parameters for bash copy (default: %(default)s)",
+        help="Extra parameters for input files staging "
+             "(default: %(default)s)",
         type=str,
         default="--verbose"
     )
@@ -225,6 +406,13 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
         default="REMOVE_DUPLICATES=true"
     )
 
+    main_parser.add_argument(
+        "--samtools-markdup-extra",
+        help="Extra parameters for samtools markdup (default: %(default)s)",
+        type=str,
+        default="-r"
+    )
+
     main_parser.add_argument(
         "--picard-isize-extra",
         help="Extra parameters for Picard insert "
@@ -240,6 +428,14 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
         default="--verbosity DEBUG"
     )
 
+    main_parser.add_argument(
+        "--gatk-markdup-spark-extra",
+        help="Extra parameters for GATK MarkDuplicatesSpark "
+             "(default: %(default)s)",
+        type=str,
+        default="--remove-all-duplicates"
+    )
+
     main_parser.add_argument(
         "--picard-summary-extra",
         help="Extra parameters for Picard summary"
@@ -293,15 +489,29 @@ def test_parse_args() -> None:
     options = parse_args(shlex.split("/path/to/fasta.fa /path/to/known.vcf"))
 
     expected = argparse.Namespace(
+        aligner='bwa',
+        alignment_format='bam',
+        bqsr_shards=1,
         bwa_index_extra='',
         bwa_map_extra='-T 20 -M',
         cold_storage=['None'],
+        compact_known=False,
         copy_extra='--verbose',
         debug=False,
+        dedup_backend='picard',
         design='design.tsv',
+        drop_off_target=False,
         fasta='/path/to/fasta.fa',
+        fused_dedup=False,
+        fused_mapping=False,
+        fused_qc=False,
         gatk_bqsr_extra='--verbosity DEBUG',
+        gatk_markdup_spark_extra='--remove-all-duplicates',
+        group_jobs=False,
+        group_samples=1,
+        incremental_qc=False,
         known_vcf=['/path/to/known.vcf'],
+        mapping_chunk_reads=0,
         no_quality_control=False,
         picard_dedup_extra='REMOVE_DUPLICATES=true',
         picard_group_extra=(
@@ -316,11 +526,21 @@ def test_parse_args() -> None:
         picard_sort_sam_extra='',
         picard_summary_extra='',
         quiet=False,
+        reference_cache='',
+        resources_model='',
+        rule_threads=[],
         samtools_faidx_extra='',
         samtools_fixmate_extra='-c -m',
+        samtools_markdup_extra='-r',
         samtools_view='-b -h -F 12',
         samtools_sort_memory="8",
+        scratch_dir='',
         singularity='docker://continuumio/miniconda3:4.4.10',
+        spark=False,
+        staging_qc=False,
+        target_padding=100,
+        targets='',
+        telemetry_interval=0,
         threads=1,
         workdir='.'
     )
@@ -344,12 +564,19 @@ def args_to_dict(args: argparse.ArgumentParser) -> Dict[str, Any]:
     >>> args_to_dict(
         parse_args(shlex.split("/path/to/fasta.fa /path/to/known.vcf"))
     )
-    {'cold_storage': 'None',
+    {'aligner': 'bwa',
+     'alignment_format': 'bam',
+     'bqsr_shards': 1,
+     'cold_storage': 'None',
+     'dedup_backend': 'picard',
      'design': 'design.tsv',
+     'group_samples': 1,
+     'mapping_chunk_reads': 0,
      'params': {'bwa_index_extra': '',
       'bwa_map_extra': '-T 20 -M',
       'copy_extra': '--verbose',
       'gatk_bqsr_extra': '--verbosity DEBUG',
+      'gatk_markdup_spark_extra': '--remove-all-duplicates',
       'picard_dedup_extra': 'REMOVE_DUPLICATES=true',
       'picard_group_extra': 'RGLB=standard RGPL=illumina RGPU={sample}
        RGSM={sample}',
@@ -360,27 +587,66 @@ def args_to_dict(args: argparse.ArgumentParser) -> Dict[str, Any]:
       'picard_summary_extra': '',
       'samtools_faidx_extra': '',
       'samtools_fixmate_extra': '-c -m',
+      'samtools_markdup_extra': '-r',
       'samtools_view': '-b -h -F 12'},
-     'ref': {'fasta': '/path/to/fasta.fa', 'known': ['/path/to/known.vcf']},
+     'ref': {'fasta': '/path/to/fasta.fa', 'known': ['/path/to/known.vcf'],
+      'targets': ''},
+     'reference_cache': '',
+     'resources_model': '',
+     'rule_threads': {},
+     'scratch_dir': '',
      'singularity_docker_image': 'docker://continuumio/miniconda3:4.4.10',
+     'target_padding': 100,
+     'telemetry_interval': 0,
      'threads': 1,
      'workdir': '.',
-     'workflow': {'fastqc': True, 'mapping_quality': True, 'multiqc': True}}
+     'workflow': {'compact_known': False, 'drop_off_target': False,
+      'fastqc': True, 'fused_dedup': False,
+      'fused_mapping': False, 'fused_qc': False, 'group_jobs': False,
+      'incremental_qc': False, 'mapping_quality': True, 'multiqc': True,
+      'spark': False, 'staging_qc': False}}
     """
     return {
         "design": args.design,
         "workdir": args.workdir,
         "threads": args.threads,
+        "bqsr_shards": args.bqsr_shards,
+        "target_padding": args.target_padding,
+        "mapping_chunk_reads": args.mapping_chunk_reads,
+        "group_samples": args.group_samples,
+        "dedup_backend": args.dedup_backend,
+        "aligner": args.aligner,
+        "alignment_format": args.alignment_format,
         "singularity_docker_image": args.singularity,
         "cold_storage": args.cold_storage,
+        "reference_cache": args.reference_cache,
+        "resources_model": args.resources_model,
+        "rule_threads": {
+            rule: int(threads)
+            for rule, threads in (
+                pair.split("=") for pair in args.rule_threads
+            )
+        },
+        "scratch_dir": args.scratch_dir,
+        "telemetry_interval": args.telemetry_interval,
         "ref": {
             "fasta": args.fasta,
-            "known": args.known_vcf
+            "known": args.known_vcf,
+            "targets": args.targets
         },
         "workflow": {
             "fastqc": not args.no_quality_control,
             "multiqc": not args.no_quality_control,
             "mapping_quality": not args.no_quality_control,
+            "fused_mapping": args.fused_mapping,
+            "fused_dedup": args.fused_dedup,
+            "fused_qc": args.fused_qc,
+            "staging_qc": args.staging_qc,
+            "spark": args.spark,
+            "incremental_qc": args.incremental_qc,
+            "drop_off_target": args.drop_off_target,
+            "compact_known": args.compact_known,
+            "group_jobs": args.group_jobs,
         },
         "params": {
             "copy_extra": args.copy_extra,
@@ -391,11 +657,13 @@ def args_to_dict(args: argparse.ArgumentParser) -> Dict[str, Any]:
             "picard_dedup_extra": args.picard_dedup_extra,
             "picard_isize_extra": args.picard_isize_extra,
             "gatk_bqsr_extra": args.gatk_bqsr_extra,
+            "gatk_markdup_spark_extra": args.gatk_markdup_spark_extra,
             "picard_summary_extra": args.picard_summary_extra,
             "samtools_fixmate_extra": args.samtools_fixmate_extra,
             "picard_sequence_dict_extra": args.picard_sequence_dict_extra,
             "samtools_view": args.samtools_view,
             "samtools_faidx_extra": args.samtools_faidx_extra,
+            "samtools_markdup_extra": args.samtools_markdup_extra,
             "samtools_sort_memory": args.samtools_sort_memory
         }
     }
@@ -409,13 +677,20 @@ def test_args_to_dict() -> None:
     >>> pytest -v prepare_config.py -k test_args_to_dict
     """
     expected = {
+        'aligner': 'bwa',
+        'alignment_format': 'bam',
+        'bqsr_shards': 1,
         'cold_storage': ['None'],
+        'dedup_backend': 'picard',
         'design': 'design.tsv',
+        'group_samples': 1,
+        'mapping_chunk_reads': 0,
         'params': {
             'bwa_index_extra': '',
             'bwa_map_extra': '-T 20 -M',
             'copy_extra': '--verbose',
             'gatk_bqsr_extra': '--verbosity DEBUG',
+            'gatk_markdup_spark_extra': '--remove-all-duplicates',
             'picard_dedup_extra': 'REMOVE_DUPLICATES=true',
             'picard_group_extra': ('RGLB=standard RGPL=illumina '
                                    'RGPU={sample} RGSM={sample}'),
@@ -428,14 +703,38 @@ def test_args_to_dict() -> None:
             'picard_summary_extra': '',
             'samtools_faidx_extra': '',
             'samtools_fixmate_extra': '-c -m',
+            'samtools_markdup_extra': '-r',
             'samtools_view': '-b -h -F 12',
             "samtools_sort_memory": '8'
         },
-        'ref': {'fasta': '/path/to/fasta.fa', 'known': ['/path/to/known.vcf']},
+        'ref': {
+            'fasta': '/path/to/fasta.fa',
+            'known': ['/path/to/known.vcf'],
+            'targets': ''
+        },
+        'reference_cache': '',
+        'resources_model': '',
+        'rule_threads': {},
+        'scratch_dir': '',
         'singularity_docker_image': 'docker://continuumio/miniconda3:4.4.10',
+        'target_padding': 100,
+        'telemetry_interval': 0,
         'threads': 1,
         'workdir': '.',
-        'workflow': {'fastqc': True, 'mapping_quality': True, 'multiqc': True}
+        'workflow': {
+            'fastqc': True,
+            'mapping_quality': True,
+            'multiqc': True,
+            'fused_mapping': False,
+            'fused_dedup': False,
+            'fused_qc': False,
+            'staging_qc': False,
+            'spark': False,
+            'incremental_qc': False,
+            'drop_off_target': False,
+            'compact_known': False,
+            'group_jobs': False
+        }
     }
     test = args_to_dict(
         parse_args(shlex.split("/path/to/fasta.fa /path/to/known.vcf"))
@@ -443,6 +742,14 @@ def test_args_to_dict() -> None:
 
     assert test == expected
 
+    test = args_to_dict(parse_args(shlex.split(
+        "/path/to/fasta.fa /path/to/known.vcf "
+        "--rule-threads samtools_sort_coordinate=4 samtools_index=2"
+    )))
+    assert test["rule_threads"] == {
+        "samtools_sort_coordinate": 4, "samtools_index": 2
+    }
+
 
 # Yaml formatting
 def dict_to_yaml(indict: Dict[str, Any]) -> str:
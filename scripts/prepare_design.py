@@ -5,13 +5,19 @@
 This script aims to prepare the list of files to be processed
 by the wes-mapping-bwa-gatk pipeline
 
-It iterates over a given directory, lists all fastq files. As a pair of
-fastq files usually have names that follows each other in the alphabetical
-order, this script sorts the fastq files names and, by default, creates
-pairs of fastq files that way.
+It iterates over a given directory, lists all fastq files. Directories
+are scanned in parallel, hidden directories are skipped, and an optional
+scan cache lets re-runs list only the directories modified since.
 
-Finally, it writes these pairs, using the longest common substring as
-identifier. The written file is a TSV file.
+Pairs of fastq files are identified from their names: sample name, lane
+and mate (R1/R2, 1/2). Index reads (I1/I2) and undetermined reads are left
+aside. Files without recognizable mate fall back to alphabetical pairing.
+When a sample was sequenced on several lanes, each lane gets its own line.
+
+Finally, it writes these pairs. The written file is a TSV file. On demand,
+a manifest with read counts, read lengths, sizes and checksums of each
+fastq file is written next to it. Files are parsed in parallel processes,
+and files left unchanged since the previous manifest are not read again.
 
 You can test this script with:
 pytest -v ./prepare_design.py
@@ -25,24 +31,56 @@ python3.7 ./prepare_design.py ../tests/reads
 
 # Search in sub-directories:
 python3.7 ./prepare_design.py ../tests --recursive
+
+# Search a large run folder with 16 threads, caching the scan:
+python3.7 ./prepare_design.py /path/to/run --recursive --threads 16 \
+    --cache run.scan.json
+
+# Also write the fastq manifest next to the design:
+python3.7 ./prepare_design.py ../tests/reads --single --manifest
 """
 
 import argparse           # Parse command line
+import fnmatch            # Directories exclusion patterns
+import gzip               # Compressed fastq files
+import hashlib            # Fastq checksums
+import io                 # Streaming file reads
+import json               # Scan cache
 import logging            # Traces and loggings
 import logging.handlers   # Logging behaviour
 import os                 # OS related activities
 import pandas as pd       # Parse TSV files
 import pytest             # Unit testing
+import re                 # Fastq names parsing
 import shlex              # Lexical analysis
 import sys                # System related methods
 
-from pathlib import Path                        # Paths related methods
-from typing import Dict, Generator, List, Any   # Type hints
+from collections import Counter     # Lanes per sample
+from concurrent.futures import (     # Parallel scan and parsing
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from itertools import islice                              # Sequence lines
+from pathlib import Path                                  # Paths methods
+from typing import Dict, Generator, List, Any, Optional   # Type hints
 
 logger = logging.getLogger(
     os.path.splitext(os.path.basename(sys.argv[0]))[0]
 )
 
+FQ_EXT = (".fq", ".fq.gz", ".fastq", ".fastq.gz")
+
+# Illumina-like names: sample[_S1][_L001]{_,.}{R1,1,I1}[_001].fastq[.gz]
+FQ_PATTERN = re.compile(
+    r"^(?P<sample>.+?)"
+    r"(?:_S\d+)?"
+    r"(?:_L(?P<lane>\d{3}))?"
+    r"[._](?P<mate>[RI]?[12])"
+    r"(?:_(?P<chunk>\d{3}))?"
+    r"\.(?:fq|fastq)(?:\.gz)?$"
+)
+
+MANIFEST = "manifest.tsv"
+
 
 # Building custom class for help formatter
 class CustomFormatter(argparse.RawDescriptionHelpFormatter,
@@ -73,15 +111,65 @@ def setup_logging(args: argparse.ArgumentParser) -> None:
 
 # Processing functions
 # Looking for fastq files
+def scan_dir(directory: str,
+             cache: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    List the fastq files and sub-directories of a single directory. When
+    the directory did not change since it was cached, the cached listing
+    is returned without reading the directory again.
+
+    Parameters:
+        directory   str             Path to the directory to scan
+        cache       Dict[str, Any]  Previous listings, by directory
+
+    Return:
+                    Dict[str, Any]  Modification time, fastq files and
+                                    sub-directories names
+
+    Example:
+    >>> scan_dir("../tests/reads")
+    {'mtime_ns': 1590000000000000000, 'fastq': ['a_U.fastq'], 'subdirs': []}
+    """
+    mtime = os.stat(directory).st_mtime_ns
+    cached = (cache or {}).get(directory)
+    if cached is not None and cached["mtime_ns"] == mtime:
+        return cached
+
+    fastq, subdirs = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # DirEntry types come from the directory listing: no stat call
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.name.endswith(FQ_EXT):
+                fastq.append(entry.name)
+
+    return {
+        "mtime_ns": mtime,
+        "fastq": sorted(fastq),
+        "subdirs": sorted(subdirs)
+    }
+
+
 def search_fq(fq_dir: Path,
-              recursive: bool = False) -> Generator[str, str, None]:
+              recursive: bool = False,
+              threads: int = 1,
+              exclude: List[str] = [".*"],
+              cache: Optional[Dict[str, Any]] = None
+              ) -> Generator[str, str, None]:
     """
-    Iterate over a directory and search for fastq files
+    Iterate over a directory and search for fastq files. Each directory is
+    scanned by a pool of worker threads. Directories matching an exclusion
+    pattern are pruned. The cache, when given, is updated in place with the
+    listing of every visited directory.
 
     Parameters:
         fq_dir      Path        Path to the fastq directory in which to search
         recursive   bool        A boolean, weather to search recursively in
                                 sub-directories (True) or not (False)
+        threads     int         Number of directories scanned in parallel
+        exclude     List[str]   Directories names patterns to skip
+        cache       Dict        Previous listings, by directory
 
     Return:
                     Generator[str, str, None]       A Generator of paths
@@ -93,18 +181,36 @@ def search_fq(fq_dir: Path,
     >>> list(search_fq(Path("../tests/", True)))
     [PosixPath('../tests/reads/a_U.fastq')]
     """
-    for path in fq_dir.iterdir():
-        if path.is_dir():
-            if recursive is True:
-                yield from search_fq(path, recursive)
-            else:
-                continue
-
-        if path.name.endswith((".fq", ".fq.gz", ".fastq", ".fastq.gz")):
-            yield path
-
+    previous = dict(cache or {})
+    if cache is not None:
+        cache.clear()
 
-def test_search_fq():
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {
+            executor.submit(scan_dir, str(fq_dir), previous): str(fq_dir)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                listing = future.result()
+                if cache is not None:
+                    cache[directory] = listing
+
+                for name in listing["fastq"]:
+                    yield Path(directory) / name
+
+                if recursive is not True:
+                    continue
+                for name in listing["subdirs"]:
+                    if any(fnmatch.fnmatch(name, pat) for pat in exclude):
+                        logger.debug("Skipping %s/%s", directory, name)
+                        continue
+                    path = os.path.join(directory, name)
+                    pending[executor.submit(scan_dir, path, previous)] = path
+
+
+def test_search_fq(tmp_path, monkeypatch):
     """
     This function tests the ability of the function "search_fq" to find the
     fastq files in the given directory
@@ -116,6 +222,41 @@ def test_search_fq():
     expected = [Path('tests/reads/a_U.fastq')]
     assert sorted(list(search_fq(path))) == sorted(expected)
 
+    for sub in ["run/a", "run/a/b", "run/.snakemake", "run/tmp"]:
+        (tmp_path / sub).mkdir(parents=True)
+    for fq in ["run/a/s1_R1.fq.gz", "run/a/b/s2_R1.fq", "run/.snakemake/x.fq",
+               "run/tmp/s3.fastq", "run/a/notes.txt"]:
+        (tmp_path / fq).write_text("")
+
+    run = tmp_path / "run"
+    assert list(search_fq(run)) == []
+    cache = {}
+    found = sorted(search_fq(run, True, 4, [".*", "tmp"], cache))
+    assert found == [run / "a" / "b" / "s2_R1.fq", run / "a" / "s1_R1.fq.gz"]
+    assert sorted(cache.keys()) == sorted(
+        str(p) for p in [run, run / "a", run / "a" / "b"]
+    )
+
+    # Unchanged directories are not listed again
+    def fail(path):
+        raise AssertionError(f"{path} listed again")
+    monkeypatch.setattr(os, "scandir", fail)
+    assert sorted(search_fq(run, True, 4, [".*", "tmp"], cache)) == found
+
+
+def load_cache(path: Optional[str]) -> Dict[str, Any]:
+    """
+    Load a scan cache, or return an empty one when missing or unreadable
+    """
+    if path is None or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except ValueError:
+        logger.warning("Ignoring unreadable scan cache: %s", path)
+        return {}
+
 
 def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
     """
@@ -129,8 +270,9 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
 
     Example:
     >>> parse_args(shlex.split("/path/to/fasta --single"))
-    Namespace(output='design.tsv', path='/path/to/fastq/dir', recursive=False,
-    single=False)
+    Namespace(cache=None, exclude=['.*'], manifest=False,
+    output='design.tsv', path='/path/to/fastq/dir', recursive=False,
+    single=False, threads=4)
     """
     main_parser = argparse.ArgumentParser(
         description=sys.modules[__name__].__doc__,
@@ -156,6 +298,39 @@ def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
         action="store_true"
     )
 
+    main_parser.add_argument(
+        "-t", "--threads",
+        help="Number of directories scanned, or fastq files parsed, in "
+             "parallel "
+             "(default: %(default)s)",
+        type=int,
+        default=4
+    )
+
+    main_parser.add_argument(
+        "-e", "--exclude",
+        help="Directories names patterns skipped while searching "
+             "(default: %(default)s)",
+        type=str,
+        nargs="+",
+        default=[".*"]
+    )
+
+    main_parser.add_argument(
+        "-c", "--cache",
+        help="Path to a scan cache, re-runs only list the directories "
+             "modified since the last scan (default: %(default)s)",
+        type=str,
+        default=None
+    )
+
+    main_parser.add_argument(
+        "-m", "--manifest",
+        help="Also write read counts, read lengths, sizes and checksums "
+             f"of fastq files in a {MANIFEST} next to the design",
+        action="store_true"
+    )
+
     main_parser.add_argument(
         "-o", "--output",
         help="Path to output file (default: %(default)s)",
@@ -191,10 +366,14 @@ def test_parse_args() -> None:
     """
     options = parse_args(shlex.split("/path/to/fastq/dir/ --single"))
     expected = argparse.Namespace(
+        cache=None,
+        exclude=[".*"],
+        manifest=False,
         output='design.tsv',
         path='/path/to/fastq/dir/',
         recursive=False,
         single=True,
+        threads=4,
         quiet=False,
         debug=False
     )
@@ -202,6 +381,59 @@ def test_parse_args() -> None:
 
 
 # Turning the FQ list into a dictionnary
+def parse_fq_name(name: str) -> Optional[Dict[str, str]]:
+    """
+    Identify sample, lane, mate and chunk from a fastq file name
+
+    Parameters:
+        name    str                 A fastq file name
+
+    Return:
+                Dict[str, str]      The name fields, None when the mate
+                                    can not be identified
+
+    Example:
+    >>> parse_fq_name("s1_S1_L002_R1_001.fastq.gz")
+    {'sample': 's1', 'lane': '002', 'mate': 'R1', 'chunk': '001'}
+    """
+    match = FQ_PATTERN.match(name)
+    if match is None:
+        return None
+    return {
+        key: value or ""
+        for key, value in match.groupdict().items()
+    }
+
+
+def test_parse_fq_name():
+    """
+    This function tests the fastq names parsing
+
+    Example:
+    pytest -v ./prepare_design.py -k test_parse_fq_name
+    """
+    assert parse_fq_name("s1_S1_L002_R1_001.fastq.gz") == {
+        "sample": "s1", "lane": "002", "mate": "R1", "chunk": "001"
+    }
+    assert parse_fq_name("my_sample.R2.fq") == {
+        "sample": "my_sample", "lane": "", "mate": "R2", "chunk": ""
+    }
+    assert parse_fq_name("s2_2.fastq.gz")["mate"] == "2"
+    assert parse_fq_name("s2_S3_L001_I1_001.fastq.gz")["mate"] == "I1"
+    assert parse_fq_name("a_U.fastq") is None
+
+
+def is_auxiliary(name: str) -> bool:
+    """
+    Return True for index reads and undetermined reads, which are not
+    sample reads
+    """
+    fields = parse_fq_name(name)
+    return name.startswith("Undetermined") or (
+        fields is not None and fields["mate"].startswith("I")
+    )
+
+
 def classify_fq(fq_files: List[Path], single: bool = True) -> Dict[str, Path]:
     """
     Return a dictionnary with identified fastq files (paried or not)
@@ -214,21 +446,28 @@ def classify_fq(fq_files: List[Path], single: bool = True) -> Dict[str, Path]:
     Return:
                     Dict[str, Path] A dictionnary: for each Sample ID, the ID
                                     is repeated alongside with the upstream
-                                    /downstream fastq files.
+                                    /downstream fastq files. Samples
+                                    sequenced on several lanes also have
+                                    a Lane identifier.
 
     Example:
     # Paired-end single sample
-    >>> classify_fq([Path("file1.R1.fq"), Path("file1.R2.fq")], True)
-    {'file1.R1.fq': {'Downstream_file': PosixPath("/path/to/file1.R1.fq"),
-     'Sample_id': 'file1.R1',
-     'Upstream_file': PosixPath('/path/to/file1.R2.fq')}
+    >>> classify_fq([Path("file1.R1.fq"), Path("file1.R2.fq")], False)
+    {'file1.R1.fq': {'Sample_id': 'file1',
+     'Upstream_file': PosixPath('/path/to/file1.R1.fq'),
+     'Downstream_file': PosixPath("/path/to/file1.R2.fq")}}
 
     # Single-ended single sample
-    >>> classify_fq([Path("file1.fq")], False)
+    >>> classify_fq([Path("file1.fq")], True)
     {'file1.fq': {'Sample_id': 'file1',
      'Upstream_file': PosixPath('/path/to/file1.fq')}}
     """
     fq_dict = {}
+    auxiliary = {fq for fq in fq_files if is_auxiliary(fq.name)}
+    if len(auxiliary) > 0:
+        logger.warning("Skipping index or undetermined reads: %s", auxiliary)
+    fq_files = [fq for fq in fq_files if fq not in auxiliary]
+
     if single is True:
         logger.debug("Single-ended design")
         for fq in fq_files:
@@ -236,14 +475,45 @@ def classify_fq(fq_files: List[Path], single: bool = True) -> Dict[str, Path]:
                 "Sample_id": fq.stem,
                 "Upstream_file": fq.absolute()
             }
-    else:
-        logger.debug("Pair-ended design")
-        for fq1, fq2 in zip(fq_files[0::2], fq_files[1::2]):
-            fq_dict[fq1.name] = {
-                "Sample_id": fq1.stem,
-                "Upstream_file": fq1.absolute(),
-                "Downstream_file": fq2.absolute()
-            }
+        return fq_dict
+
+    logger.debug("Pair-ended design")
+    # Mates are grouped by sample, then by lane and file chunk
+    units, leftovers = {}, []
+    for fq in fq_files:
+        fields = parse_fq_name(fq.name)
+        if fields is None:
+            leftovers.append(fq)
+            continue
+        unit = (fields["sample"], fields["lane"], fields["chunk"])
+        units.setdefault(unit, {})[fields["mate"][-1]] = fq
+
+    runs = Counter(sample for sample, _, _ in units)
+    for (sample, lane, chunk), mates in sorted(units.items()):
+        if sorted(mates.keys()) != ["1", "2"]:
+            logger.warning("Missing mate, skipping: %s", mates)
+            continue
+
+        fq_dict[mates["1"].name] = {
+            "Sample_id": sample,
+            "Upstream_file": mates["1"].absolute(),
+            "Downstream_file": mates["2"].absolute()
+        }
+        # Samples sequenced on several lanes are mapped lane by lane
+        if runs[sample] > 1:
+            fq_dict[mates["1"].name]["Lane"] = "_".join(
+                field for field in [lane and f"L{lane}", chunk] if field
+            ) or str(len(fq_dict))
+
+    # Files without recognizable mate follow each other alphabetically
+    if len(leftovers) % 2 != 0:
+        logger.warning("Odd number of unrecognized fastq files: %s", leftovers)
+    for fq1, fq2 in zip(leftovers[0::2], leftovers[1::2]):
+        fq_dict[fq1.name] = {
+            "Sample_id": fq1.stem,
+            "Upstream_file": fq1.absolute(),
+            "Downstream_file": fq2.absolute()
+        }
 
     return fq_dict
 
@@ -269,6 +539,194 @@ def test_classify_fq():
     )
     assert classification == expected
 
+    names = [
+        "Undetermined_S0_L001_R1_001.fastq.gz",
+        "a_S1_L001_I1_001.fastq.gz",
+        "a_S1_L001_R1_001.fastq.gz",
+        "a_S1_L001_R2_001.fastq.gz",
+        "a_S1_L002_R1_001.fastq.gz",
+        "a_S1_L002_R2_001.fastq.gz",
+        "b.R1.fq",
+        "b.R2.fq",
+        "c_R1.fq",
+        "x.fq",
+        "y.fq"
+    ]
+    classification = classify_fq([prefix / name for name in names], False)
+    assert {
+        key: (value["Sample_id"], value.get("Lane"))
+        for key, value in classification.items()
+    } == {
+        "a_S1_L001_R1_001.fastq.gz": ("a", "L001_001"),
+        "a_S1_L002_R1_001.fastq.gz": ("a", "L002_001"),
+        "b.R1.fq": ("b", None),
+        "x.fq": ("x", None)
+    }
+    assert classification["b.R1.fq"]["Downstream_file"] == prefix / "b.R2.fq"
+    assert classification["x.fq"]["Downstream_file"] == prefix / "y.fq"
+
+
+# Describing fastq files content
+class ChecksumReader(io.RawIOBase):
+    """
+    This class wraps a binary file and updates a checksum with every byte
+    read from it, so a file is hashed while being decompressed.
+    """
+    def __init__(self, raw: io.RawIOBase, checksum: Any) -> None:
+        self.raw = raw
+        self.checksum = checksum
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        size = self.raw.readinto(buffer)
+        self.checksum.update(memoryview(buffer)[:size])
+        return size
+
+
+def fq_stats(path: Path) -> Dict[str, Any]:
+    """
+    Read a fastq file once and describe its content: number of reads,
+    reads lengths, compressed and uncompressed sizes, and md5 checksum
+    of the file as stored
+
+    Parameters:
+        path    Path                Path to a fastq file, gzipped or not
+
+    Return:
+                Dict[str, Any]      The manifest line of this file
+
+    Example:
+    >>> fq_stats(Path("../tests/reads/a_U.fastq"))
+    {'File': '/path/to/tests/reads/a_U.fastq', 'Reads': 2500,
+     'Mean_length': 100.0, 'Max_length': 100, 'Compressed_size': 582500,
+     'Uncompressed_size': 582500, 'Md5': '0f...', 'Mtime_ns': 159...}
+    """
+    checksum = hashlib.md5()
+    status = path.stat()
+    reads, bases, longest = 0, 0, 0
+    with path.open("rb", buffering=0) as raw:
+        stream = io.BufferedReader(
+            ChecksumReader(raw, checksum), buffer_size=1024 ** 2
+        )
+        if path.name.endswith(".gz"):
+            stream = gzip.GzipFile(fileobj=stream)
+
+        for sequence in islice(stream, 1, None, 4):
+            length = len(sequence.rstrip(b"\r\n"))
+            reads += 1
+            bases += length
+            longest = max(longest, length)
+
+        # Trailing bytes still have to be hashed
+        while stream.read(1024 ** 2):
+            pass
+        size = stream.tell() if isinstance(stream, gzip.GzipFile) \
+            else status.st_size
+
+    return {
+        "File": str(path.absolute()),
+        "Reads": reads,
+        "Mean_length": round(bases / reads, 2) if reads > 0 else 0.0,
+        "Max_length": longest,
+        "Compressed_size": status.st_size,
+        "Uncompressed_size": size,
+        "Md5": checksum.hexdigest(),
+        "Mtime_ns": status.st_mtime_ns
+    }
+
+
+def test_fq_stats(tmp_path):
+    """
+    This function tests the fastq files description
+
+    Example:
+    pytest -v ./prepare_design.py -k test_fq_stats
+    """
+    content = b"@r1\nACGT\n+\nIIII\n@r2\nACGTAC\n+\nIIIIII\n"
+    plain = tmp_path / "s1_R1.fq"
+    plain.write_bytes(content)
+    packed = tmp_path / "s1_R2.fq.gz"
+    packed.write_bytes(gzip.compress(content))
+
+    stats = fq_stats(plain)
+    assert stats["File"] == str(plain)
+    assert (stats["Reads"], stats["Mean_length"], stats["Max_length"]) \
+        == (2, 5.0, 6)
+    assert stats["Compressed_size"] == stats["Uncompressed_size"] \
+        == len(content)
+    assert stats["Md5"] == hashlib.md5(content).hexdigest()
+
+    stats = fq_stats(packed)
+    assert (stats["Reads"], stats["Mean_length"], stats["Max_length"]) \
+        == (2, 5.0, 6)
+    assert stats["Uncompressed_size"] == len(content)
+    assert stats["Compressed_size"] == packed.stat().st_size
+    assert stats["Md5"] == hashlib.md5(packed.read_bytes()).hexdigest()
+
+
+def build_manifest(fq_files: List[Path],
+                   threads: int = 1,
+                   previous: Optional[pd.DataFrame] = None
+                   ) -> pd.DataFrame:
+    """
+    Describe fastq files in parallel processes. Files with the same size
+    and modification time as in a previous manifest are not read again.
+
+    Parameters:
+        fq_files    List[Path]      Fastq files to describe
+        threads     int             Number of files parsed in parallel
+        previous    DataFrame       A previous manifest, if any
+
+    Return:
+                    DataFrame       One line per fastq file
+    """
+    known = {}
+    if previous is not None:
+        known = {line["File"]: line for line in previous.to_dict("records")}
+
+    lines, changed = {}, []
+    for fq in fq_files:
+        line = known.get(str(fq.absolute()))
+        status = fq.stat()
+        if line is not None \
+                and line["Compressed_size"] == status.st_size \
+                and line["Mtime_ns"] == status.st_mtime_ns:
+            lines[fq] = line
+        else:
+            changed.append(fq)
+
+    logger.debug("Reading %s new or modified fastq files", len(changed))
+    if len(changed) > 0:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            lines.update(zip(changed, executor.map(fq_stats, changed)))
+
+    return pd.DataFrame([lines[fq] for fq in fq_files])
+
+
+def test_build_manifest(tmp_path, monkeypatch):
+    """
+    This function tests the manifest construction, and that unchanged
+    files are not read twice
+
+    Example:
+    pytest -v ./prepare_design.py -k test_build_manifest
+    """
+    fq_files = []
+    for name in ["s1_R1.fq", "s1_R2.fq"]:
+        fq_files.append(tmp_path / name)
+        fq_files[-1].write_bytes(b"@r1\nACGT\n+\nIIII\n")
+
+    manifest = build_manifest(fq_files, 2)
+    assert manifest["File"].tolist() == [str(fq) for fq in fq_files]
+    assert manifest["Reads"].tolist() == [1, 1]
+
+    def fail(path):
+        raise AssertionError(f"{path} read again")
+    monkeypatch.setattr(sys.modules[__name__], "fq_stats", fail)
+    assert build_manifest(fq_files, 2, manifest).equals(manifest)
+
 
 def main(args: argparse.ArgumentParser) -> None:
     """
@@ -280,15 +738,37 @@ def main(args: argparse.ArgumentParser) -> None:
     Example:
     >>> main(parse_args(shlex.split("/path/to/fasta/dir/")))
     """
-    fq_list = sorted(list(search_fq(Path(args.path), args.recursive)))
+    cache = load_cache(args.cache)
+    fq_list = sorted(list(search_fq(
+        Path(args.path), args.recursive, args.threads, args.exclude, cache
+    )))
     logger.debug(fq_list)
+    if args.cache is not None:
+        with open(args.cache, "w") as stream:
+            json.dump(cache, stream)
+
     fq_dict = classify_fq(fq_list, args.single)
     logger.debug(fq_dict)
 
-    data = pd.DataFrame(fq_dict).T
+    data = pd.DataFrame(list(fq_dict.values()))
     logger.debug(data.head())
     data.to_csv(args.output, sep="\t", index=False)
 
+    if args.manifest is True:
+        manifest_path = Path(args.output).parent / MANIFEST
+        previous = None
+        if manifest_path.exists():
+            previous = pd.read_csv(manifest_path, sep="\t", header=0)
+        fq_files = [
+            Path(fq)
+            for column in ["Upstream_file", "Downstream_file"]
+            if column in data.columns
+            for fq in data[column].tolist()
+        ]
+        manifest = build_manifest(fq_files, args.threads, previous)
+        logger.debug(manifest.head())
+        manifest.to_csv(manifest_path, sep="\t", index=False)
+
 
 if __name__ == '__main__':
     # Parsing command line
@@ -0,0 +1,733 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script keeps a compact quality control record per sample, and builds
+the cohort quality tables from these records only.
+
+The record subcommand parses the quality controls of one sample (FastQC
+archives or fastp reports, Picard duplicates, alignment summary and insert
+size metrics) into a small JSON file. Since the pipeline writes one record
+per sample, only new or changed samples are parsed again when the cohort
+grows.
+
+The aggregate subcommand streams the records of all samples listed in the
+design file into two tables, one row per fastq file and one row per
+sample. Both are MultiQC custom content files: MultiQC reads these tables
+instead of every sample's quality controls.
+
+You can test this script with:
+pytest -v ./qc_records.py
+
+Usage example:
+# Record the quality controls of one sample
+python3.8 ./qc_records.py record --sample s1 \
+    --fastqc qc/fastqc/s1_R1_fastqc.zip qc/fastqc/s1_R2_fastqc.zip \
+    --duplicates picard/stats/duplicates/s1.metrics.txt \
+    --summary picard/stats/summary/s1_summary.txt \
+    --output qc/records/s1.json
+
+# Build cohort tables
+python3.8 ./qc_records.py aggregate qc/records --design design.tsv \
+    --fastq qc/cohort/fastq_mqc.tsv --samples qc/cohort/samples_mqc.tsv
+"""
+
+import argparse             # Parse command line
+import csv                  # Read design and write TSV files
+import json                 # Records format
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import sys                  # System related methods
+import zipfile              # FastQC archives
+
+from pathlib import Path                # Paths related methods
+from typing import Any, Dict, List      # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+# Picard metrics kept in records, by metrics file
+DUPLICATES_METRICS = [
+    "UNPAIRED_READS_EXAMINED", "READ_PAIRS_EXAMINED", "PERCENT_DUPLICATION"
+]
+SUMMARY_METRICS = [
+    "TOTAL_READS", "PF_READS_ALIGNED", "PCT_PF_READS_ALIGNED",
+    "MEAN_READ_LENGTH"
+]
+INSERT_SIZE_METRICS = [
+    "MEDIAN_INSERT_SIZE", "MEAN_INSERT_SIZE", "STANDARD_DEVIATION"
+]
+
+FASTQ_COLUMNS = [
+    "Fastq", "Sample", "Total sequences", "GC %", "Sequence length",
+    "Failed modules"
+]
+SAMPLE_COLUMNS = [
+    "Sample", "Fastq sequences", "Failed FastQC modules", "Total reads",
+    "Aligned %", "Duplication %", "Median insert size"
+]
+
+# MultiQC custom content headers
+FASTQ_HEADER = """# id: 'cohort_fastq'
+# section_name: 'Fastq quality'
+# description: 'Raw fastq files quality, from per-sample records'
+# plot_type: 'table'
+"""
+SAMPLE_HEADER = """# id: 'cohort_samples'
+# section_name: 'Samples quality'
+# description: 'Mapping quality per sample, from per-sample records'
+# plot_type: 'table'
+"""
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+def to_number(value: str) -> Any:
+    """
+    Convert a metric into an int or a float when possible, or keep it as is
+    """
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            continue
+    return value
+
+
+# Parsing quality controls
+def read_fastqc(path: Path) -> Dict[str, Any]:
+    """
+    Parse the basic statistics and the failed modules of a FastQC archive
+
+    Parameters:
+        path    Path                Path to a FastQC zip archive
+
+    Return:
+                Dict[str, Any]      Fastq quality record
+
+    Example:
+    >>> read_fastqc(Path("qc/fastqc/s1_R1_fastqc.zip"))
+    {'fastq': 's1_R1', 'total_sequences': 1000, 'gc': 48,
+     'length': '35-151', 'failed': ['Per base sequence content']}
+    """
+    record = {
+        "fastq": path.name[:-len("_fastqc.zip")],
+        "total_sequences": 0,
+        "gc": "",
+        "length": "",
+        "failed": []
+    }
+    with zipfile.ZipFile(path) as archive:
+        data = next(
+            name for name in archive.namelist()
+            if name.endswith("/fastqc_data.txt")
+        )
+        lines = archive.read(data).decode().split("\n")
+
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if line.startswith(">>") and not line.startswith(">>END_MODULE"):
+            if len(fields) > 1 and fields[1] == "fail":
+                record["failed"].append(fields[0][2:])
+        elif fields[0] == "Total Sequences":
+            record["total_sequences"] = to_number(fields[1])
+        elif fields[0] == "%GC":
+            record["gc"] = to_number(fields[1])
+        elif fields[0] == "Sequence length":
+            record["length"] = to_number(fields[1])
+    return record
+
+
+def test_read_fastqc(tmp_path) -> None:
+    """
+    This function tests the FastQC archives parsing
+
+    Example:
+    pytest -v qc_records.py -k test_read_fastqc
+    """
+    path = tmp_path / "s1_R1_fastqc.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("s1_R1_fastqc/fastqc_data.txt", (
+            "##FastQC\t0.11.9\n"
+            ">>Basic Statistics\tpass\n"
+            "#Measure\tValue\n"
+            "Total Sequences\t1000\n"
+            "Sequence length\t35-151\n"
+            "%GC\t48\n"
+            ">>END_MODULE\n"
+            ">>Per base sequence content\tfail\n"
+            ">>END_MODULE\n"
+        ))
+    assert read_fastqc(path) == {
+        "fastq": "s1_R1", "total_sequences": 1000, "gc": 48,
+        "length": "35-151", "failed": ["Per base sequence content"]
+    }
+
+
+def read_fastp(path: Path) -> Dict[str, Any]:
+    """
+    Parse the raw reads statistics of a fastp report, as a FastQC record
+
+    Parameters:
+        path    Path                Path to a fastp json report
+
+    Return:
+                Dict[str, Any]      Fastq quality record
+
+    Example:
+    >>> read_fastp(Path("qc/fastp/s1_R1.fastq.gz.fastp.json"))
+    {'fastq': 's1_R1.fastq.gz', 'total_sequences': 1000, 'gc': 48.0,
+     'length': 150, 'failed': []}
+    """
+    with path.open() as report:
+        raw = json.load(report)["summary"]["before_filtering"]
+    return {
+        "fastq": path.name[:-len(".fastp.json")],
+        "total_sequences": raw["total_reads"],
+        "gc": round(raw["gc_content"] * 100, 2),
+        "length": raw["read1_mean_length"],
+        "failed": []
+    }
+
+
+def test_read_fastp(tmp_path) -> None:
+    """
+    This function tests the fastp reports parsing
+
+    Example:
+    pytest -v qc_records.py -k test_read_fastp
+    """
+    path = tmp_path / "s1_R1.fastq.gz.fastp.json"
+    path.write_text(json.dumps({"summary": {"before_filtering": {
+        "total_reads": 1000, "gc_content": 0.48, "read1_mean_length": 150
+    }}}))
+    assert read_fastp(path) == {
+        "fastq": "s1_R1.fastq.gz", "total_sequences": 1000, "gc": 48.0,
+        "length": 150, "failed": []
+    }
+
+
+def read_picard(path: Path, keep: List[str]) -> List[Dict[str, Any]]:
+    """
+    Parse the metrics table of a Picard metrics file, histograms excluded
+
+    Parameters:
+        path    Path                    Path to a Picard metrics file
+        keep    List[str]               Metrics kept
+
+    Return:
+                List[Dict[str, Any]]    Metrics rows
+
+    Example:
+    >>> read_picard(Path("s1.metrics.txt"), ["PERCENT_DUPLICATION"])
+    [{'PERCENT_DUPLICATION': 0.1}]
+    """
+    rows, header = [], None
+    for line in path.read_text().split("\n"):
+        if line.startswith("## METRICS CLASS"):
+            header = []
+        elif header == []:
+            header = line.split("\t")
+        elif header is not None and line.strip() == "":
+            break
+        elif header is not None:
+            row = dict(zip(header, line.split("\t")))
+            rows.append({
+                metric: to_number(row.get(metric, ""))
+                for metric in keep + (
+                    ["CATEGORY"] if "CATEGORY" in row else []
+                )
+            })
+    return rows
+
+
+def test_read_picard(tmp_path) -> None:
+    """
+    This function tests the Picard metrics parsing
+
+    Example:
+    pytest -v qc_records.py -k test_read_picard
+    """
+    path = tmp_path / "s1_summary.txt"
+    path.write_text(
+        "## htsjdk.samtools.metrics.StringHeader\n"
+        "\n"
+        "## METRICS CLASS\tpicard.analysis.AlignmentSummaryMetrics\n"
+        "CATEGORY\tTOTAL_READS\tPCT_PF_READS_ALIGNED\n"
+        "FIRST_OF_PAIR\t100\t0.99\n"
+        "PAIR\t200\t0.98\n"
+        "\n"
+        "## HISTOGRAM\tjava.lang.Integer\n"
+        "insert_size\tAll_Reads.fr_count\n"
+        "100\t3\n"
+    )
+    assert read_picard(path, ["TOTAL_READS", "PCT_PF_READS_ALIGNED"]) == [
+        {"TOTAL_READS": 100, "PCT_PF_READS_ALIGNED": 0.99,
+         "CATEGORY": "FIRST_OF_PAIR"},
+        {"TOTAL_READS": 200, "PCT_PF_READS_ALIGNED": 0.98, "CATEGORY": "PAIR"}
+    ]
+
+
+def record(sample: str,
+           fastqc: List[Path] = [],
+           fastp: List[Path] = [],
+           duplicates: Path = None,
+           summary: Path = None,
+           insert_size: Path = None) -> Dict[str, Any]:
+    """
+    Build the compact quality control record of a sample. Picard
+    alignment summaries are reduced to their PAIR category for paired
+    reads, UNPAIRED otherwise.
+
+    Parameters:
+        sample      str             Sample identifier
+        fastqc      List[Path]      Paths to FastQC archives
+        fastp       List[Path]      Paths to fastp json reports
+        duplicates  Path            Path to Picard duplicates metrics
+        summary     Path            Path to Picard alignment summary
+        insert_size Path            Path to Picard insert size metrics
+
+    Return:
+                    Dict[str, Any]  Sample record
+
+    Example:
+    >>> record("s1", fastqc=[Path("qc/fastqc/s1_R1_fastqc.zip")])
+    {'sample': 's1', 'fastq': [{'fastq': 's1_R1', ...}]}
+    """
+    sample_record = {
+        "sample": sample,
+        "fastq": (
+            [read_fastqc(path) for path in fastqc]
+            + [read_fastp(path) for path in fastp]
+        )
+    }
+    if duplicates is not None:
+        rows = read_picard(duplicates, DUPLICATES_METRICS)
+        sample_record["duplicates"] = rows[0] if rows else {}
+    if summary is not None:
+        rows = {
+            row["CATEGORY"]: row
+            for row in read_picard(summary, SUMMARY_METRICS)
+        }
+        row = rows.get("PAIR", rows.get("UNPAIRED", {}))
+        row.pop("CATEGORY", None)
+        sample_record["summary"] = row
+    if insert_size is not None:
+        rows = read_picard(insert_size, INSERT_SIZE_METRICS)
+        sample_record["insert_size"] = rows[0] if rows else {}
+    return sample_record
+
+
+def test_record(tmp_path) -> None:
+    """
+    This function tests the sample records building
+
+    Example:
+    pytest -v qc_records.py -k test_record
+    """
+    summary = tmp_path / "s1_summary.txt"
+    summary.write_text(
+        "## METRICS CLASS\tpicard.analysis.AlignmentSummaryMetrics\n"
+        "CATEGORY\tTOTAL_READS\tPCT_PF_READS_ALIGNED\n"
+        "UNPAIRED\t100\t0.99\n"
+    )
+    duplicates = tmp_path / "s1.metrics.txt"
+    duplicates.write_text(
+        "## METRICS CLASS\tpicard.sam.DuplicationMetrics\n"
+        "LIBRARY\tREAD_PAIRS_EXAMINED\tPERCENT_DUPLICATION\n"
+        "standard\t0\t0.1\n"
+    )
+    sample_record = record("s1", duplicates=duplicates, summary=summary)
+    assert sample_record == {
+        "sample": "s1",
+        "fastq": [],
+        "duplicates": {
+            "UNPAIRED_READS_EXAMINED": "", "READ_PAIRS_EXAMINED": 0,
+            "PERCENT_DUPLICATION": 0.1
+        },
+        "summary": {
+            "TOTAL_READS": 100, "PF_READS_ALIGNED": "",
+            "PCT_PF_READS_ALIGNED": 0.99, "MEAN_READ_LENGTH": ""
+        }
+    }
+
+
+# Building cohort tables
+def design_samples(design: Path) -> List[str]:
+    """
+    Return the samples identifiers of a design file, in design order and
+    without duplicates (samples sequenced on several lanes)
+    """
+    with design.open() as stream:
+        samples = [
+            row["Sample_id"]
+            for row in csv.DictReader(stream, delimiter="\t")
+        ]
+    return list(dict.fromkeys(samples))
+
+
+def test_design_samples(tmp_path) -> None:
+    """
+    This function tests the design samples listing
+
+    Example:
+    pytest -v qc_records.py -k test_design_samples
+    """
+    design = tmp_path / "design.tsv"
+    design.write_text(
+        "Sample_id\tUpstream_file\tLane\n"
+        "s2\ta.fq\t1\ns1\tb.fq\t1\ns2\tc.fq\t2\n"
+    )
+    assert design_samples(design) == ["s2", "s1"]
+
+
+def sample_row(sample_record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the cohort table row of a sample record. Ratios are given as
+    percentages, empty when not measured.
+
+    Parameters:
+        sample_record   Dict[str, Any]  Sample record
+
+    Return:
+                        Dict[str, Any]  Samples table row
+
+    Example:
+    >>> sample_row({"sample": "s1", "fastq": [], "summary": {...}})
+    {'Sample': 's1', 'Fastq sequences': 0, ..., 'Aligned %': 99.0, ...}
+    """
+    def percent(section: str, metric: str) -> Any:
+        value = sample_record.get(section, {}).get(metric, "")
+        if isinstance(value, (int, float)):
+            return round(value * 100, 2)
+        return ""
+
+    fastq = sample_record.get("fastq", [])
+    return {
+        "Sample": sample_record["sample"],
+        "Fastq sequences": sum(
+            record["total_sequences"] for record in fastq
+        ),
+        "Failed FastQC modules": sum(
+            len(record["failed"]) for record in fastq
+        ),
+        "Total reads": sample_record.get("summary", {}).get(
+            "TOTAL_READS", ""
+        ),
+        "Aligned %": percent("summary", "PCT_PF_READS_ALIGNED"),
+        "Duplication %": percent("duplicates", "PERCENT_DUPLICATION"),
+        "Median insert size": sample_record.get("insert_size", {}).get(
+            "MEDIAN_INSERT_SIZE", ""
+        )
+    }
+
+
+def aggregate(records: Path,
+              samples: List[str],
+              fastq_table: Path,
+              samples_table: Path) -> int:
+    """
+    Write the cohort tables from sample records, reading one record at a
+    time, so that memory does not grow with the cohort
+
+    Parameters:
+        records         Path        Path to the records directory
+        samples         List[str]   Samples identifiers
+        fastq_table     Path        Path to the per-fastq table
+        samples_table   Path        Path to the per-sample table
+
+    Return:
+                        int         Number of samples written
+
+    Example:
+    >>> aggregate(Path("qc/records"), ["s1", "s2"],
+                  Path("fastq_mqc.tsv"), Path("samples_mqc.tsv"))
+    2
+    """
+    with fastq_table.open("w") as fastq_stream, \
+            samples_table.open("w") as samples_stream:
+        fastq_stream.write(FASTQ_HEADER)
+        samples_stream.write(SAMPLE_HEADER)
+        fastq_writer = csv.DictWriter(
+            fastq_stream, fieldnames=FASTQ_COLUMNS, delimiter="\t",
+            lineterminator="\n"
+        )
+        samples_writer = csv.DictWriter(
+            samples_stream, fieldnames=SAMPLE_COLUMNS, delimiter="\t",
+            lineterminator="\n"
+        )
+        fastq_writer.writeheader()
+        samples_writer.writeheader()
+
+        for sample in samples:
+            with (records / f"{sample}.json").open() as stream:
+                sample_record = json.load(stream)
+            samples_writer.writerow(sample_row(sample_record))
+            for fastq in sample_record.get("fastq", []):
+                fastq_writer.writerow({
+                    "Fastq": fastq["fastq"],
+                    "Sample": sample,
+                    "Total sequences": fastq["total_sequences"],
+                    "GC %": fastq["gc"],
+                    "Sequence length": fastq["length"],
+                    "Failed modules": ", ".join(fastq["failed"])
+                })
+    logger.debug("%s samples aggregated", len(samples))
+    return len(samples)
+
+
+def test_aggregate(tmp_path) -> None:
+    """
+    This function tests the cohort tables building
+
+    Example:
+    pytest -v qc_records.py -k test_aggregate
+    """
+    (tmp_path / "s1.json").write_text(json.dumps({
+        "sample": "s1",
+        "fastq": [{
+            "fastq": "s1_R1", "total_sequences": 10, "gc": 48,
+            "length": 150, "failed": ["Adapter Content", "Kmer Content"]
+        }],
+        "duplicates": {"PERCENT_DUPLICATION": 0.125},
+        "insert_size": {"MEDIAN_INSERT_SIZE": 300}
+    }))
+    (tmp_path / "s2.json").write_text(json.dumps({
+        "sample": "s2", "fastq": [], "summary": {"TOTAL_READS": 10}
+    }))
+    fastq, samples = tmp_path / "fastq_mqc.tsv", tmp_path / "samples_mqc.tsv"
+    assert aggregate(tmp_path, ["s1", "s2"], fastq, samples) == 2
+
+    assert fastq.read_text().split("\n")[-2] == (
+        "s1_R1\ts1\t10\t48\t150\tAdapter Content, Kmer Content"
+    )
+    lines = samples.read_text().split("\n")
+    assert lines[0] == "# id: 'cohort_samples'"
+    assert lines[-3:-1] == ["s1\t10\t2\t\t\t12.5\t300", "s2\t0\t0\t10\t\t\t"]
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("record --sample s1 --output s1.json"))
+    Namespace(debug=False, duplicates=None, fastp=[], fastqc=[],
+    insert_size=None, output='s1.json', quiet=False, sample='s1',
+    subcommand='record', summary=None)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    subparsers = main_parser.add_subparsers(dest="subcommand")
+    subparsers.required = True
+
+    record_parser = subparsers.add_parser(
+        "record",
+        help="Parse the quality controls of a sample into a record",
+        formatter_class=CustomFormatter
+    )
+    record_parser.add_argument(
+        "--sample",
+        help="Sample identifier",
+        type=str,
+        required=True
+    )
+    record_parser.add_argument(
+        "--output",
+        help="Path to the sample record",
+        type=str,
+        required=True
+    )
+    record_parser.add_argument(
+        "--fastqc",
+        help="Paths to the FastQC archives of the sample",
+        type=str,
+        nargs="*",
+        default=[]
+    )
+    record_parser.add_argument(
+        "--fastp",
+        help="Paths to the fastp json reports of the sample",
+        type=str,
+        nargs="*",
+        default=[]
+    )
+    record_parser.add_argument(
+        "--duplicates",
+        help="Path to the Picard duplicates metrics",
+        type=str,
+        default=None
+    )
+    record_parser.add_argument(
+        "--summary",
+        help="Path to the Picard alignment summary metrics",
+        type=str,
+        default=None
+    )
+    record_parser.add_argument(
+        "--insert-size",
+        help="Path to the Picard insert size metrics",
+        type=str,
+        default=None
+    )
+
+    aggregate_parser = subparsers.add_parser(
+        "aggregate",
+        help="Build the cohort tables from sample records",
+        formatter_class=CustomFormatter
+    )
+    aggregate_parser.add_argument(
+        "records",
+        help="Path to the records directory",
+        type=str
+    )
+    aggregate_parser.add_argument(
+        "--design",
+        help="Path to the design file listing the cohort samples",
+        type=str,
+        required=True
+    )
+    aggregate_parser.add_argument(
+        "--fastq",
+        help="Path to the per-fastq table",
+        type=str,
+        default="fastq_mqc.tsv"
+    )
+    aggregate_parser.add_argument(
+        "--samples",
+        help="Path to the per-sample table",
+        type=str,
+        default="samples_mqc.tsv"
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v qc_records.py -k test_parse_args
+    """
+    options = parse_args(shlex.split(
+        "record --sample s1 --output s1.json --fastqc a.zip b.zip "
+        "--summary s1_summary.txt"
+    ))
+    expected = argparse.Namespace(
+        debug=False,
+        duplicates=None,
+        fastp=[],
+        fastqc=["a.zip", "b.zip"],
+        insert_size=None,
+        output="s1.json",
+        quiet=False,
+        sample="s1",
+        subcommand="record",
+        summary="s1_summary.txt"
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    This function performs the requested records operation
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Example:
+    >>> main(parse_args(shlex.split(
+        "aggregate qc/records --design design.tsv"
+    )))
+    """
+    def optional(path: str) -> Path:
+        return Path(path) if path is not None else None
+
+    if args.subcommand == "record":
+        sample_record = record(
+            sample=args.sample,
+            fastqc=[Path(path) for path in args.fastqc],
+            fastp=[Path(path) for path in args.fastp],
+            duplicates=optional(args.duplicates),
+            summary=optional(args.summary),
+            insert_size=optional(args.insert_size)
+        )
+        with open(args.output, "w") as output:
+            json.dump(sample_record, output, indent=1)
+    elif args.subcommand == "aggregate":
+        aggregate(
+            records=Path(args.records),
+            samples=design_samples(Path(args.design)),
+            fastq_table=Path(args.fastq),
+            samples_table=Path(args.samples)
+        )
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Processing quality control records")
+        main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,691 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script manages a persistent, content-addressed cache of reference
+indexes shared by all runs of the wes-mapping-bwa-gatk pipeline
+
+Each entry is keyed by a checksum of the source file content (FASTA, VCF),
+the conda environment used to build the index and the build command. On a
+cache miss, the index is built once under an exclusive lock, so that two
+pipelines starting at the same time never build it twice. On a cache hit,
+the index files are linked into the working directory.
+
+You can test this script with:
+pytest -v ./reference_cache.py
+
+Usage example:
+# Fetch (or build) bwa indexes for a fasta file
+python3.8 ./reference_cache.py --cache /path/to/cache fetch \
+    --source /path/to/genome.fa --tool-file ../envs/reference_cache.yaml \
+    --command "bwa index -p {outdir}/genome.fa {source}" \
+    --outputs bwa/index/genome.fa.amb bwa/index/genome.fa.ann
+
+# List cache entries
+python3.8 ./reference_cache.py --cache /path/to/cache list
+
+# Evict entries unused for 30 days
+python3.8 ./reference_cache.py --cache /path/to/cache evict --older-than 30
+"""
+
+import argparse             # Parse command line
+import datetime             # Human readable dates
+import errno                # Error codes
+import fcntl                # File locking
+import hashlib              # Checksums
+import json                 # Entries manifests
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import shutil               # High level file operations
+import subprocess           # Build commands
+import sys                  # System related methods
+import time                 # Timestamps
+
+from contextlib import contextmanager           # Lock context
+from pathlib import Path                        # Paths related methods
+from typing import Any, Dict, Generator, List   # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+# Locking the cache
+@contextmanager
+def locked(lock_path: Path) -> Generator[None, None, None]:
+    """
+    Hold an exclusive lock on the given file for the duration of the context
+
+    Parameters:
+        lock_path   Path        Path to the lock file, created if missing
+
+    Example:
+    >>> with locked(Path("/path/to/cache/entry.lock")):
+    ...     pass
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_path.open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# Content checksums
+def file_checksum(path: Path, cache: Path) -> str:
+    """
+    Return the sha256 of a file content. Checksums are memoized in the
+    cache, keyed by real path, size and modification time, so that large
+    references are read only once.
+
+    Parameters:
+        path    Path    Path to the file to checksum
+        cache   Path    Path to the cache directory
+
+    Return:
+                str     The hexadecimal sha256 of the file content
+
+    Example:
+    >>> file_checksum(Path("genome.fa"), Path("/path/to/cache"))
+    'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+    """
+    stat = path.stat()
+    memo_key = f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    memo_path = cache / "checksums.json"
+
+    with locked(cache / "checksums.lock"):
+        memo = json.loads(memo_path.read_text()) if memo_path.exists() else {}
+        if memo_key in memo:
+            logger.debug(f"Checksum of {path} found in memo")
+            return memo[memo_key]
+
+        logger.info(f"Computing checksum of {path}")
+        sha = hashlib.sha256()
+        with path.open("rb") as content:
+            for block in iter(lambda: content.read(1 << 20), b""):
+                sha.update(block)
+
+        memo[memo_key] = sha.hexdigest()
+        memo_path.write_text(json.dumps(memo, indent=2))
+        return memo[memo_key]
+
+
+def test_file_checksum(tmp_path) -> None:
+    """
+    This function tests the checksum computation and its memoization
+
+    Example:
+    pytest -v reference_cache.py -k test_file_checksum
+    """
+    source = tmp_path / "genome.fa"
+    source.write_text("")
+    expected = (
+        "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+    )
+    assert file_checksum(source, tmp_path) == expected
+    assert (tmp_path / "checksums.json").exists()
+    assert file_checksum(source, tmp_path) == expected
+
+
+def entry_key(source_sum: str, tool: str, command: str) -> str:
+    """
+    Return the cache key of an index
+
+    Parameters:
+        source_sum  str     Checksum of the source file content
+        tool        str     Content of the file pinning tools versions
+        command     str     Build command template
+
+    Return:
+                    str     The hexadecimal sha256 cache key
+
+    Example:
+    >>> entry_key("e3b0...", "bwa=0.7.17", "bwa index {source}")
+    '5c1b...'
+    """
+    sha = hashlib.sha256()
+    for item in (source_sum, tool, command):
+        sha.update(item.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def test_entry_key() -> None:
+    """
+    This function tests that every key component changes the key
+
+    Example:
+    pytest -v reference_cache.py -k test_entry_key
+    """
+    key = entry_key("abc", "bwa=0.7.17", "bwa index {source}")
+    assert key == entry_key("abc", "bwa=0.7.17", "bwa index {source}")
+    assert key != entry_key("abd", "bwa=0.7.17", "bwa index {source}")
+    assert key != entry_key("abc", "bwa=0.7.18", "bwa index {source}")
+    assert key != entry_key("abc", "bwa=0.7.17", "bwa index -a is {source}")
+
+
+# Linking cached files
+def link(cached: Path, destination: Path) -> str:
+    """
+    Hardlink a cached file to its destination, or symlink it when the
+    cache lies on another filesystem
+
+    Parameters:
+        cached          Path    Path to the file within the cache
+        destination     Path    Path to the linked file
+
+    Return:
+                        str     The kind of link made
+
+    Example:
+    >>> link(Path("/cache/key/genome.fa.fai"), Path("genome/genome.fa.fai"))
+    'hardlink'
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists() or destination.is_symlink():
+        destination.unlink()
+
+    try:
+        os.link(cached, destination)
+        return "hardlink"
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        destination.symlink_to(cached.resolve())
+        return "symlink"
+
+
+# Fetching entries
+def fetch(cache: Path,
+          source: Path,
+          tool: str,
+          command: str,
+          outputs: List[Path],
+          depends: List[Path] = None) -> bool:
+    """
+    Link the requested outputs from the cache, building them first on a
+    cache miss
+
+    Parameters:
+        cache       Path        Path to the cache directory
+        source      Path        Path to the indexed file
+        tool        str         Content of the file pinning tools versions
+        command     str         Build command template. {source} is
+                                replaced by the source path and {outdir} by
+                                the directory in which outputs must be built
+        outputs     List[Path]  Destination paths. Built files are looked
+                                for with the same name in {outdir}
+        depends     List[Path]  Further files read by the build command,
+                                e.g. capture targets. Their content is part
+                                of the key, {depends} is replaced by their
+                                paths
+
+    Return:
+                    bool        True on a cache hit, False on a cache miss
+
+    Example:
+    >>> fetch(
+        Path("/path/to/cache"), Path("genome.fa"), "samtools=1.9",
+        "ln -s {source} {outdir}/g.fa && samtools faidx {outdir}/g.fa",
+        [Path("genome/g.fa.fai")]
+    )
+    True
+    """
+    cache.mkdir(parents=True, exist_ok=True)
+    depends = depends or []
+    key = entry_key(
+        ":".join(file_checksum(path, cache) for path in [source] + depends),
+        tool,
+        command
+    )
+    entry = cache / key
+    hit = True
+
+    with locked(cache / f"{key}.lock"):
+        if not (entry / "manifest.json").exists():
+            hit = False
+            logger.info(f"Cache miss for {source.name}, building {key}")
+            staging = cache / f"{key}.tmp-{os.getpid()}"
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir()
+            try:
+                subprocess.run(
+                    command.format(
+                        source=shlex.quote(str(source.resolve())),
+                        outdir=shlex.quote(str(staging)),
+                        depends=" ".join(
+                            shlex.quote(str(path.resolve()))
+                            for path in depends
+                        )
+                    ),
+                    shell=True,
+                    check=True
+                )
+                for output in outputs:
+                    built = staging / output.name
+                    if not built.is_file() or built.is_symlink():
+                        raise FileNotFoundError(f"Missing output: {built}")
+                    built.chmod(0o444)
+                for extra in staging.iterdir():
+                    if extra.name not in {output.name for output in outputs}:
+                        extra.unlink()
+
+                manifest = {
+                    "key": key,
+                    "source": str(source.resolve()),
+                    "depends": [str(path.resolve()) for path in depends],
+                    "command": command,
+                    "files": sorted(output.name for output in outputs),
+                    "size": sum(
+                        (staging / output.name).stat().st_size
+                        for output in outputs
+                    ),
+                    "created": time.time()
+                }
+                (staging / "manifest.json").write_text(
+                    json.dumps(manifest, indent=2)
+                )
+                staging.rename(entry)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        else:
+            logger.info(f"Cache hit for {source.name}: {key}")
+
+        for output in outputs:
+            kind = link(entry / output.name, output)
+            logger.info(f"Linked {output} ({kind})")
+        (entry / "last_used").write_text(str(time.time()))
+
+    return hit
+
+
+def test_fetch(tmp_path) -> None:
+    """
+    This function tests that an entry is built once, then linked
+
+    Example:
+    pytest -v reference_cache.py -k test_fetch
+    """
+    cache = tmp_path / "cache"
+    source = tmp_path / "genome.fa"
+    source.write_text(">chr1\nACGT\n")
+    command = "cp {source} {outdir}/genome.fa.copy"
+
+    first = tmp_path / "run1" / "genome.fa.copy"
+    assert fetch(cache, source, "tool=1", command, [first]) is False
+    assert first.read_text() == ">chr1\nACGT\n"
+
+    second = tmp_path / "run2" / "genome.fa.copy"
+    assert fetch(cache, source, "tool=1", command, [second]) is True
+    assert second.read_text() == ">chr1\nACGT\n"
+    assert len(list_entries(cache)) == 1
+
+    third = tmp_path / "run3" / "genome.fa.copy"
+    assert fetch(cache, source, "tool=2", command, [third]) is False
+    assert len(list_entries(cache)) == 2
+
+
+def test_fetch_depends(tmp_path) -> None:
+    """
+    This function tests that the files a build depends on are keyed too
+
+    Example:
+    pytest -v reference_cache.py -k test_fetch_depends
+    """
+    cache = tmp_path / "cache"
+    source = tmp_path / "known.vcf"
+    source.write_text("chr1\t10\n")
+    targets = tmp_path / "targets.bed"
+    targets.write_text("chr1\t0\t100\n")
+    command = "cat {source} {depends} > {outdir}/known.compact.vcf"
+
+    first = tmp_path / "run1" / "known.compact.vcf"
+    assert fetch(cache, source, "tool=1", command, [first], [targets]) is False
+    assert first.read_text() == "chr1\t10\nchr1\t0\t100\n"
+
+    second = tmp_path / "run2" / "known.compact.vcf"
+    assert fetch(cache, source, "tool=1", command, [second], [targets]) is True
+
+    targets.write_text("chr2\t0\t100\n")
+    third = tmp_path / "run3" / "known.compact.vcf"
+    assert fetch(cache, source, "tool=1", command, [third], [targets]) is False
+    assert third.read_text() == "chr1\t10\nchr2\t0\t100\n"
+
+
+def test_fetch_failure(tmp_path) -> None:
+    """
+    This function tests that a failed build leaves no entry behind
+
+    Example:
+    pytest -v reference_cache.py -k test_fetch_failure
+    """
+    # pytest is not available within tools environments
+    import pytest
+
+    cache = tmp_path / "cache"
+    source = tmp_path / "genome.fa"
+    source.write_text(">chr1\nACGT\n")
+    with pytest.raises(FileNotFoundError):
+        fetch(cache, source, "tool=1", "true", [tmp_path / "genome.fa.fai"])
+    assert list_entries(cache) == []
+
+
+# Listing and evicting entries
+def list_entries(cache: Path) -> List[Dict[str, Any]]:
+    """
+    Return the manifests of all complete cache entries, with their last
+    usage time
+
+    Parameters:
+        cache   Path                    Path to the cache directory
+
+    Return:
+                List[Dict[str, Any]]    One manifest per entry
+
+    Example:
+    >>> list_entries(Path("/path/to/cache"))
+    [{'key': '5c1b...', 'source': '/path/to/genome.fa', ...}]
+    """
+    entries = []
+    if not cache.exists():
+        return entries
+
+    for manifest_path in sorted(cache.glob("*/manifest.json")):
+        manifest = json.loads(manifest_path.read_text())
+        last_used = manifest_path.parent / "last_used"
+        manifest["last_used"] = (
+            float(last_used.read_text())
+            if last_used.exists() else manifest["created"]
+        )
+        entries.append(manifest)
+    return entries
+
+
+def evict(cache: Path,
+          older_than: float = None,
+          keys: List[str] = None,
+          dry_run: bool = False) -> List[str]:
+    """
+    Remove cache entries, either unused for a given number of days, or
+    given by their keys
+
+    Parameters:
+        cache       Path        Path to the cache directory
+        older_than  float       Evict entries unused for this many days
+        keys        List[str]   Evict these entries (key prefixes allowed)
+        dry_run     bool        Only report what would be evicted
+
+    Return:
+                    List[str]   The evicted keys
+
+    Example:
+    >>> evict(Path("/path/to/cache"), older_than=30)
+    ['5c1b...']
+    """
+    evicted = []
+    now = time.time()
+    for entry in list_entries(cache):
+        stale = (
+            older_than is not None
+            and now - entry["last_used"] > older_than * 86400
+        )
+        named = any(entry["key"].startswith(key) for key in keys or [])
+        if not (stale or named):
+            continue
+
+        evicted.append(entry["key"])
+        if dry_run is True:
+            logger.info(f"Would evict {entry['key']}")
+            continue
+
+        # Running pipelines keep their hardlinks, removal is safe. Lock
+        # files are kept: a waiting process may already hold them open.
+        with locked(cache / f"{entry['key']}.lock"):
+            logger.info(f"Evicting {entry['key']}")
+            shutil.rmtree(cache / entry["key"])
+
+    return evicted
+
+
+def test_evict(tmp_path) -> None:
+    """
+    This function tests eviction by age and by key
+
+    Example:
+    pytest -v reference_cache.py -k test_evict
+    """
+    cache = tmp_path / "cache"
+    source = tmp_path / "genome.fa"
+    source.write_text(">chr1\nACGT\n")
+    command = "cp {source} {outdir}/genome.fa.copy"
+    fetch(cache, source, "tool=1", command, [tmp_path / "genome.fa.copy"])
+    key = list_entries(cache)[0]["key"]
+
+    assert evict(cache, older_than=1) == []
+    assert evict(cache, keys=[key[:8]], dry_run=True) == [key]
+    assert len(list_entries(cache)) == 1
+    assert evict(cache, older_than=0) == [key]
+    assert list_entries(cache) == []
+    assert (tmp_path / "genome.fa.copy").read_text() == ">chr1\nACGT\n"
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("--cache /path/to/cache list"))
+    Namespace(cache='/path/to/cache', debug=False, quiet=False,
+    subcommand='list')
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+    main_parser.add_argument(
+        "-c", "--cache",
+        help="Path to the reference cache directory",
+        type=str,
+        required=True
+    )
+
+    subparsers = main_parser.add_subparsers(dest="subcommand")
+    subparsers.required = True
+
+    fetch_parser = subparsers.add_parser(
+        "fetch",
+        help="Link indexes from the cache, building them on a cache miss",
+        formatter_class=CustomFormatter
+    )
+    fetch_parser.add_argument(
+        "--source",
+        help="Path to the indexed file",
+        type=str,
+        required=True
+    )
+    fetch_parser.add_argument(
+        "--tool-file",
+        help="Path to the file pinning tools versions",
+        type=str,
+        required=True
+    )
+    fetch_parser.add_argument(
+        "--command",
+        help="Build command, using {source} and {outdir} place holders",
+        type=str,
+        required=True
+    )
+    fetch_parser.add_argument(
+        "--depends",
+        help="Space separated list of further files read by the build "
+             "command, using the {depends} place holder",
+        type=str,
+        nargs="+",
+        default=[]
+    )
+    fetch_parser.add_argument(
+        "--outputs",
+        help="Space separated list of paths to linked indexes",
+        type=str,
+        nargs="+",
+        required=True
+    )
+
+    subparsers.add_parser(
+        "list",
+        help="List cache entries",
+        formatter_class=CustomFormatter
+    )
+
+    evict_parser = subparsers.add_parser(
+        "evict",
+        help="Remove cache entries",
+        formatter_class=CustomFormatter
+    )
+    evict_parser.add_argument(
+        "--older-than",
+        help="Evict entries unused for this number of days",
+        type=float,
+        default=None
+    )
+    evict_parser.add_argument(
+        "--keys",
+        help="Space separated list of keys (or key prefixes) to evict",
+        type=str,
+        nargs="+",
+        default=[]
+    )
+    evict_parser.add_argument(
+        "--dry-run",
+        help="Only list entries that would be evicted",
+        action="store_true"
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v reference_cache.py -k test_parse_args
+    """
+    options = parse_args(shlex.split(
+        "--cache /path/to/cache evict --older-than 30"
+    ))
+    expected = argparse.Namespace(
+        cache="/path/to/cache",
+        debug=False,
+        dry_run=False,
+        keys=[],
+        older_than=30.0,
+        quiet=False,
+        subcommand="evict"
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    This function performs the requested cache operation
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Example:
+    >>> main(parse_args(shlex.split("--cache /path/to/cache list")))
+    """
+    cache = Path(args.cache)
+    if args.subcommand == "fetch":
+        fetch(
+            cache=cache,
+            source=Path(args.source),
+            tool=Path(args.tool_file).read_text(),
+            command=args.command,
+            outputs=[Path(output) for output in args.outputs],
+            depends=[Path(path) for path in args.depends]
+        )
+    elif args.subcommand == "list":
+        print("key", "last_used", "size", "files", "source", sep="\t")
+        for entry in list_entries(cache):
+            print(
+                entry["key"],
+                datetime.datetime.fromtimestamp(
+                    entry["last_used"]
+                ).isoformat(timespec="seconds"),
+                entry["size"],
+                ",".join(entry["files"]),
+                entry["source"],
+                sep="\t"
+            )
+    elif args.subcommand == "evict":
+        evict(cache, args.older_than, args.keys, args.dry_run)
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Managing reference cache")
+        main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,765 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script builds a synthetic whole exome sequencing dataset, used to
+benchmark the pipeline offline and reproducibly. It writes:
+
+- a random genome sequence (genome/genome.fasta)
+- capture targets (genome/targets.bed)
+- known sites (genome/dbsnp.vcf.gz, bgzip compressed)
+- paired or single reads drawn over the targets (reads/*.fastq.gz)
+- a design file (design.tsv) and a simulation manifest (simulation.json)
+
+Reads carry sequencing errors and a configurable fraction of duplicates.
+The same seed always builds the same dataset.
+
+You can test this script with:
+pytest -v ./simulate_wes.py
+
+Usage example:
+python3.8 ./simulate_wes.py --output-dir tests/benchmark --samples 2 \
+    --reads 100000 --read-length 150 --duplicate-rate 0.1
+"""
+
+import argparse             # Parse command line
+import gzip                 # Compress fastq files
+import json                 # Simulation manifest
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import math                 # Errors positions
+import os                   # OS related activities
+import random               # Random sequences
+import shlex                # Lexical analysis
+import struct               # BGZF blocks
+import sys                  # System related methods
+import zlib                 # BGZF compression
+
+from pathlib import Path                           # Paths related methods
+from typing import Any, Dict, Iterator, List, Tuple  # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+# Empty BGZF block closing every bgzip file
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+# Building the reference
+def random_genome(size: int,
+                  contigs: int,
+                  rng: random.Random) -> Dict[str, str]:
+    """
+    Build a random genome sequence split into contigs of equal length
+
+    Parameters:
+        size        int             Total genome length
+        contigs     int             Number of contigs
+        rng         Random          Random number generator
+
+    Return:
+                    Dict[str, str]  Sequences, by contig name
+
+    Example:
+    >>> random_genome(8, 2, random.Random(1))
+    {'chr1': 'AGTC', 'chr2': 'GATT'}
+    """
+    length = size // contigs
+    return {
+        f"chr{index + 1}": "".join(rng.choices("ACGT", k=length))
+        for index in range(contigs)
+    }
+
+
+def test_random_genome() -> None:
+    """
+    This function tests the genome generation
+
+    Example:
+    pytest -v simulate_wes.py -k test_random_genome
+    """
+    genome = random_genome(1000, 4, random.Random(1))
+    assert list(genome.keys()) == ["chr1", "chr2", "chr3", "chr4"]
+    assert all(len(seq) == 250 for seq in genome.values())
+    assert set("".join(genome.values())) == set("ACGT")
+    assert genome == random_genome(1000, 4, random.Random(1))
+
+
+def random_targets(genome: Dict[str, str],
+                   targets: int,
+                   length: int,
+                   rng: random.Random) -> List[Tuple[str, int, int]]:
+    """
+    Draw capture targets (exons) over the genome, sorted by position
+
+    Parameters:
+        genome      Dict[str, str]  Sequences, by contig name
+        targets     int             Number of targets
+        length      int             Length of each target
+        rng         Random          Random number generator
+
+    Return:
+                    List[Tuple]     Contig, 0-based start and end
+
+    Example:
+    >>> random_targets({"chr1": "A" * 1000}, 2, 100, random.Random(1))
+    [('chr1', 134, 234), ('chr1', 582, 682)]
+    """
+    names = list(genome.keys())
+    drawn = []
+    for _ in range(targets):
+        chrom = rng.choice(names)
+        start = rng.randrange(0, len(genome[chrom]) - length)
+        drawn.append((chrom, start, start + length))
+    return sorted(drawn, key=lambda target: (names.index(target[0]),
+                                             target[1]))
+
+
+def test_random_targets() -> None:
+    """
+    This function tests the targets drawing
+
+    Example:
+    pytest -v simulate_wes.py -k test_random_targets
+    """
+    genome = {"chr1": "A" * 1000, "chr2": "C" * 500}
+    targets = random_targets(genome, 20, 100, random.Random(1))
+    assert len(targets) == 20
+    assert all(end - start == 100 for _, start, end in targets)
+    assert all(end <= len(genome[chrom]) for chrom, _, end in targets)
+    assert targets == sorted(targets, key=lambda t: (t[0], t[1]))
+
+
+def random_known_sites(genome: Dict[str, str],
+                       targets: List[Tuple[str, int, int]],
+                       sites: int,
+                       rng: random.Random) -> List[Tuple[str, int, str, str]]:
+    """
+    Draw known single nucleotide variants within the targets
+
+    Parameters:
+        genome      Dict[str, str]  Sequences, by contig name
+        targets     List[Tuple]     Contig, 0-based start and end
+        sites       int             Number of known sites
+        rng         Random          Random number generator
+
+    Return:
+                    List[Tuple]     Contig, 1-based position, ref and alt
+
+    Example:
+    >>> random_known_sites({"chr1": "ACGT"}, [("chr1", 0, 4)], 1, rng)
+    [('chr1', 3, 'G', 'T')]
+    """
+    names = list(genome.keys())
+    drawn = set()
+    for _ in range(sites):
+        chrom, start, end = rng.choice(targets)
+        position = rng.randrange(start, end)
+        ref = genome[chrom][position]
+        alt = rng.choice([base for base in "ACGT" if base != ref])
+        drawn.add((chrom, position + 1, ref, alt))
+    return sorted(drawn, key=lambda site: (names.index(site[0]), site[1]))
+
+
+def test_random_known_sites() -> None:
+    """
+    This function tests the known sites drawing
+
+    Example:
+    pytest -v simulate_wes.py -k test_random_known_sites
+    """
+    genome = {"chr1": "ACGTACGTAC"}
+    sites = random_known_sites(genome, [("chr1", 2, 6)], 10, random.Random(1))
+    for chrom, position, ref, alt in sites:
+        assert 3 <= position <= 6
+        assert genome[chrom][position - 1] == ref
+        assert alt != ref
+
+
+# Simulating reads
+def add_errors(sequence: str, error_rate: float, rng: random.Random) -> str:
+    """
+    Replace bases at random with a per-base error probability. Errors
+    positions are drawn with geometric jumps, to avoid drawing one random
+    number per base.
+
+    Parameters:
+        sequence    str             Read sequence
+        error_rate  float           Per-base error probability
+        rng         Random          Random number generator
+
+    Return:
+                    str             Read sequence with errors
+
+    Example:
+    >>> add_errors("AAAA", 0.5, random.Random(1))
+    'ACAA'
+    """
+    if error_rate <= 0:
+        return sequence
+
+    bases = list(sequence)
+    position = -1
+    while True:
+        position += 1 + int(math.log(1 - rng.random()) /
+                            math.log(1 - error_rate))
+        if position >= len(bases):
+            break
+        bases[position] = rng.choice(
+            [base for base in "ACGT" if base != bases[position]]
+        )
+    return "".join(bases)
+
+
+def test_add_errors() -> None:
+    """
+    This function tests the sequencing errors
+
+    Example:
+    pytest -v simulate_wes.py -k test_add_errors
+    """
+    rng = random.Random(1)
+    assert add_errors("A" * 100, 0, rng) == "A" * 100
+    errors = sum(
+        base != "A"
+        for _ in range(100)
+        for base in add_errors("A" * 100, 0.01, rng)
+    )
+    assert 50 < errors < 150
+
+
+def simulate_fragments(genome: Dict[str, str],
+                       targets: List[Tuple[str, int, int]],
+                       reads: int,
+                       read_length: int,
+                       insert_size: int,
+                       duplicate_rate: float,
+                       error_rate: float,
+                       paired: bool,
+                       rng: random.Random) -> Iterator[List[str]]:
+    """
+    Draw sequenced fragments overlapping the targets. Each fragment yields
+    one read per mate, mate 2 being reverse complemented. A fraction of
+    fragments duplicates a previously drawn position.
+
+    Parameters:
+        genome          Dict[str, str]  Sequences, by contig name
+        targets         List[Tuple]     Contig, 0-based start and end
+        reads           int             Number of fragments
+        read_length     int             Length of each read
+        insert_size     int             Length of each fragment
+        duplicate_rate  float           Fraction of duplicated fragments
+        error_rate      float           Per-base error probability
+        paired          bool            Draw two mates per fragment
+        rng             Random          Random number generator
+
+    Return:
+                        Iterator        Reads sequences of each fragment
+
+    Example:
+    >>> next(simulate_fragments(genome, targets, 1, 4, 8, 0, 0, True, rng))
+    ['ACGT', 'TTAG']
+    """
+    insert_size = max(insert_size, read_length)
+    positions = []
+    for _ in range(reads):
+        if positions and rng.random() < duplicate_rate:
+            chrom, start = rng.choice(positions)
+        else:
+            chrom, target_start, target_end = rng.choice(targets)
+            start = rng.randrange(
+                max(0, target_start - insert_size + 1),
+                min(target_end, len(genome[chrom]) - insert_size + 1)
+            )
+            positions.append((chrom, start))
+
+        fragment = genome[chrom][start:start + insert_size]
+        mates = [fragment[:read_length]]
+        if paired:
+            mates.append(
+                fragment[-read_length:].translate(COMPLEMENT)[::-1]
+            )
+        yield [add_errors(mate, error_rate, rng) for mate in mates]
+
+
+def test_simulate_fragments() -> None:
+    """
+    This function tests the fragments drawing
+
+    Example:
+    pytest -v simulate_wes.py -k test_simulate_fragments
+    """
+    rng = random.Random(1)
+    genome = random_genome(10000, 1, rng)
+    targets = [("chr1", 5000, 5200)]
+    fragments = list(simulate_fragments(
+        genome, targets, 100, 50, 200, 0.5, 0, True, rng
+    ))
+    assert len(fragments) == 100
+    assert all(len(mate) == 50 for mates in fragments for mate in mates)
+    r1, r2 = fragments[0]
+    start = genome["chr1"].index(r1)
+    assert 4801 <= start < 5200
+    assert genome["chr1"][start + 150:start + 200] == (
+        r2.translate(COMPLEMENT)[::-1]
+    )
+    assert len(set(map(tuple, fragments))) < 80
+
+    single = next(simulate_fragments(
+        genome, targets, 1, 50, 200, 0, 0, False, rng
+    ))
+    assert len(single) == 1
+
+
+# Writing files
+def bgzf_compress(data: bytes, block_size: int = 65280) -> bytes:
+    """
+    Compress data in BGZF format, as bgzip does, so that the result can be
+    indexed with tabix or bcftools
+
+    Parameters:
+        data        bytes           Uncompressed data
+        block_size  int             Uncompressed size of each block
+
+    Return:
+                    bytes           BGZF compressed data
+
+    Example:
+    >>> gzip.decompress(bgzf_compress(b"ACGT"))
+    b'ACGT'
+    """
+    blocks = []
+    for offset in range(0, len(data), block_size):
+        chunk = data[offset:offset + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        blocks.append(
+            struct.pack(
+                "<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                len(deflated) + 25
+            )
+            + deflated
+            + struct.pack("<2I", zlib.crc32(chunk), len(chunk))
+        )
+    blocks.append(BGZF_EOF)
+    return b"".join(blocks)
+
+
+def test_bgzf_compress() -> None:
+    """
+    This function tests the BGZF compression
+
+    Example:
+    pytest -v simulate_wes.py -k test_bgzf_compress
+    """
+    data = b"ACGT\n" * 50000
+    compressed = bgzf_compress(data)
+    assert gzip.decompress(compressed) == data
+    assert compressed[12:14] == b"BC"
+    assert compressed.endswith(BGZF_EOF)
+
+
+def write_fasta(genome: Dict[str, str], path: Path, width: int = 60) -> None:
+    """
+    Write a fasta formatted genome sequence
+
+    Parameters:
+        genome      Dict[str, str]  Sequences, by contig name
+        path        Path            Path to the fasta file
+        width       int             Line width
+
+    Example:
+    >>> write_fasta({"chr1": "ACGT"}, Path("genome.fasta"))
+    """
+    with path.open("w") as fasta:
+        for name, sequence in genome.items():
+            fasta.write(f">{name}\n")
+            for offset in range(0, len(sequence), width):
+                fasta.write(f"{sequence[offset:offset + width]}\n")
+
+
+def write_vcf(sites: List[Tuple[str, int, str, str]],
+              genome: Dict[str, str],
+              path: Path) -> None:
+    """
+    Write bgzip compressed known sites
+
+    Parameters:
+        sites       List[Tuple]     Contig, 1-based position, ref and alt
+        genome      Dict[str, str]  Sequences, by contig name
+        path        Path            Path to the vcf.gz file
+
+    Example:
+    >>> write_vcf([("chr1", 3, "G", "T")], genome, Path("dbsnp.vcf.gz"))
+    """
+    lines = ["##fileformat=VCFv4.2"]
+    lines += [
+        f"##contig=<ID={name},length={len(sequence)}>"
+        for name, sequence in genome.items()
+    ]
+    lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO")
+    lines += [
+        f"{chrom}\t{position}\tsim{index}\t{ref}\t{alt}\t.\tPASS\t."
+        for index, (chrom, position, ref, alt) in enumerate(sites)
+    ]
+    path.write_bytes(bgzf_compress(("\n".join(lines) + "\n").encode()))
+
+
+def test_write_vcf(tmp_path) -> None:
+    """
+    This function tests the known sites writing
+
+    Example:
+    pytest -v simulate_wes.py -k test_write_vcf
+    """
+    path = tmp_path / "dbsnp.vcf.gz"
+    write_vcf([("chr1", 3, "G", "T")], {"chr1": "ACGT"}, path)
+    lines = gzip.decompress(path.read_bytes()).decode().split("\n")
+    assert lines[1] == "##contig=<ID=chr1,length=4>"
+    assert lines[3] == "chr1\t3\tsim0\tG\tT\t.\tPASS\t."
+
+
+def write_reads(fragments: Iterator[List[str]],
+                sample: str,
+                paths: List[Path]) -> int:
+    """
+    Write the simulated reads of a sample, one fastq file per mate
+
+    Parameters:
+        fragments   Iterator        Reads sequences of each fragment
+        sample      str             Sample name, used in reads names
+        paths       List[Path]      Paths to the fastq.gz files
+
+    Return:
+                    int             Number of reads written
+
+    Example:
+    >>> write_reads(fragments, "s1", [Path("s1_R1.fastq.gz")])
+    1000
+    """
+    streams = [gzip.open(path, "wt", compresslevel=1) for path in paths]
+    count = 0
+    try:
+        for index, mates in enumerate(fragments):
+            for stream, mate in zip(streams, mates):
+                stream.write(
+                    f"@{sample}.{index}\n{mate}\n+\n{'F' * len(mate)}\n"
+                )
+                count += 1
+    finally:
+        for stream in streams:
+            stream.close()
+    return count
+
+
+def test_write_reads(tmp_path) -> None:
+    """
+    This function tests the fastq writing
+
+    Example:
+    pytest -v simulate_wes.py -k test_write_reads
+    """
+    paths = [tmp_path / "s1_R1.fastq.gz", tmp_path / "s1_R2.fastq.gz"]
+    count = write_reads(iter([["AC", "GT"], ["CC", "GG"]]), "s1", paths)
+    assert count == 4
+    with gzip.open(paths[1], "rt") as fastq:
+        assert fastq.read() == "@s1.0\nGT\n+\nFF\n@s1.1\nGG\n+\nFF\n"
+
+
+def simulate(args: argparse.ArgumentParser) -> Dict[str, Any]:
+    """
+    Build the whole dataset and return the simulation manifest
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Return:
+                Dict[str, Any]      Simulation parameters and reads counts
+
+    Example:
+    >>> simulate(parse_args(shlex.split("--samples 1 --reads 10")))
+    {'parameters': {...}, 'samples': {'sim1': 10}}
+    """
+    rng = random.Random(args.seed)
+    output = Path(args.output_dir)
+    (output / "genome").mkdir(parents=True, exist_ok=True)
+    (output / "reads").mkdir(parents=True, exist_ok=True)
+
+    genome = random_genome(args.genome_size, args.contigs, rng)
+    write_fasta(genome, output / "genome" / "genome.fasta")
+
+    targets = random_targets(genome, args.targets, args.target_length, rng)
+    with (output / "genome" / "targets.bed").open("w") as bed:
+        for chrom, start, end in targets:
+            bed.write(f"{chrom}\t{start}\t{end}\n")
+
+    sites = random_known_sites(genome, targets, args.known_sites, rng)
+    write_vcf(sites, genome, output / "genome" / "dbsnp.vcf.gz")
+
+    manifest = {"parameters": vars(args), "samples": {}}
+    mates = ["R1"] if args.single else ["R1", "R2"]
+    design = ["\t".join(
+        ["Sample_id", "Upstream_file"]
+        + ([] if args.single else ["Downstream_file"])
+    )]
+    for index in range(args.samples):
+        sample = f"sim{index + 1}"
+        paths = [
+            (output / "reads" / f"{sample}_{mate}.fastq.gz").absolute()
+            for mate in mates
+        ]
+        fragments = simulate_fragments(
+            genome, targets, args.reads, args.read_length, args.insert_size,
+            args.duplicate_rate, args.error_rate, not args.single, rng
+        )
+        manifest["samples"][sample] = write_reads(fragments, sample, paths)
+        design.append("\t".join([sample] + [str(path) for path in paths]))
+        logger.info(
+            "%s reads simulated for %s", manifest["samples"][sample], sample
+        )
+
+    (output / "design.tsv").write_text("\n".join(design) + "\n")
+    with (output / "simulation.json").open("w") as stream:
+        json.dump(manifest, stream, indent=2, sort_keys=True)
+    return manifest
+
+
+def test_simulate(tmp_path) -> None:
+    """
+    This function tests the whole dataset building
+
+    Example:
+    pytest -v simulate_wes.py -k test_simulate
+    """
+    args = parse_args(shlex.split(
+        f"--output-dir {tmp_path} --samples 2 --reads 50 --genome-size 20000 "
+        "--targets 10 --known-sites 5"
+    ))
+    manifest = simulate(args)
+    assert manifest["samples"] == {"sim1": 100, "sim2": 100}
+    design = (tmp_path / "design.tsv").read_text().split("\n")
+    assert design[0] == "Sample_id\tUpstream_file\tDownstream_file"
+    assert design[1].startswith(f"sim1\t{tmp_path}/reads/sim1_R1.fastq.gz")
+    assert len((tmp_path / "genome" / "targets.bed").read_text().split()) == 30
+    assert (tmp_path / "simulation.json").exists()
+
+    first = (tmp_path / "reads" / "sim1_R1.fastq.gz").read_bytes()
+    simulate(args)
+    assert gzip.decompress(first) == gzip.decompress(
+        (tmp_path / "reads" / "sim1_R1.fastq.gz").read_bytes()
+    )
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("--samples 1"))
+    Namespace(contigs=3, debug=False, duplicate_rate=0.1, error_rate=0.001,
+    genome_size=3000000, insert_size=300, known_sites=1000,
+    output_dir='benchmark', quiet=False, read_length=150, reads=100000,
+    samples=1, seed=42, single=False, target_length=200, targets=2000)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    main_parser.add_argument(
+        "-o", "--output-dir",
+        help="Path to output directory (default: %(default)s)",
+        type=str,
+        default="benchmark"
+    )
+
+    main_parser.add_argument(
+        "--samples",
+        help="Number of samples (default: %(default)s)",
+        type=int,
+        default=2
+    )
+
+    main_parser.add_argument(
+        "--genome-size",
+        help="Total length of the genome (default: %(default)s)",
+        type=int,
+        default=3000000
+    )
+
+    main_parser.add_argument(
+        "--contigs",
+        help="Number of contigs in the genome (default: %(default)s)",
+        type=int,
+        default=3
+    )
+
+    main_parser.add_argument(
+        "--targets",
+        help="Number of capture targets (default: %(default)s)",
+        type=int,
+        default=2000
+    )
+
+    main_parser.add_argument(
+        "--target-length",
+        help="Length of each capture target (default: %(default)s)",
+        type=int,
+        default=200
+    )
+
+    main_parser.add_argument(
+        "--known-sites",
+        help="Number of known variants (default: %(default)s)",
+        type=int,
+        default=1000
+    )
+
+    main_parser.add_argument(
+        "--reads",
+        help="Number of fragments per sample (default: %(default)s)",
+        type=int,
+        default=100000
+    )
+
+    main_parser.add_argument(
+        "--read-length",
+        help="Length of each read (default: %(default)s)",
+        type=int,
+        default=150
+    )
+
+    main_parser.add_argument(
+        "--insert-size",
+        help="Length of each fragment (default: %(default)s)",
+        type=int,
+        default=300
+    )
+
+    main_parser.add_argument(
+        "--duplicate-rate",
+        help="Fraction of duplicated fragments (default: %(default)s)",
+        type=float,
+        default=0.1
+    )
+
+    main_parser.add_argument(
+        "--error-rate",
+        help="Per-base sequencing error rate (default: %(default)s)",
+        type=float,
+        default=0.001
+    )
+
+    main_parser.add_argument(
+        "--single",
+        help="Simulate single ended reads",
+        default=False,
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--seed",
+        help="Random seed (default: %(default)s)",
+        type=int,
+        default=42
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v simulate_wes.py -k test_parse_args
+    """
+    options = parse_args(shlex.split("--samples 1 --single"))
+    expected = argparse.Namespace(
+        contigs=3,
+        debug=False,
+        duplicate_rate=0.1,
+        error_rate=0.001,
+        genome_size=3000000,
+        insert_size=300,
+        known_sites=1000,
+        output_dir="benchmark",
+        quiet=False,
+        read_length=150,
+        reads=100000,
+        samples=1,
+        seed=42,
+        single=True,
+        target_length=200,
+        targets=2000
+    )
+    assert options == expected
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Simulating exome sequencing data")
+        simulate(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)
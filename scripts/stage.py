@@ -0,0 +1,654 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script stages an input file (fastq, fasta, vcf) in the working
+directory of the wes-mapping-bwa-gatk pipeline
+
+Files lying on hot storage are not copied: they are hardlinked, reflinked
+or symlinked, in this order of preference. Files lying under a cold storage
+mount point are copied in parallel chunks. Each chunk is flushed to the
+storage, dropped from the page cache, then read back and verified against
+the checksum of the source bytes. The chosen strategy and the number of
+bytes moved are logged for each file.
+
+The staged bytes may also be streamed, in file order, to the standard
+input of a command, e.g. a quality control tool, so that the file is not
+read a second time to be controlled.
+
+You can test this script with:
+pytest -v ./stage.py
+
+Usage example:
+# Stage a fastq file, /mnt being cold storage
+python3.8 ./stage.py /mnt/run/sample_R1.fq.gz raw_data/sample_R1.fq.gz \
+    --cold-storage /mnt --threads 4
+
+# Stage a fastq file and control its quality with fastp at the same time
+python3.8 ./stage.py /mnt/run/sample_R1.fq.gz raw_data/sample_R1.fq.gz \
+    --cold-storage /mnt --threads 4 \
+    --tee "gzip -cdf | fastp --stdin --json sample_R1.fastp.json"
+"""
+
+import argparse             # Parse command line
+import fcntl                # Reflinks
+import hashlib              # Checksums
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import subprocess           # Staged bytes consumer
+import sys                  # System related methods
+import time                 # Timings
+
+from collections import deque                      # Chunks copy window
+from concurrent.futures import ThreadPoolExecutor  # Parallel chunks copy
+from pathlib import Path                           # Paths related methods
+from typing import Any, Callable, List, Optional, Tuple   # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+# ioctl request cloning a whole file on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Hot storage strategies, by order of preference
+LINK_STRATEGIES = ["hardlink", "reflink", "symlink"]
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.verbose and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+# Storage detection
+def is_cold(source: Path, cold_storage: List[str]) -> bool:
+    """
+    Return True if the source file lies under a cold storage mount point
+
+    Parameters:
+        source          Path        Path to the file to stage
+        cold_storage    List[str]   Cold storage mount points
+
+    Return:
+                        bool        Whether the file is on cold storage
+
+    Example:
+    >>> is_cold(Path("/mnt/run/sample.fq"), ["/mnt"])
+    True
+    """
+    real = Path(os.path.realpath(source))
+    for mount in cold_storage:
+        if mount in ("NONE", "None", ""):
+            continue
+        mount = Path(os.path.realpath(mount))
+        if real == mount or mount in real.parents:
+            return True
+    return False
+
+
+def test_is_cold(tmp_path) -> None:
+    """
+    This function tests cold storage detection
+
+    Example:
+    pytest -v stage.py -k test_is_cold
+    """
+    cold = tmp_path / "cold"
+    cold.mkdir()
+    assert is_cold(cold / "sample.fq", [str(cold)]) is True
+    assert is_cold(tmp_path / "cold2" / "sample.fq", [str(cold)]) is False
+    assert is_cold(tmp_path / "sample.fq", ["None"]) is False
+
+
+# Hot storage: zero-copy strategies
+def reflink(source: Path, destination: Path) -> None:
+    """
+    Clone the source file into the destination, sharing data blocks
+
+    Parameters:
+        source          Path    Path to the file to stage
+        destination     Path    Path to the staged file
+
+    Example:
+    >>> reflink(Path("/data/sample.fq"), Path("raw_data/sample.fq"))
+    """
+    with source.open("rb") as src, destination.open("wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            destination.unlink()
+            raise
+
+
+def link(source: Path, destination: Path, strategy: str) -> None:
+    """
+    Stage a file with the given zero-copy strategy
+
+    Parameters:
+        source          Path    Path to the file to stage
+        destination     Path    Path to the staged file
+        strategy        str     One of hardlink, reflink or symlink
+
+    Example:
+    >>> link(Path("/data/sample.fq"), Path("raw_data/sample.fq"), "symlink")
+    """
+    if strategy == "hardlink":
+        os.link(source, destination)
+    elif strategy == "reflink":
+        reflink(source, destination)
+    elif strategy == "symlink":
+        destination.symlink_to(os.path.realpath(source))
+    else:
+        raise ValueError(f"Unknown staging strategy: {strategy}")
+
+
+def stream(source: Path,
+           sink: Callable[[bytes], Any],
+           block_size: int = 8 * 1024 * 1024) -> None:
+    """
+    Read a file sequentially, and hand each block to the sink
+
+    Parameters:
+        source          Path        Path to the file to read
+        sink            Callable    Function receiving the bytes read
+        block_size      int         Read size, in bytes
+
+    Example:
+    >>> stream(Path("/data/sample.fq"), process.stdin.write)
+    """
+    with source.open("rb") as src:
+        for block in iter(lambda: src.read(block_size), b""):
+            sink(block)
+
+
+# Cold storage: parallel, verified copy
+def copy_chunk(source: Path,
+               destination: Path,
+               offset: int,
+               size: int) -> bytes:
+    """
+    Copy one chunk of a file, and verify the written bytes against the
+    checksum of the bytes read. Written bytes are flushed and dropped from
+    the page cache before being read back, so that they come from the
+    storage, where the operating system supports it.
+
+    Parameters:
+        source          Path    Path to the file to stage
+        destination     Path    Path to the pre-allocated staged file
+        offset          int     Chunk start, in bytes
+        size            int     Chunk size, in bytes
+
+    Return:
+                        bytes   The copied bytes
+
+    Example:
+    >>> copy_chunk(Path("/mnt/sample.fq"), Path("raw_data/sample.fq"), 0, 4)
+    b'@r1\n'
+    """
+    src = os.open(source, os.O_RDONLY)
+    dst = os.open(destination, os.O_RDWR)
+    try:
+        data = os.pread(src, size, offset)
+        expected = hashlib.sha256(data).digest()
+        written = 0
+        while written < len(data):
+            written += os.pwrite(dst, data[written:], offset + written)
+
+        os.fdatasync(dst)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(dst, offset, len(data), os.POSIX_FADV_DONTNEED)
+        copied = os.pread(dst, len(data), offset)
+        if hashlib.sha256(copied).digest() != expected:
+            raise IOError(
+                f"Checksum mismatch in {destination} at offset {offset}"
+            )
+        return data
+    finally:
+        os.close(src)
+        os.close(dst)
+
+
+def parallel_copy(source: Path,
+                  destination: Path,
+                  threads: int = 1,
+                  chunk_size: int = 64 * 1024 * 1024,
+                  sink: Optional[Callable[[bytes], Any]] = None) -> int:
+    """
+    Copy a file in parallel chunks, each of them being verified. Copied
+    chunks are collected in file order, and handed to the sink if any,
+    while the following chunks are being copied.
+
+    Parameters:
+        source          Path        Path to the file to stage
+        destination     Path        Path to the staged file
+        threads         int         Number of chunks copied at the same time
+        chunk_size      int         Chunk size, in bytes
+        sink            Callable    Function receiving the copied bytes
+
+    Return:
+                        int     Number of bytes copied
+
+    Example:
+    >>> parallel_copy(Path("/mnt/sample.fq"), Path("raw_data/sample.fq"), 4)
+    123456789
+    """
+    total = source.stat().st_size
+    with destination.open("wb") as dst:
+        dst.truncate(total)
+
+    # At most two chunks per thread are held in memory
+    window = 2 * max(threads, 1)
+    copied, pending = 0, deque()
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        for offset in range(0, total, chunk_size):
+            pending.append(executor.submit(
+                copy_chunk, source, destination, offset,
+                min(chunk_size, total - offset)
+            ))
+            while len(pending) >= window or (
+                    offset + chunk_size >= total and pending):
+                data = pending.popleft().result()
+                copied += len(data)
+                if sink is not None:
+                    sink(data)
+
+    if copied != total:
+        raise IOError(f"Copied {copied} bytes out of {total} for {source}")
+    os.chmod(destination, source.stat().st_mode & 0o777)
+    return copied
+
+
+def test_parallel_copy(tmp_path) -> None:
+    """
+    This function tests the chunked copy with a chunk size that does not
+    divide the file size
+
+    Example:
+    pytest -v stage.py -k test_parallel_copy
+    """
+    source = tmp_path / "sample.fq"
+    source.write_bytes(bytes(range(256)) * 41)
+    destination = tmp_path / "raw_data.fq"
+    copied = parallel_copy(source, destination, threads=3, chunk_size=1000)
+    assert copied == 256 * 41
+    assert destination.read_bytes() == source.read_bytes()
+
+    # The sink receives every chunk, in file order
+    received = []
+    parallel_copy(source, destination, 2, 1000, received.append)
+    assert b"".join(received) == source.read_bytes()
+    assert len(received) == 11
+
+
+def test_copy_chunk_corrupted(tmp_path, monkeypatch) -> None:
+    """
+    This function tests that a chunk read back with other bytes than the
+    ones read from the source fails the copy
+
+    Example:
+    pytest -v stage.py -k test_copy_chunk_corrupted
+    """
+    import pytest
+
+    source = tmp_path / "sample.fq"
+    source.write_bytes(b"@r1\nACGT\n+\nIIII\n")
+    destination = tmp_path / "raw_data.fq"
+    destination.write_bytes(bytes(source.stat().st_size))
+
+    # The source is read first, then the destination is read back
+    reads, pread = [], os.pread
+
+    def corrupted_pread(fd: int, size: int, offset: int) -> bytes:
+        reads.append(fd)
+        data = pread(fd, size, offset)
+        return data if len(reads) == 1 else data[::-1]
+
+    monkeypatch.setattr(os, "pread", corrupted_pread)
+
+    with pytest.raises(IOError, match="Checksum mismatch"):
+        copy_chunk(source, destination, 0, source.stat().st_size)
+
+
+# Staging
+def stage(source: Path,
+          destination: Path,
+          cold_storage: List[str],
+          strategy: str = "auto",
+          threads: int = 1,
+          chunk_size: int = 64 * 1024 * 1024,
+          sink: Optional[Callable[[bytes], Any]] = None) -> Tuple[str, int]:
+    """
+    Stage a file, choosing the cheapest strategy allowed by its storage.
+    When a sink is given, it receives the staged bytes: copied chunks as
+    they are verified, or the whole linked file read once.
+
+    Parameters:
+        source          Path        Path to the file to stage
+        destination     Path        Path to the staged file
+        cold_storage    List[str]   Cold storage mount points
+        strategy        str         auto, copy, hardlink, reflink or symlink
+        threads         int         Number of chunks copied at the same time
+        chunk_size      int         Chunk size, in bytes
+        sink            Callable    Function receiving the staged bytes
+
+    Return:
+                        Tuple[str, int]     Used strategy, bytes moved
+
+    Example:
+    >>> stage(Path("/data/s.fq"), Path("raw_data/s.fq"), ["/mnt"])
+    ('hardlink', 0)
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists() or destination.is_symlink():
+        destination.unlink()
+
+    if strategy == "auto":
+        strategies = (
+            ["copy"] if is_cold(source, cold_storage) else LINK_STRATEGIES
+        )
+    else:
+        strategies = [strategy]
+
+    for candidate in strategies:
+        if candidate == "copy":
+            return "copy", parallel_copy(
+                source, destination, threads, chunk_size, sink
+            )
+        try:
+            link(source, destination, candidate)
+        except OSError as error:
+            if strategy != "auto":
+                raise
+            logger.debug(f"Could not {candidate} {source}: {error}")
+            continue
+
+        if sink is not None:
+            stream(source, sink)
+        return candidate, 0
+
+    # Every zero-copy strategy failed (e.g. no symlink support)
+    return "copy", parallel_copy(
+        source, destination, threads, chunk_size, sink
+    )
+
+
+def test_stage(tmp_path) -> None:
+    """
+    This function tests the strategy selection
+
+    Example:
+    pytest -v stage.py -k test_stage
+    """
+    hot = tmp_path / "hot"
+    cold = tmp_path / "cold"
+    hot.mkdir()
+    cold.mkdir()
+    (hot / "s.fq").write_text("@r\nACGT\n+\nIIII\n")
+    (cold / "s.fq").write_text("@r\nACGT\n+\nIIII\n")
+
+    strategy, moved = stage(hot / "s.fq", tmp_path / "a.fq", [str(cold)])
+    assert (strategy, moved) == ("hardlink", 0)
+    assert (tmp_path / "a.fq").read_text() == "@r\nACGT\n+\nIIII\n"
+
+    strategy, moved = stage(cold / "s.fq", tmp_path / "b.fq", [str(cold)])
+    assert (strategy, moved) == ("copy", 15)
+    assert not (tmp_path / "b.fq").is_symlink()
+
+    strategy, moved = stage(
+        hot / "s.fq", tmp_path / "c.fq", [str(cold)], strategy="symlink"
+    )
+    assert (strategy, moved) == ("symlink", 0)
+    assert (tmp_path / "c.fq").is_symlink()
+
+    for source in [hot / "s.fq", cold / "s.fq"]:
+        received = []
+        stage(source, tmp_path / "d.fq", [str(cold)], sink=received.append)
+        assert b"".join(received) == b"@r\nACGT\n+\nIIII\n"
+
+
+def tee_stage(command: str, **kwargs: Any) -> Tuple[str, int]:
+    """
+    Stage a file while streaming its bytes to the standard input of a
+    shell command. The command has to succeed for the staging to succeed.
+
+    Parameters:
+        command         str         A shell command reading its stdin
+        kwargs          Any         Arguments of the stage function
+
+    Return:
+                        Tuple[str, int]     Used strategy, bytes moved
+
+    Example:
+    >>> tee_stage("wc -c > size.txt", source=Path("/mnt/s.fq"),
+    ...           destination=Path("raw_data/s.fq"), cold_storage=["/mnt"])
+    ('copy', 15)
+    """
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+    try:
+        result = stage(sink=process.stdin.write, **kwargs)
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        process.stdin.close()
+
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return result
+
+
+def test_tee_stage(tmp_path) -> None:
+    """
+    This function tests the staging with a command reading staged bytes
+
+    Example:
+    pytest -v stage.py -k test_tee_stage
+    """
+    # pytest is not available within tools environments
+    import pytest
+
+    cold = tmp_path / "cold"
+    cold.mkdir()
+    (cold / "s.fq").write_text("@r\nACGT\n+\nIIII\n")
+    size = tmp_path / "size.txt"
+
+    strategy, moved = tee_stage(
+        f"wc -c > {size}", source=cold / "s.fq",
+        destination=tmp_path / "s.fq", cold_storage=[str(cold)]
+    )
+    assert (strategy, moved) == ("copy", 15)
+    assert size.read_text().strip() == "15"
+
+    with pytest.raises(subprocess.CalledProcessError):
+        tee_stage(
+            "cat > /dev/null; exit 3", source=cold / "s.fq",
+            destination=tmp_path / "s.fq", cold_storage=[str(cold)]
+        )
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("/mnt/s.fq raw_data/s.fq --cold-storage /mnt"))
+    Namespace(chunk_size=64, cold_storage=['/mnt'],
+    destination='raw_data/s.fq', quiet=False, source='/mnt/s.fq',
+    strategy='auto', tee=None, threads=1, verbose=False)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    main_parser.add_argument(
+        "source",
+        help="Path to the file to stage",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "destination",
+        help="Path to the staged file",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "--cold-storage",
+        help="Path to cold storage mount points (default: %(default)s)",
+        type=str,
+        default=["None"],
+        nargs="+"
+    )
+
+    main_parser.add_argument(
+        "--strategy",
+        help="Staging strategy, auto chooses it from the storage "
+             "(default: %(default)s)",
+        type=str,
+        choices=["auto", "copy"] + LINK_STRATEGIES,
+        default="auto"
+    )
+
+    main_parser.add_argument(
+        "-t", "--threads",
+        help="Number of chunks copied in parallel (default: %(default)s)",
+        type=int,
+        default=1
+    )
+
+    main_parser.add_argument(
+        "--chunk-size",
+        help="Size of copied chunks, in MiB (default: %(default)s)",
+        type=int,
+        default=64
+    )
+
+    main_parser.add_argument(
+        "--tee",
+        help="Shell command receiving the staged bytes on its standard "
+             "input, e.g. a quality control tool (default: %(default)s)",
+        type=str,
+        default=None
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-v", "--verbose",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v stage.py -k test_parse_args
+    """
+    options = parse_args(shlex.split(
+        "/mnt/s.fq raw_data/s.fq --cold-storage /mnt --verbose"
+    ))
+    expected = argparse.Namespace(
+        chunk_size=64,
+        cold_storage=["/mnt"],
+        destination="raw_data/s.fq",
+        quiet=False,
+        source="/mnt/s.fq",
+        strategy="auto",
+        tee=None,
+        threads=1,
+        verbose=True
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    This function stages the file and logs what has been done
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Example:
+    >>> main(parse_args(shlex.split("/mnt/s.fq raw_data/s.fq")))
+    """
+    start = time.time()
+    options = {
+        "source": Path(args.source),
+        "destination": Path(args.destination),
+        "cold_storage": args.cold_storage,
+        "strategy": args.strategy,
+        "threads": args.threads,
+        "chunk_size": args.chunk_size * 1024 * 1024
+    }
+    if args.tee is None:
+        strategy, moved = stage(**options)
+    else:
+        strategy, moved = tee_stage(args.tee, **options)
+    elapsed = time.time() - start
+    logger.info(
+        f"Staged {args.source} -> {args.destination}: "
+        f"strategy={strategy} bytes_moved={moved} "
+        f"seconds={elapsed:.2f} "
+        f"MiB/s={moved / 1048576 / max(elapsed, 1e-6):.1f}"
+    )
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Staging file")
+        main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)
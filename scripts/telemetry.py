@@ -0,0 +1,944 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script records and summarizes the resources usage of pipeline jobs
+
+The record subcommand samples, at a fixed interval, the process tree of a
+job: CPU time, time spent waiting for block IO, resident memory, bytes
+read and written, and open files. It stops by itself when the job ends,
+or cleanly when the job terminates it on exit.
+Only the Linux /proc file system is read, no tool is required.
+
+The summarize subcommand turns the per-job samples, expected under
+telemetry/{rule}/, into per-stage utilisation and per-job timelines. Each
+stage is reported as CPU, memory or IO bound, or as idle when none of its
+resources is saturated. Reads counts, taken from a simulation manifest or
+from Picard alignment summaries, give reads processed per second.
+
+You can test this script with:
+pytest -v ./telemetry.py
+
+Usage example:
+# Sample a running job every 5 seconds
+python3.8 ./telemetry.py record --pid 1234 --interval 5 --threads 4 \
+    --mem-mb 8192 --output telemetry/bwa_mem/s1.tsv
+
+# Summarize all jobs
+python3.8 ./telemetry.py summarize telemetry --stages stages.tsv \
+    --timeline timeline.tsv --simulation simulation.json
+"""
+
+import argparse             # Parse command line
+import csv                  # Read and write TSV files
+import json                 # Simulation manifests
+import logging              # Traces and loggings
+import logging.handlers     # Logging behaviour
+import os                   # OS related activities
+import shlex                # Lexical analysis
+import signal               # Termination by the sampled job
+import sys                  # System related methods
+import threading            # Stop request from the sampled job
+import time                 # Sampling clock
+
+from pathlib import Path                    # Paths related methods
+from typing import Any, Dict, List, Tuple   # Type hints
+
+
+logger = logging.getLogger(
+    os.path.splitext(os.path.basename(sys.argv[0]))[0]
+)
+
+SAMPLE_COLUMNS = [
+    "time_s", "threads", "mem_mb", "cpu_s", "io_wait_s", "rss_mb",
+    "read_mb", "write_mb", "open_files", "processes"
+]
+STAGE_COLUMNS = [
+    "stage", "jobs", "wall_s", "cpu_s", "cpu_usage", "io_wait",
+    "max_rss_mb", "memory_usage", "read_mb", "write_mb", "max_open_files",
+    "reads_per_s", "bound"
+]
+TIMELINE_COLUMNS = [
+    "stage", "job", "time_s", "cpu_load", "rss_mb", "read_mb_s",
+    "write_mb_s", "open_files", "reads_per_s"
+]
+
+# Saturation thresholds used to tell what bounds a stage
+MEMORY_BOUND = 0.9
+CPU_BOUND = 0.75
+IO_BOUND = 0.25
+
+# Set when the sampled job asks its sampler to stop, before exiting
+STOP = threading.Event()
+
+
+# Building custom class for help formatter
+class CustomFormatter(argparse.RawDescriptionHelpFormatter,
+                      argparse.ArgumentDefaultsHelpFormatter):
+    """
+    This class is used only to allow line breaks in the documentation,
+    without breaking the classic argument formatting.
+    """
+    pass
+
+
+# Handling logging options
+# No tests for this function
+def setup_logging(args: argparse.ArgumentParser) -> None:
+    """
+    Configure logging behaviour
+    """
+    root = logging.getLogger("")
+    root.setLevel(logging.WARNING)
+    logger.setLevel(args.debug and logging.DEBUG or logging.INFO)
+    if not args.quiet:
+        ch = logging.StreamHandler()
+        ch.setFormatter(logging.Formatter(
+            "%(levelname)s [%(name)s]: %(message)s"
+        ))
+        root.addHandler(ch)
+
+
+def to_float(value: str) -> float:
+    """
+    Convert a TSV value, empty when not measured, into a float
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Reading the process tree
+def read_process(proc: Path, pid: int) -> Dict[str, int]:
+    """
+    Read the counters of one process. Counters which may not be read, e.g.
+    IO of a process owned by another user, are left to zero.
+
+    Parameters:
+        proc    Path                Path to the /proc file system
+        pid     int                 Process identifier
+
+    Return:
+                Dict[str, int]      State, parent pid, CPU and IO wait clock
+                                    ticks, resident pages, bytes read and
+                                    written, open files
+
+    Example:
+    >>> read_process(Path("/proc"), 1234)
+    {'state': 'S', 'ppid': 1, 'ticks': 1200, 'io_ticks': 3, 'rss_pages': 2048,
+     'read_bytes': 4096, 'write_bytes': 0, 'open_files': 5}
+    """
+    # The command name may hold spaces and parenthesis: fields are read
+    # after its closing parenthesis, starting at the process state
+    stat = (proc / str(pid) / "stat").read_text()
+    fields = stat[stat.rindex(")") + 2:].split()
+    process = {
+        "state": fields[0],
+        "ppid": int(fields[1]),
+        "ticks": int(fields[11]) + int(fields[12]),
+        "io_ticks": int(fields[39]) if len(fields) > 39 else 0,
+        "rss_pages": int(fields[21]),
+        "read_bytes": 0,
+        "write_bytes": 0,
+        "open_files": 0
+    }
+
+    try:
+        for line in (proc / str(pid) / "io").read_text().split("\n"):
+            key, _, value = line.partition(": ")
+            if key in ("read_bytes", "write_bytes"):
+                process[key] = int(value)
+    except OSError:
+        pass
+
+    try:
+        process["open_files"] = len(os.listdir(proc / str(pid) / "fd"))
+    except OSError:
+        pass
+
+    return process
+
+
+def fake_process(proc: Path, pid: int, ppid: int, state: str = "S",
+                 ticks: int = 0, rss_pages: int = 0,
+                 read_bytes: int = 0, open_files: int = 0) -> None:
+    """
+    Write a process in a fake /proc file system, for tests only
+    """
+    stat = [0] * 42
+    stat[1], stat[21], stat[39] = ppid, rss_pages, 1
+    stat[11] = stat[12] = ticks
+    (proc / str(pid) / "fd").mkdir(parents=True)
+    (proc / str(pid) / "stat").write_text(
+        f"{pid} (my job) {state} " + " ".join(map(str, stat[1:])) + "\n"
+    )
+    (proc / str(pid) / "io").write_text(
+        f"rchar: 1\nread_bytes: {read_bytes}\nwrite_bytes: 0\n"
+    )
+    for fd in range(open_files):
+        (proc / str(pid) / "fd" / str(fd)).touch()
+
+
+def test_read_process(tmp_path) -> None:
+    """
+    This function tests the process counters parsing
+
+    Example:
+    pytest -v telemetry.py -k test_read_process
+    """
+    fake_process(tmp_path, 10, 1, ticks=7, rss_pages=3, read_bytes=42,
+                 open_files=2)
+    assert read_process(tmp_path, 10) == {
+        "state": "S", "ppid": 1, "ticks": 14, "io_ticks": 1, "rss_pages": 3,
+        "read_bytes": 42, "write_bytes": 0, "open_files": 2
+    }
+
+
+def read_tree(proc: Path, root: int,
+              exclude: List[int] = []) -> Dict[int, Dict[str, int]]:
+    """
+    Read the counters of a process and all its running descendants
+
+    Parameters:
+        proc        Path                Path to the /proc file system
+        root        int                 Root process identifier
+        exclude     List[int]           Processes left out, with their
+                                        own descendants
+
+    Return:
+                    Dict[int, Dict]     Process counters, by pid
+
+    Example:
+    >>> read_tree(Path("/proc"), 1234)
+    {1234: {'ppid': 1, ...}, 1240: {'ppid': 1234, ...}}
+    """
+    processes = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            processes[int(entry.name)] = read_process(proc, int(entry.name))
+        except (OSError, ValueError, IndexError):
+            # Process ended while being read
+            continue
+
+    children = {}
+    for pid, process in processes.items():
+        children.setdefault(process["ppid"], []).append(pid)
+
+    # Ended processes not yet waited for by their parent are zombies
+    tree, pending = {}, [root] if root in processes else []
+    while pending:
+        pid = pending.pop()
+        if pid in exclude or processes[pid]["state"] == "Z":
+            continue
+        tree[pid] = processes[pid]
+        pending += children.get(pid, [])
+    return tree
+
+
+def test_read_tree(tmp_path) -> None:
+    """
+    This function tests the process tree walk
+
+    Example:
+    pytest -v telemetry.py -k test_read_tree
+    """
+    fake_process(tmp_path, 10, 1)
+    fake_process(tmp_path, 11, 10)
+    fake_process(tmp_path, 12, 11)
+    fake_process(tmp_path, 13, 10)
+    fake_process(tmp_path, 14, 10, state="Z")
+    fake_process(tmp_path, 20, 1)
+    (tmp_path / "self").mkdir()
+    assert sorted(read_tree(tmp_path, 10)) == [10, 11, 12, 13]
+    assert sorted(read_tree(tmp_path, 10, exclude=[11])) == [10, 13]
+    assert read_tree(tmp_path, 30) == {}
+
+
+# Sampling a job
+def running(proc: Path, pid: int) -> bool:
+    """
+    Return True when a process is running, neither ended nor zombie
+    """
+    try:
+        return read_process(proc, pid)["state"] != "Z"
+    except (OSError, ValueError, IndexError):
+        return False
+
+
+def sample(tree: Dict[int, Dict[str, int]],
+           seen: Dict[int, Dict[str, int]]) -> Dict[str, float]:
+    """
+    Sum the counters of a process tree. Cumulated counters (CPU time, IO
+    wait, bytes read and written) of ended processes are kept from the
+    last time they were seen, so that totals never decrease.
+
+    Parameters:
+        tree    Dict[int, Dict]     Current process counters, by pid
+        seen    Dict[int, Dict]     Last counters of all processes seen,
+                                    updated in place
+
+    Return:
+                Dict[str, float]    Job counters, in seconds and MB
+
+    Example:
+    >>> sample(read_tree(Path("/proc"), 1234), {})
+    {'cpu_s': 12.0, 'io_wait_s': 0.3, 'rss_mb': 512.0, 'read_mb': 1.5,
+     'write_mb': 0.0, 'open_files': 12, 'processes': 3}
+    """
+    seen.update(tree)
+    ticks, page = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE")
+    return {
+        "cpu_s": sum(p["ticks"] for p in seen.values()) / ticks,
+        "io_wait_s": sum(p["io_ticks"] for p in seen.values()) / ticks,
+        "rss_mb": sum(p["rss_pages"] for p in tree.values()) * page / 2**20,
+        "read_mb": sum(p["read_bytes"] for p in seen.values()) / 2**20,
+        "write_mb": sum(p["write_bytes"] for p in seen.values()) / 2**20,
+        "open_files": sum(p["open_files"] for p in tree.values()),
+        "processes": len(tree)
+    }
+
+
+def test_sample() -> None:
+    """
+    This function tests the process tree counters sum
+
+    Example:
+    pytest -v telemetry.py -k test_sample
+    """
+    ticks = os.sysconf("SC_CLK_TCK")
+
+    def process(cpu, read):
+        return {
+            "state": "R", "ppid": 1, "ticks": cpu * ticks, "io_ticks": 0,
+            "rss_pages": 0, "read_bytes": read * 2**20, "write_bytes": 0,
+            "open_files": 1
+        }
+
+    seen = {}
+    job = sample({10: process(1, 2), 11: process(3, 4)}, seen)
+    assert (job["cpu_s"], job["read_mb"], job["processes"]) == (4, 6, 2)
+
+    # Process 11 ended: its counters are kept, while process 10 goes on
+    job = sample({10: process(2, 2)}, seen)
+    assert (job["cpu_s"], job["read_mb"], job["processes"]) == (5, 6, 1)
+    assert job["open_files"] == 1
+
+
+def record(proc: Path, pid: int, output: Path, interval: float = 5,
+           threads: int = 1, mem_mb: int = 0) -> int:
+    """
+    Sample a job process tree into a TSV file, until its root process ends
+    or asks to stop. Rows are flushed as soon as they are sampled, so that
+    a killed job keeps its telemetry.
+
+    Parameters:
+        proc        Path    Path to the /proc file system
+        pid         int     Job root process identifier
+        output      Path    Path to the TSV file
+        interval    float   Seconds between two samples
+        threads     int     Threads reserved by the job
+        mem_mb      int     Memory reserved by the job, in MB
+
+    Return:
+                    int     Number of samples written
+
+    Example:
+    >>> record(Path("/proc"), 1234, Path("telemetry/bwa_mem/s1.tsv"))
+    12
+    """
+    # The sampler itself, and the shells starting it, are not measured
+    exclude, ancestor = [], os.getpid()
+    while ancestor not in (pid, 0, 1):
+        exclude.append(ancestor)
+        try:
+            ancestor = read_process(proc, ancestor)["ppid"]
+        except (OSError, ValueError, IndexError):
+            break
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    start, seen, samples = time.monotonic(), {}, 0
+    with output.open("w") as stream:
+        writer = csv.writer(stream, delimiter="\t", lineterminator="\n")
+        writer.writerow(SAMPLE_COLUMNS)
+        while running(proc, pid) and not STOP.is_set():
+            tree = read_tree(proc, pid, exclude)
+            if not tree:
+                break
+            job = sample(tree, seen)
+            writer.writerow([
+                round(time.monotonic() - start, 2), threads, mem_mb,
+                *(
+                    round(job[column], 2)
+                    for column in SAMPLE_COLUMNS[3:]
+                )
+            ])
+            stream.flush()
+            samples += 1
+
+            # Poll often enough to end with the job, not one interval later
+            deadline = time.monotonic() + interval
+            while time.monotonic() < deadline and running(proc, pid):
+                if STOP.is_set():
+                    break
+                time.sleep(min(0.2, interval))
+    logger.debug("%s samples written to %s", samples, output)
+    return samples
+
+
+def test_record(tmp_path) -> None:
+    """
+    This function tests the sampling of a job, on a short lived process
+
+    Example:
+    pytest -v telemetry.py -k test_record
+    """
+    import subprocess
+    job = subprocess.Popen(["sleep", "1"])
+    samples = record(Path("/proc"), job.pid, tmp_path / "job.tsv", 0.2, 2)
+    job.wait()
+    with (tmp_path / "job.tsv").open() as stream:
+        rows = list(csv.DictReader(stream, delimiter="\t"))
+    assert len(rows) == samples > 1
+    assert rows[0]["threads"] == "2"
+    assert rows[0]["processes"] == "1"
+    assert to_float(rows[-1]["time_s"]) >= to_float(rows[0]["time_s"])
+
+
+def test_record_terminated(tmp_path) -> None:
+    """
+    This function tests that a sampler terminated by its job exits cleanly,
+    with its samples written
+
+    Example:
+    pytest -v telemetry.py -k test_record_terminated
+    """
+    import subprocess
+    job = subprocess.Popen(["sleep", "30"])
+    sampler = subprocess.Popen([
+        sys.executable, __file__, "--quiet", "record", "--pid",
+        str(job.pid), "--interval", "0.1", "--output",
+        str(tmp_path / "job.tsv")
+    ])
+    time.sleep(1)
+    sampler.terminate()
+    assert sampler.wait(timeout=10) == 0
+    job.kill()
+    job.wait()
+    with (tmp_path / "job.tsv").open() as stream:
+        rows = list(csv.DictReader(stream, delimiter="\t"))
+    assert len(rows) > 1
+
+
+# Summarizing jobs
+def read_job(path: Path) -> List[Dict[str, float]]:
+    """
+    Read the samples of one job
+
+    Parameters:
+        path    Path                    Path to a job telemetry file
+
+    Return:
+                List[Dict[str, float]]  Samples, by column name
+
+    Example:
+    >>> read_job(Path("telemetry/bwa_mem/s1.tsv"))
+    [{'time_s': 0.0, 'threads': 4.0, ...}, ...]
+    """
+    with path.open() as stream:
+        return [
+            {column: to_float(value) for column, value in row.items()}
+            for row in csv.DictReader(stream, delimiter="\t")
+        ]
+
+
+def timeline(rows: List[Dict[str, float]],
+             reads: int = 0) -> List[Dict[str, float]]:
+    """
+    Turn the cumulated samples of a job into rates between samples. Reads
+    processed over time are estimated from bytes read, as a share of all
+    the bytes the job read.
+
+    Parameters:
+        rows    List[Dict[str, float]]  Samples of a job
+        reads   int                     Number of reads the job processed
+
+    Return:
+                List[Dict[str, float]]  Rates, by column name
+
+    Example:
+    >>> timeline([{"time_s": 0, "cpu_s": 0, "read_mb": 0, ...},
+                  {"time_s": 10, "cpu_s": 20, "read_mb": 100, ...}], 1000)
+    [{'time_s': 10, 'cpu_load': 2.0, 'read_mb_s': 10.0, ...,
+      'reads_per_s': 100.0}]
+    """
+    total_read = rows[-1]["read_mb"] if rows else 0
+    rates = []
+    for before, after in zip(rows, rows[1:]):
+        elapsed = after["time_s"] - before["time_s"]
+        if elapsed <= 0:
+            continue
+        read = after["read_mb"] - before["read_mb"]
+        rates.append({
+            "time_s": after["time_s"],
+            "cpu_load": round((after["cpu_s"] - before["cpu_s"]) / elapsed, 2),
+            "rss_mb": after["rss_mb"],
+            "read_mb_s": round(read / elapsed, 2),
+            "write_mb_s": round(
+                (after["write_mb"] - before["write_mb"]) / elapsed, 2
+            ),
+            "open_files": int(after["open_files"]),
+            "reads_per_s": (
+                round(reads * read / total_read / elapsed, 2)
+                if reads > 0 and total_read > 0 else ""
+            )
+        })
+    return rates
+
+
+def test_timeline() -> None:
+    """
+    This function tests the conversion of samples into rates
+
+    Example:
+    pytest -v telemetry.py -k test_timeline
+    """
+    def row(time_s, cpu_s, read_mb):
+        return {
+            "time_s": time_s, "cpu_s": cpu_s, "rss_mb": 10, "read_mb": read_mb,
+            "write_mb": 0, "open_files": 3
+        }
+
+    rates = timeline([row(0, 0, 0), row(10, 20, 40), row(20, 25, 100)], 1000)
+    assert [rate["cpu_load"] for rate in rates] == [2.0, 0.5]
+    assert [rate["read_mb_s"] for rate in rates] == [4.0, 6.0]
+    assert [rate["reads_per_s"] for rate in rates] == [40.0, 60.0]
+    assert timeline([row(0, 0, 0), row(10, 5, 0)])[0]["reads_per_s"] == ""
+    assert timeline([row(0, 0, 0)]) == []
+
+
+def bound(stage: Dict[str, float]) -> str:
+    """
+    Tell which resource bounds a stage: memory when jobs came close to the
+    memory they reserved, CPU when they kept their threads busy, IO when
+    they spent a large share of their time waiting for the disks. Stages
+    bound by none of these are idle: waiting on their inputs, on locks or
+    on too few threads.
+
+    Parameters:
+        stage   Dict[str, float]    Stage utilisation
+
+    Return:
+                str                 One of memory, cpu, io or idle
+
+    Example:
+    >>> bound({"memory_usage": 0.2, "cpu_usage": 0.95, "io_wait": 0.01})
+    'cpu'
+    """
+    if to_float(stage["memory_usage"]) >= MEMORY_BOUND:
+        return "memory"
+    if stage["cpu_usage"] >= CPU_BOUND:
+        return "cpu"
+    if stage["io_wait"] >= IO_BOUND:
+        return "io"
+    return "idle"
+
+
+def summarize(telemetry: Path, reads: Dict[str, int]) -> Tuple[
+        Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Aggregate job telemetry files per stage, and gather their timelines.
+    Reads per second are computed over the jobs named after a known
+    sample.
+
+    Parameters:
+        telemetry   Path                Path to the telemetry directory
+        reads       Dict[str, int]      Reads counts, by sample
+
+    Return:
+                    Dict[str, Dict]     Stages utilisation, by stage
+                    List[Dict]          Timelines rows of all jobs
+
+    Example:
+    >>> summarize(Path("telemetry"), {"sim1": 200000})
+    ({'bwa_mem': {'jobs': 1, 'wall_s': 60.0, ..., 'bound': 'cpu'}},
+     [{'stage': 'bwa_mem', 'job': 'sim1', 'time_s': 5.0, ...}, ...])
+    """
+    stages, timelines = {}, []
+    for stage in sorted(telemetry.iterdir()):
+        if not stage.is_dir():
+            continue
+        summary = {
+            "jobs": 0, "wall_s": 0.0, "cpu_s": 0.0, "io_wait_s": 0.0,
+            "reserved_s": 0.0, "max_rss_mb": 0.0, "memory_usage": "",
+            "read_mb": 0.0, "write_mb": 0.0, "max_open_files": 0
+        }
+        sample_reads, sample_wall = 0, 0.0
+        for path in sorted(stage.glob("*.tsv")):
+            rows = read_job(path)
+            if not rows:
+                continue
+            last = rows[-1]
+            summary["jobs"] += 1
+            summary["wall_s"] += last["time_s"]
+            summary["cpu_s"] += last["cpu_s"]
+            summary["io_wait_s"] += last["io_wait_s"]
+            summary["reserved_s"] += last["time_s"] * max(last["threads"], 1)
+            summary["read_mb"] += last["read_mb"]
+            summary["write_mb"] += last["write_mb"]
+            rss = max(row["rss_mb"] for row in rows)
+            summary["max_rss_mb"] = max(summary["max_rss_mb"], rss)
+            if last["mem_mb"] > 0:
+                summary["memory_usage"] = round(max(
+                    to_float(summary["memory_usage"]), rss / last["mem_mb"]
+                ), 2)
+            summary["max_open_files"] = max(
+                summary["max_open_files"],
+                int(max(row["open_files"] for row in rows))
+            )
+
+            job = path.stem
+            sample = job.split(".")[0]
+            if sample in reads:
+                sample_reads += reads[sample]
+                sample_wall += last["time_s"]
+            for rate in timeline(rows, reads.get(sample, 0)):
+                timelines.append({"stage": stage.name, "job": job, **rate})
+
+        if summary["jobs"] == 0:
+            continue
+        wall, reserved = summary.pop("wall_s"), summary.pop("reserved_s")
+        io_wait = summary.pop("io_wait_s")
+        summary = {
+            "jobs": summary["jobs"],
+            "wall_s": round(wall, 2),
+            "cpu_s": round(summary["cpu_s"], 2),
+            "cpu_usage": round(summary["cpu_s"] / reserved, 2)
+            if reserved > 0 else 0.0,
+            "io_wait": round(io_wait / wall, 2) if wall > 0 else 0.0,
+            "max_rss_mb": round(summary["max_rss_mb"], 2),
+            "memory_usage": summary["memory_usage"],
+            "read_mb": round(summary["read_mb"], 2),
+            "write_mb": round(summary["write_mb"], 2),
+            "max_open_files": summary["max_open_files"],
+            "reads_per_s": round(sample_reads / sample_wall, 2)
+            if sample_wall > 0 else ""
+        }
+        summary["bound"] = bound(summary)
+        stages[stage.name] = summary
+    return stages, timelines
+
+
+def test_summarize(tmp_path) -> None:
+    """
+    This function tests the aggregation per stage
+
+    Example:
+    pytest -v telemetry.py -k test_summarize
+    """
+    header = "\t".join(SAMPLE_COLUMNS) + "\n"
+    (tmp_path / "bwa_mem").mkdir()
+    (tmp_path / "bwa_mem" / "sim1.tsv").write_text(
+        header
+        + "0\t4\t1000\t0\t0\t100\t0\t0\t5\t2\n"
+        + "10\t4\t1000\t38\t0\t200\t50\t10\t6\t2\n"
+    )
+    (tmp_path / "gatk_bqsr").mkdir()
+    (tmp_path / "gatk_bqsr" / "sim1.tsv").write_text(
+        header
+        + "0\t1\t1000\t0\t0\t950\t0\t0\t5\t1\n"
+        + "20\t1\t1000\t4\t10\t950\t20\t20\t5\t1\n"
+    )
+    (tmp_path / "samtools_index").mkdir()
+    (tmp_path / "samtools_index" / "sim1.tsv").write_text(
+        header + "0\t1\t0\t0\t0\t0\t0\t0\t0\t1\n"
+    )
+    (tmp_path / "empty").mkdir()
+
+    stages, timelines = summarize(tmp_path, {"sim1": 1000})
+    assert list(stages) == ["bwa_mem", "gatk_bqsr", "samtools_index"]
+    assert stages["bwa_mem"]["cpu_usage"] == 0.95
+    assert stages["bwa_mem"]["memory_usage"] == 0.2
+    assert stages["bwa_mem"]["reads_per_s"] == 100
+    assert stages["bwa_mem"]["bound"] == "cpu"
+    assert stages["gatk_bqsr"]["bound"] == "memory"
+    assert stages["samtools_index"]["memory_usage"] == ""
+    assert stages["samtools_index"]["bound"] == "idle"
+    assert [row["stage"] for row in timelines] == ["bwa_mem", "gatk_bqsr"]
+    assert timelines[0]["reads_per_s"] == 100
+
+
+def test_bound() -> None:
+    """
+    This function tests the bounding resource of a stage
+
+    Example:
+    pytest -v telemetry.py -k test_bound
+    """
+    stage = {"memory_usage": "", "cpu_usage": 0.2, "io_wait": 0.5}
+    assert bound(stage) == "io"
+    stage["cpu_usage"] = 0.8
+    assert bound(stage) == "cpu"
+    stage["memory_usage"] = 0.95
+    assert bound(stage) == "memory"
+
+
+def read_alignment_summary(path: Path) -> int:
+    """
+    Return the total number of reads from a Picard alignment summary. The
+    PAIR category counts both mates, when reads are paired.
+
+    Parameters:
+        path    Path    Path to a Picard AlignmentSummaryMetrics file
+
+    Return:
+                int     Number of reads
+
+    Example:
+    >>> read_alignment_summary(Path("picard/stats/summary/s1_summary.txt"))
+    200000
+    """
+    header, categories = None, {}
+    for line in path.read_text().split("\n"):
+        if line.startswith("CATEGORY\t"):
+            header = line.split("\t")
+        elif header is not None and line.strip() == "":
+            break
+        elif header is not None:
+            row = dict(zip(header, line.split("\t")))
+            categories[row["CATEGORY"]] = int(row["TOTAL_READS"])
+    return categories.get("PAIR", categories.get("UNPAIRED", 0))
+
+
+def test_read_alignment_summary(tmp_path) -> None:
+    """
+    This function tests the Picard alignment summary parsing
+
+    Example:
+    pytest -v telemetry.py -k test_read_alignment_summary
+    """
+    path = tmp_path / "s1_summary.txt"
+    path.write_text(
+        "## METRICS CLASS\tpicard.analysis.AlignmentSummaryMetrics\n"
+        "CATEGORY\tTOTAL_READS\tPF_READS\n"
+        "FIRST_OF_PAIR\t100\t100\n"
+        "SECOND_OF_PAIR\t100\t100\n"
+        "PAIR\t200\t200\n"
+        "\n"
+    )
+    assert read_alignment_summary(path) == 200
+    path.write_text("CATEGORY\tTOTAL_READS\nUNPAIRED\t50\n")
+    assert read_alignment_summary(path) == 50
+
+
+def write_table(rows: List[Dict[str, Any]],
+                columns: List[str],
+                path: Path) -> None:
+    """
+    Write rows as a TSV file, with the given columns
+    """
+    with path.open("w") as stream:
+        writer = csv.DictWriter(
+            stream, fieldnames=columns, delimiter="\t", lineterminator="\n"
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args(args: Any = sys.argv[1:]) -> argparse.ArgumentParser:
+    """
+    Build a command line parser object
+
+    Parameters:
+        args    Any                 Command line arguments
+
+    Return:
+                ArgumentParser      Parsed command line object
+
+    Example:
+    >>> parse_args(shlex.split("record --pid 1234 --output s1.tsv"))
+    Namespace(debug=False, interval=5.0, mem_mb=0, output='s1.tsv',
+    pid=1234, quiet=False, subcommand='record', threads=1)
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=CustomFormatter,
+        epilog="Each tool belong to their respective authors"
+    )
+
+    subparsers = main_parser.add_subparsers(dest="subcommand")
+    subparsers.required = True
+
+    record_parser = subparsers.add_parser(
+        "record",
+        help="Sample the process tree of a job until it ends",
+        formatter_class=CustomFormatter
+    )
+    record_parser.add_argument(
+        "--pid",
+        help="Identifier of the job root process",
+        type=int,
+        required=True
+    )
+    record_parser.add_argument(
+        "--output",
+        help="Path to the job telemetry file",
+        type=str,
+        required=True
+    )
+    record_parser.add_argument(
+        "--interval",
+        help="Seconds between two samples",
+        type=float,
+        default=5.0
+    )
+    record_parser.add_argument(
+        "--threads",
+        help="Threads reserved by the job",
+        type=int,
+        default=1
+    )
+    record_parser.add_argument(
+        "--mem-mb",
+        help="Memory reserved by the job, in MB. 0 when unknown",
+        type=int,
+        default=0
+    )
+
+    summarize_parser = subparsers.add_parser(
+        "summarize",
+        help="Summarize jobs telemetry per stage",
+        formatter_class=CustomFormatter
+    )
+    summarize_parser.add_argument(
+        "telemetry",
+        help="Path to the telemetry directory",
+        type=str
+    )
+    summarize_parser.add_argument(
+        "--stages",
+        help="Path to the per-stage utilisation report",
+        type=str,
+        default="/dev/stdout"
+    )
+    summarize_parser.add_argument(
+        "--timeline",
+        help="Path to the per-job timelines",
+        type=str,
+        default=None
+    )
+    summarize_parser.add_argument(
+        "-s", "--simulation",
+        help="Path to the simulation manifest, used to count reads",
+        type=str,
+        default=None
+    )
+    summarize_parser.add_argument(
+        "--alignment-summaries",
+        help="Paths to Picard alignment summaries, named "
+             "{sample}_summary.txt, used to count reads",
+        type=str,
+        nargs="+",
+        default=[]
+    )
+
+    # Logging options
+    log = main_parser.add_mutually_exclusive_group()
+    log.add_argument(
+        "-d", "--debug",
+        help="Set logging in debug mode",
+        default=False,
+        action='store_true'
+    )
+
+    log.add_argument(
+        "-q", "--quiet",
+        help="Turn off logging behaviour",
+        default=False,
+        action='store_true'
+    )
+
+    return main_parser.parse_args(args)
+
+
+def test_parse_args() -> None:
+    """
+    This function tests the command line parsing
+
+    Example:
+    >>> pytest -v telemetry.py -k test_parse_args
+    """
+    options = parse_args(shlex.split(
+        "summarize telemetry --timeline timeline.tsv "
+        "--alignment-summaries s1_summary.txt"
+    ))
+    expected = argparse.Namespace(
+        alignment_summaries=["s1_summary.txt"],
+        debug=False,
+        quiet=False,
+        simulation=None,
+        stages="/dev/stdout",
+        subcommand="summarize",
+        telemetry="telemetry",
+        timeline="timeline.tsv"
+    )
+    assert options == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    This function performs the requested telemetry operation
+
+    Parameters:
+        args    ArgumentParser      The parsed command line
+
+    Example:
+    >>> main(parse_args(shlex.split("summarize telemetry")))
+    """
+    if args.subcommand == "record":
+        # Jobs terminate their sampler before exiting: the current sample
+        # is completed, then the sampler ends with its output closed
+        signal.signal(signal.SIGTERM, lambda signum, frame: STOP.set())
+        record(
+            proc=Path("/proc"),
+            pid=args.pid,
+            output=Path(args.output),
+            interval=args.interval,
+            threads=args.threads,
+            mem_mb=args.mem_mb
+        )
+    elif args.subcommand == "summarize":
+        reads = {}
+        if args.simulation is not None:
+            with open(args.simulation) as manifest:
+                reads = json.load(manifest)["samples"]
+        for path in args.alignment_summaries:
+            sample = Path(path).name[:-len("_summary.txt")]
+            reads[sample] = read_alignment_summary(Path(path))
+
+        stages, timelines = summarize(Path(args.telemetry), reads)
+        write_table(
+            [{"stage": name, **stage} for name, stage in stages.items()],
+            STAGE_COLUMNS,
+            Path(args.stages)
+        )
+        if args.timeline is not None:
+            write_table(timelines, TIMELINE_COLUMNS, Path(args.timeline))
+        for name, stage in stages.items():
+            logger.info("%s: %s bound", name, stage["bound"])
+
+
+if __name__ == '__main__':
+    # Parsing command line
+    args = parse_args()
+    setup_logging(args)
+
+    try:
+        logger.debug("Processing jobs telemetry")
+        main(args)
+    except Exception as e:
+        logger.exception("%s", e)
+        sys.exit(1)
+    sys.exit(0)